@@ -0,0 +1,445 @@
+import copy
+import io
+import random
+import re
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+import parser
+import syntaxtree
+import lowering
+import dce
+import induction
+import licm
+import pre
+import sccp
+import tokenizer
+from tokens import IRTokens, Tokens
+
+
+def TimeIt(func, repeat=3):
+    # best of repeat runs, in seconds
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def NestedProgram(depth):
+    # alternating while/if-else statements nested depth levels deep
+    body = "let a <- a + 1"
+    for i in range(depth):
+        if i % 2:
+            body = f"if a < {i} then {body} else let b <- a fi"
+        else:
+            body = f"while a < {i} do {body} od"
+    return "main var a, b; { let a <- 0; let b <- 0; " + body + " }."
+
+
+def ParenProgram(depth):
+    # one expression wrapped in depth parentheses
+    return "main var a; { let a <- 1; let a <- " + "(" * depth + "a + 1" + ")" * depth + " }."
+
+
+def StraightLineProgram(count, varCount=20, seed=1):
+    # count random assignments of two-operand expressions over varCount variables, with no control flow
+    rand = random.Random(seed)
+    idents = [f'v{i}' for i in range(varCount)]
+    statements = [f'let {ident} <- call InputNum()' for ident in idents]
+    for _ in range(count):
+        target, left, right = rand.choice(idents), rand.choice(idents), rand.choice(idents)
+        statements.append(f'let {target} <- {left} {rand.choice("+-*")} {right} + {rand.randint(0, 50)}')
+    return 'main var ' + ', '.join(idents) + '; { ' + '; '.join(statements) + ' }.'
+
+
+def BranchyProgram(count):
+    # count sequential if-else statements, three basic blocks each
+    statements = ['let a <- call InputNum()']
+    for i in range(count):
+        statements.append(f'if a < {i} then let b <- a + {i} else let b <- a - {i} fi')
+    return 'main var a, b; { ' + '; '.join(statements) + ' }.'
+
+
+def LoopProgram(count, varCount=10, seed=1):
+    # one while loop around count random assignments, so whilePhi has to revisit every instruction
+    rand = random.Random(seed)
+    idents = [f'v{i}' for i in range(varCount)]
+    statements = []
+    for _ in range(count):
+        target, left, right = rand.choice(idents), rand.choice(idents), rand.choice(idents)
+        statements.append(f'let {target} <- {left} {rand.choice("+-*")} {right} + {rand.randint(0, 50)}')
+    return ('main var ' + ', '.join(idents) + '; { ' + '; '.join(f'let {ident} <- call InputNum()' for ident in idents)
+            + '; while v0 < 1000 do ' + '; '.join(statements) + ' od; call OutputNum(v0) }.')
+
+
+def NestedLoopProgram(depth, varCount=5):
+    # depth while loops nested inside each other, each level reading and updating every variable
+    idents = [f'v{i}' for i in range(varCount)]
+    body = '; '.join(f'let {ident} <- {ident} + v0' for ident in idents)
+    for i in range(depth):
+        updates = '; '.join(f'let {ident} <- {ident} - {i}' for ident in idents)
+        body = f'while v{i % varCount} < {i} do {updates}; {body} od'
+    return ('main var ' + ', '.join(idents) + '; { ' + '; '.join(f'let {ident} <- call InputNum()' for ident in idents)
+            + '; ' + body + '; call OutputNum(v0) }.')
+
+
+def ConstantBranchProgram(count):
+    # BranchyProgram on a constant, so every branch can be resolved at compile time
+    statements = ['let a <- 7', 'let b <- 0']
+    for i in range(count):
+        statements.append(f'if a < {i} then let b <- b + a * {i} else let b <- b - {i} fi')
+    return 'main var a, b; { ' + '; '.join(statements) + '; call OutputNum(b) }.'
+
+
+def InvariantLoopProgram(depth, count=10):
+    # depth nested while loops, each adding count expressions of the inputs a and b to s
+    counters = [f'i{level}' for level in range(depth)]
+    body = 'let s <- s'
+    for level in reversed(range(depth)):
+        terms = ' + '.join(f'a * {k} - b * {level}' for k in range(count))
+        body = (f'let {counters[level]} <- 0; while {counters[level]} < 3 do let s <- s + {terms}; {body}; '
+                f'let {counters[level]} <- {counters[level]} + 1 od')
+    return ('main var a, b, s, ' + ', '.join(counters) + '; { let a <- call InputNum(); let b <- call InputNum(); '
+            'let s <- 0; ' + body + '; call OutputNum(s) }.')
+
+
+def ArrayLoopProgram(count, size=20):
+    # two nested while loops walking count arrays by index, each with its own row length
+    arrays = [f'a{k}' for k in range(count)]
+    body = '; '.join(f'let s <- s + {array}[i * {k + size} + j]' for k, array in enumerate(arrays))
+    return ('main ' + ' '.join(f'array[{size * (size + count)}] {array};' for array in arrays) + ' var i, j, s; { '
+            f'let s <- 0; let i <- 0; while i < {size} do let j <- 0; while j < {size} do {body}; let j <- j + 1 od; '
+            'let i <- i + 1 od; call OutputNum(s) }.')
+
+
+def PartialRedundancyProgram(count):
+    # every product is computed in the then-arm of an if without else and again after it
+    statements = ['let a <- call InputNum()', 'let b <- call InputNum()', 'let c <- 0', 'let d <- 0']
+    for i in range(count):
+        statements.append(f'if b < {i} then let c <- c + a * {i} fi')
+        statements.append(f'let d <- d + a * {i}')
+    return 'main var a, b, c, d; { ' + '; '.join(statements) + '; call OutputNum(c + d) }.'
+
+
+def BenchParser(depths=(50, 200, 400, 1000)):
+    """
+    Compares the recursive Parser and TreeBuilder against StackTreeBuilder on deeply nested programs.
+    Recursive front ends that exceed the recursion limit are reported as such.
+    """
+    frontEnds = [
+        ('recursive parser', lambda src: parser.ParseString(src)),
+        ('recursive tree', lambda src: lowering.LowerTree(syntaxtree.BuildTree(source=src))),
+        ('explicit stack tree', lambda src: lowering.LowerTree(syntaxtree.BuildTree(source=src, explicitStack=True))),
+    ]
+    print(f'recursion limit {sys.getrecursionlimit()}')
+    for name, generator in [('nested statements', NestedProgram), ('parentheses', ParenProgram)]:
+        for depth in depths:
+            source = generator(depth)
+            for frontEnd, compile in frontEnds:
+                try:
+                    with redirect_stdout(io.StringIO()):
+                        elapsed = TimeIt(lambda: compile(source), repeat=1 if depth > 400 else 3)
+                    result = f'{elapsed * 1000:10.2f} ms'
+                except RecursionError:
+                    result = '  RecursionError'
+                print(f'{name:18} depth {depth:5}  {frontEnd:20} {result}')
+
+
+def LexAll(lexer):
+    # tokens of a lexer up to the EOF or error token, with lastNum and lastId after each
+    tokens = []
+    while True:
+        token = lexer.GetNext()
+        tokens.append((token, lexer.lastNum, lexer.lastId))
+        if token == Tokens.eofToken or token == Tokens.errorToken:
+            return tokens
+
+
+def BenchLexers(counts=(5000, 20000)):
+    """
+    Tokenizer against BulkTokenizer on straight-line programs. Both have to give the same tokens, which
+    is checked first on programs with non-ASCII identifiers and whitespace and with literals past 64 bits.
+    """
+    samples = [
+        'main var \u00e9; { let \u00e9 <- 1; call OutputNum(\u00e9) }.',
+        'main var x\u00b2, \u00b2x; { let x\u00b2 <- 1 }.',
+        'main var a;\u00a0{ let a <- 99999999999999999999999 + 9223372036854775808 }.',
+    ]
+    for source in samples + [StraightLineProgram(100)]:
+        same = LexAll(tokenizer.Tokenizer(None, source=source)) == LexAll(tokenizer.BulkTokenizer(None, source=source))
+        print(f'{source[:40]!a:48} {"same tokens" if same else "DIFFERENT TOKENS"}')
+    for count in counts:
+        source = StraightLineProgram(count)
+        scalar = TimeIt(lambda: LexAll(tokenizer.Tokenizer(None, source=source)))
+        bulk = TimeIt(lambda: LexAll(tokenizer.BulkTokenizer(None, source=source)))
+        print(f'{count:6} expressions  Tokenizer {scalar * 1000:8.2f} ms  BulkTokenizer {bulk * 1000:8.2f} ms')
+
+
+def BenchCSE(counts=(1000, 5000, 10000, 20000)):
+    """
+    Compiles straight-line programs of increasing size. Every expression goes through
+    SSA.FindPreviousInst, so time per expression stays flat only if the CSE lookup does not
+    depend on how many instructions came before.
+    """
+    for count in counts:
+        source = StraightLineProgram(count)
+        with redirect_stdout(io.StringIO()):
+            elapsed = TimeIt(lambda: parser.ParseString(source), repeat=1)
+        print(f'{count:6} expressions  {elapsed * 1000:10.2f} ms  {elapsed * 1e6 / count:8.2f} us/expression')
+
+
+def BenchBlocks(counts=(300, 1000)):
+    """
+    Memory held by the compiled SSA for programs with thousands of basic blocks,
+    measured with tracemalloc while the compilation is still alive.
+    """
+    for count in counts:
+        source = BranchyProgram(count)
+        tracemalloc.start()
+        with redirect_stdout(io.StringIO()):
+            comp = parser.ParseString(source)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        blocks = len(comp.ssa.BBList)
+        print(f'{blocks:6} blocks  {current / 2 ** 20:8.2f} MiB retained  {peak / 2 ** 20:8.2f} MiB peak  '
+              f'{current / blocks:8.0f} bytes/block')
+        del comp
+
+
+def BenchInstructions(counts=(5000, 20000)):
+    """
+    Memory of the instruction store of compiled straight-line programs, measured by deep-copying
+    SSA.instructionList under tracemalloc (tuples of plain values are shared, not copied).
+    """
+    for count in counts:
+        source = StraightLineProgram(count)
+        with redirect_stdout(io.StringIO()):
+            comp = parser.ParseString(source)
+        tracemalloc.start()
+        insts = copy.deepcopy(comp.ssa.instructionList)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{len(insts):6} instructions  {current / 2 ** 20:8.2f} MiB  {current / len(insts):6.0f} bytes/instruction')
+        del comp, insts
+
+
+def BenchLoops(counts=(250, 500, 1000)):
+    """
+    Compiles a while loop whose body grows, which is dominated by the loop phi placement passes.
+    """
+    for count in counts:
+        source = LoopProgram(count)
+        with redirect_stdout(io.StringIO()):
+            elapsed = TimeIt(lambda: parser.ParseString(source), repeat=1)
+        print(f'{count:6} statements in loop  {elapsed * 1000:10.2f} ms')
+
+
+def BenchSealed(depths=(10, 20, 40, 80)):
+    """
+    Compiles nested while loops with the whilePhi passes and with sealed-block construction.
+    whilePhi revisits the whole body of every enclosing loop, sealing each header once does not.
+    """
+    for depth in depths:
+        source = NestedLoopProgram(depth)
+        for mode, sealed in [('whilePhi', False), ('sealed', True)]:
+            with redirect_stdout(io.StringIO()):
+                elapsed = TimeIt(lambda: parser.ParseString(source, sealedSSA=sealed), repeat=1)
+            print(f'{depth:4} nested loops  {mode:8} {elapsed * 1000:10.2f} ms')
+
+
+def BenchVariables(counts=(500, 2000), repeat=200):
+    """
+    Looks up the current value of every variable from the last block of a chain of if-else statements,
+    which sits below one join block per statement in the dominator tree.
+    """
+    for count in counts:
+        with redirect_stdout(io.StringIO()):
+            comp = parser.ParseString(BranchyProgram(count))
+        ssa = comp.ssa
+        idents = [symbol.ident for symbol in comp.symbols.GetSymbols()]
+        last = len(ssa.BBList) - 1
+
+        def LookUp():
+            for _ in range(repeat):
+                for ident in idents:
+                    ssa.GetVarVersion(ident, last)
+                    ssa.GetVarInstNode(ident, last)
+
+        elapsed = TimeIt(LookUp)
+        print(f'{count:6} if statements  {elapsed * 1e6 / (2 * repeat * len(idents)):8.2f} us/lookup')
+
+
+def BenchHistories(counts=(5000, 20000)):
+    """
+    Memory held by the value table histories of compiled straight-line programs, measured with
+    tracemalloc as what SSA.DropHistories gives back.
+    """
+    for count in counts:
+        source = StraightLineProgram(count)
+        tracemalloc.start()
+        with redirect_stdout(io.StringIO()):
+            comp = parser.ParseString(source)
+        entries = len(comp.ssa.histories)
+        before, _ = tracemalloc.get_traced_memory()
+        comp.ssa.DropHistories()
+        after, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{count:6} expressions  {entries:7} history entries  {before / 2 ** 20:8.2f} MiB retained  '
+              f'{(before - after) / 2 ** 20:8.2f} MiB in histories')
+        del comp
+
+
+def BenchUses(counts=(5000, 20000)):
+    """
+    Replaces all uses of every instruction of compiled straight-line programs by a fresh constant and back.
+    With def-use chains the time per use does not depend on the size of the program.
+    """
+    for count in counts:
+        with redirect_stdout(io.StringIO()):
+            comp = parser.ParseString(StraightLineProgram(count))
+        ssa = comp.ssa
+        store = ssa.instructionList
+        instIDs = [instID for instID in range(len(store)) if instID in store.users]
+        uses = sum(len(store.GetUsers(instID)) for instID in instIDs)
+        temp, _ = ssa.DefineIR(IRTokens.constToken, 0, -1)
+
+        def Replace():
+            for instID in instIDs:
+                ssa.ReplaceAllUses(instID, temp)
+                ssa.ReplaceAllUses(temp, instID)
+
+        elapsed = TimeIt(Replace, repeat=1)
+        print(f'{count:6} expressions  {uses:7} uses  {elapsed * 1e6 / (2 * uses):8.2f} us/use')
+
+
+def BenchIncremental(counts=(200, 800)):
+    """
+    IncrementalParser edits against compiling the edited program from scratch. An edit re-parses from
+    the top-level statement it is in to the end, so editing the last statement should cost a small
+    fraction of a full compile and editing the first about as much as one.
+    """
+    for name, generator in [('straight-line', StraightLineProgram), ('if-else', BranchyProgram)]:
+        for count in counts:
+            # one statement per line, Relex re-lexes the edited line
+            source = generator(count).replace('; ', ';\n')
+            literals = [match.span(1) for match in re.finditer(r'\+ (\d+)', source)]
+            with redirect_stdout(io.StringIO()):
+                full = TimeIt(lambda: parser.ParseString(source))
+                start = time.perf_counter()
+                incremental = parser.IncrementalParser(source)
+                setup = time.perf_counter() - start
+                edits = []
+                for begin, end in (literals[0], literals[len(literals) // 2], literals[-1]):
+                    edits.append(TimeIt(lambda: incremental.Edit(begin, end, '9' * (end - begin))))
+            print(f'{name:14} {count:5} statements  full {full * 1000:8.2f} ms  setup {setup * 1000:8.2f} ms  '
+                  f'edit first/middle/last ' + ' / '.join(f'{edit * 1000:.2f}' for edit in edits) + ' ms')
+
+
+def BenchDCE(counts=(250, 1000)):
+    """
+    Dead code elimination on loops of random assignments that only print one variable,
+    so most assigned values are overwritten or never used.
+    """
+    for count in counts:
+        with redirect_stdout(io.StringIO()):
+            comp = parser.ParseString(LoopProgram(count))
+        before = sum(len(block.instructions) for block in comp.ssa.BBList)
+        start = time.perf_counter()
+        removed = dce.EliminateDeadCode(comp.ssa)
+        elapsed = time.perf_counter() - start
+        print(f'{count:6} statements in loop  {removed:6} of {before:6} instructions removed  {elapsed * 1000:10.2f} ms')
+
+
+def BenchSCCP(counts=(100, 1000)):
+    """
+    Sparse conditional constant propagation on chains of if-else statements over a constant.
+    """
+    for count in counts:
+        with redirect_stdout(io.StringIO()):
+            comp = parser.ParseString(ConstantBranchProgram(count))
+        before = sum(len(block.instructions) for block in comp.ssa.BBList)
+        start = time.perf_counter()
+        stats = sccp.PropagateConstants(comp.ssa)
+        elapsed = time.perf_counter() - start
+        after = sum(len(block.instructions) for block in comp.ssa.BBList)
+        print(f'{count:6} if statements  {before:6} -> {after:6} instructions  {stats["branches"]:5} branches resolved  '
+              f'{stats["unreachable"]:5} blocks unreachable  {elapsed * 1000:10.2f} ms')
+
+
+def BenchLICM(depths=(5, 20)):
+    """
+    Loop-invariant code motion on nested while loops that recompute expressions of two inputs.
+    """
+    for depth in depths:
+        with redirect_stdout(io.StringIO()):
+            comp = parser.ParseString(InvariantLoopProgram(depth), sealedSSA=True)
+        start = time.perf_counter()
+        stats = licm.HoistLoopInvariants(comp.ssa)
+        elapsed = time.perf_counter() - start
+        print(f'{depth:6} nested loops  {stats["hoisted"]:6} instructions hoisted  {stats["merged"]:5} merged  '
+              f'{elapsed * 1000:10.2f} ms')
+
+
+def BenchInduction(counts=(10, 100)):
+    """
+    Strength reduction of the array address multiplies in nested loops walking arrays by index,
+    after loop-invariant code motion.
+    """
+    for count in counts:
+        with redirect_stdout(io.StringIO()):
+            comp = parser.ParseString(ArrayLoopProgram(count), sealedSSA=True)
+        licm.HoistLoopInvariants(comp.ssa)
+        opcodes = comp.ssa.instructionList.opcodes
+        before = sum(opcodes[instID] == IRTokens.mulToken for block in comp.ssa.BBList for instID in block.instructions)
+        start = time.perf_counter()
+        stats = induction.ReduceStrength(comp.ssa)
+        elapsed = time.perf_counter() - start
+        after = sum(opcodes[instID] == IRTokens.mulToken for block in comp.ssa.BBList for instID in block.instructions)
+        print(f'{count:6} arrays  {stats["basic"]:4} induction variables  {stats["reduced"]:5} multiplies reduced  '
+              f'mul {before:5} -> {after:5}  {elapsed * 1000:10.2f} ms')
+
+
+def BenchPRE(counts=(100, 500)):
+    """
+    Partial redundancy elimination on products computed in one arm of an if and again after it.
+    """
+    for count in counts:
+        with redirect_stdout(io.StringIO()):
+            comp = parser.ParseString(PartialRedundancyProgram(count), sealedSSA=True)
+        start = time.perf_counter()
+        stats = pre.EliminatePartialRedundancies(comp.ssa)
+        elapsed = time.perf_counter() - start
+        print(f'{count:6} if statements  {stats["eliminated"]:5} eliminated  {stats["inserted"]:5} inserted  '
+              f'{stats["split"]:5} edges split  {stats["rounds"]:2} rounds  {elapsed * 1000:10.2f} ms')
+
+
+BENCHMARKS = {
+    'parser': BenchParser,
+    'lexers': BenchLexers,
+    'cse': BenchCSE,
+    'blocks': BenchBlocks,
+    'instructions': BenchInstructions,
+    'loops': BenchLoops,
+    'sealed': BenchSealed,
+    'variables': BenchVariables,
+    'histories': BenchHistories,
+    'uses': BenchUses,
+    'incremental': BenchIncremental,
+    'dce': BenchDCE,
+    'sccp': BenchSCCP,
+    'licm': BenchLICM,
+    'induction': BenchInduction,
+    'pre': BenchPRE,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for benchName in names:
+        BENCHMARKS[benchName]()
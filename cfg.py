@@ -1,29 +1,320 @@
 from tokens import *
+from array import array
+from bisect import bisect_left, bisect_right
 
 
-class InstructionNode:
-    def __init__(self, instruction: IRTokens = None, operand1: int = None, operand2: int = None,
-                 inst_id: int = None, bb_id: int = None, firstVarPair: tuple = None):
+# opcode -> IRTokens member, indexed by the values stored in InstructionStore.opcodes
+IR_TOKENS = [None] * (max(IRTokens) + 1)
+for token in IRTokens:
+    IR_TOKENS[token] = token
+
+# operands that hold the value of another instruction, by opcode: bit 1 for operand1, bit 2 for operand2
+# constants hold plain values and branches hold jump targets, neither is a use
+USE_COLUMNS = bytearray(max(IRTokens) + 1)
+for token in (IRTokens.addToken, IRTokens.subToken, IRTokens.mulToken, IRTokens.divToken, IRTokens.cmpToken,
+              IRTokens.addaToken, IRTokens.loadToken, IRTokens.storeToken, IRTokens.phiToken):
+    USE_COLUMNS[token] = 3
+for token in (IRTokens.bneToken, IRTokens.beqToken, IRTokens.bleToken, IRTokens.bltToken, IRTokens.bgeToken,
+              IRTokens.bgtToken, IRTokens.killToken, IRTokens.writeToken):
+    USE_COLUMNS[token] = 1
+
+
+class UndoLog:
+    """
+    Changes made in place while parsing, each recorded as a function and the arguments that revert it,
+    so a parser can be rolled back to an earlier statement (see parser.IncrementalParser).
+    Tables that only grow (instruction rows, blocks, histories) are cut back to a recorded length
+    instead, see SSA.Checkpoint.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def Add(self, function, *args):
+        self.entries.append((function, args))
+
+    def Mark(self):
+        return len(self.entries)
+
+    def Rollback(self, mark):
+        # reverts the changes recorded since Mark, newest first
+        entries = self.entries
+        while len(entries) > mark:
+            function, args = entries.pop()
+            function(*args)
+
+
+class InstructionStore:
+    """
+    Instructions kept column-wise in parallel typed arrays, indexed by instruction ID.
+    Integer operands are stored inline. None and the odd non-integer operand (const names, phi
+    operand tuples) use a sentinel in the array and live in a side table.
+    Indexing returns an InstructionNode view, so code written against nodes keeps working,
+    while passes can scan the columns directly.
+    Def-use chains are kept up to date by Append, SetOperand and SetOpcode, see GetUsers.
+    """
+
+    NONE = -(1 << 63)
+    OBJECT = NONE + 1
+    MAX_INLINE = (1 << 63) - 1
+
+    def __init__(self):
+        self.opcodes = array('b')
+        self.operand1 = array('q')
+        self.operand2 = array('q')
+        self.blocks = array('i')
+        self.active = bytearray()
+        # layout, maintained by SSA.PlaceInst: the block whose instruction list holds the instruction
+        # (-1 until placed) and an order label that increases along that list
+        self.placement = array('i')
+        self.order = array('q')
+        # index of the instruction's entry in its block's op table (the kill table for memory
+        # instructions, under their adda), -1 if it has none. Lets operands be re-keyed without a search
+        self.opSlots = array('i')
+        self.firstVarPairs = []
+        self.objects = {}  # (column, instID) -> operand that is not stored inline
+        self.dependencies = {}  # instID -> list of variables, only for instructions that have any
+        # instID -> instructions using it as an operand (one entry per use), see USE_COLUMNS and GetUsers
+        self.users = {}
+        # UndoLog recording the changes to existing rows, None unless the parser can be rolled back
+        self.undo = None
+
+    def Append(self, instruction: IRTokens, operand1, operand2, bb_id: int, firstVarPair: tuple = None):
         """
-        Initializes an instruction node. Most private variables should not be changed after initializing.
-        :param instruction:
-        :param operand1:
-        :param operand2:
-        :param inst_id:
-        :param bb_id:
+        Adds an instruction at the next instruction ID
+        :return: the instruction ID
+        """
+        instID = len(self.opcodes)
+        self.opcodes.append(instruction)
+        self.operand1.append(self.Encode(1, instID, operand1))
+        self.operand2.append(self.Encode(2, instID, operand2))
+        self.blocks.append(bb_id)
+        self.active.append(1)
+        self.placement.append(-1)
+        self.order.append(0)
+        self.opSlots.append(-1)
+        self.firstVarPairs.append(firstVarPair)
+        uses = USE_COLUMNS[instruction]
+        if uses:
+            if uses & 1 and self.operand1[instID] >= 0:
+                self.AddUse(self.operand1[instID], instID)
+            if uses & 2 and self.operand2[instID] >= 0:
+                self.AddUse(self.operand2[instID], instID)
+        return instID
+
+    def AddUse(self, value, instID):
+        # value is the encoded operand, only instruction IDs (inline, non-negative) are recorded
+        # most instructions have a single use, which is stored as a bare int instead of a list
+        if value >= 0:
+            users = self.users.get(value)
+            if users is None:
+                self.users[value] = instID
+            elif type(users) is int:
+                self.users[value] = [users, instID]
+            else:
+                users.append(instID)
+            if self.undo is not None:
+                self.undo.Add(self.PopUse, value)
+
+    def RemoveUse(self, value, instID):
+        if value >= 0:
+            users = self.users[value]
+            index = 0
+            if type(users) is int:
+                del self.users[value]
+            else:
+                index = users.index(instID)
+                del users[index]
+                if len(users) == 1:
+                    self.users[value] = users[0]
+            if self.undo is not None:
+                self.undo.Add(self.InsertUse, value, index, instID)
+
+    def PopUse(self, value):
+        # reverts the last AddUse of value
+        users = self.users[value]
+        if type(users) is int:
+            del self.users[value]
+        else:
+            users.pop()
+            if len(users) == 1:
+                self.users[value] = users[0]
+
+    def InsertUse(self, value, index, instID):
+        # reverts RemoveUse
+        users = self.users.get(value)
+        if users is None:
+            self.users[value] = instID
+            return
+        if type(users) is int:
+            users = self.users[value] = [users]
+        users.insert(index, instID)
+
+    def GetUsers(self, instID):
+        """
+        :return: the instructions using instID as an operand, each once, in the order they started using it
         """
-        self.instruction = instruction
-        self.operand1 = operand1
-        self.operand2 = operand2
-        self.instID = inst_id
-        self.BB = bb_id
-        self.dependency = []
-        self.firstVarPair = firstVarPair
-        self.active = True
-        self.local = False
+        users = self.users.get(instID)
+        if users is None:
+            return []
+        if type(users) is int:
+            return [users]
+        return list(dict.fromkeys(users))
+
+    def IsUse(self, instID, column):
+        # whether the operand column of instID holds the value of another instruction
+        return bool(USE_COLUMNS[self.opcodes[instID]] & column)
+
+    def Encode(self, column, instID, operand):
+        key = (column, instID)
+        old = self.objects.pop(key, None)
+        if old is not None and self.undo is not None:
+            self.undo.Add(self.objects.__setitem__, key, old)
+        if operand is None:
+            return self.NONE
+        if type(operand) is int and self.OBJECT < operand <= self.MAX_INLINE:
+            return operand
+        self.objects[key] = operand
+        if self.undo is not None:
+            self.undo.Add(self.objects.pop, key)
+        return self.OBJECT
+
+    def GetOperand(self, column, instID):
+        if column == 1:
+            value = self.operand1[instID]
+        else:
+            value = self.operand2[instID]
+        if value > self.OBJECT:
+            return value
+        if value == self.NONE:
+            return None
+        return self.objects[(column, instID)]
+
+    def SetOperand(self, column, instID, operand):
+        values = self.operand1 if column == 1 else self.operand2
+        isUse = USE_COLUMNS[self.opcodes[instID]] & column
+        if isUse:
+            self.RemoveUse(values[instID], instID)
+        if self.undo is not None:
+            self.undo.Add(values.__setitem__, instID, values[instID])
+        values[instID] = self.Encode(column, instID, operand)
+        if isUse:
+            self.AddUse(values[instID], instID)
+
+    def SetOpcode(self, instID, instruction):
+        # operands that start or stop being uses under the new opcode update the def-use chains
+        oldUses, newUses = USE_COLUMNS[self.opcodes[instID]], USE_COLUMNS[instruction]
+        for column, values in ((1, self.operand1), (2, self.operand2)):
+            if oldUses & column and not newUses & column:
+                self.RemoveUse(values[instID], instID)
+            elif newUses & column and not oldUses & column:
+                self.AddUse(values[instID], instID)
+        if self.undo is not None:
+            self.undo.Add(self.opcodes.__setitem__, instID, self.opcodes[instID])
+        self.opcodes[instID] = instruction
+
+    def SetActive(self, instID, status):
+        if self.undo is not None:
+            self.undo.Add(self.active.__setitem__, instID, self.active[instID])
+        self.active[instID] = 1 if status else 0
+
+    def SetFirstVarPair(self, instID, tup):
+        if self.undo is not None:
+            self.undo.Add(self.firstVarPairs.__setitem__, instID, self.firstVarPairs[instID])
+        self.firstVarPairs[instID] = tup
+
+    def AddDependency(self, instID, var):
+        dependency = self.dependencies.get(instID)
+        if dependency is None:
+            self.dependencies[instID] = [var]
+            if self.undo is not None:
+                self.undo.Add(self.dependencies.pop, instID)
+        else:
+            dependency.append(var)
+            if self.undo is not None:
+                self.undo.Add(dependency.pop)
+
+    def Truncate(self, length):
+        """
+        Drops the instructions from ID length on. Changes the dropped instructions made to other rows
+        and tables are reverted by the UndoLog, so this only shortens the columns.
+        """
+        for column in (self.opcodes, self.operand1, self.operand2, self.blocks, self.active, self.placement,
+                       self.order, self.opSlots, self.firstVarPairs):
+            del column[length:]
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, instID):
+        if instID < 0:
+            instID += len(self.opcodes)
+        if not 0 <= instID < len(self.opcodes):
+            raise IndexError('instruction ID out of range')
+        return InstructionNode(self, instID)
+
+    def __iter__(self):
+        for instID in range(len(self.opcodes)):
+            yield InstructionNode(self, instID)
+
+
+class InstructionNode:
+    """
+    View of one instruction in an InstructionStore. Views are created on demand and hold no state
+    of their own, so two views of the same instruction always agree.
+    """
+    __slots__ = ('store', 'instID')
+
+    def __init__(self, store: InstructionStore, instID: int):
+        self.store = store
+        self.instID = instID
+
+    @property
+    def instruction(self):
+        return IR_TOKENS[self.store.opcodes[self.instID]]
+
+    @property
+    def operand1(self):
+        return self.store.GetOperand(1, self.instID)
+
+    @operand1.setter
+    def operand1(self, operand):
+        self.store.SetOperand(1, self.instID, operand)
+
+    @property
+    def operand2(self):
+        return self.store.GetOperand(2, self.instID)
+
+    @operand2.setter
+    def operand2(self, operand):
+        self.store.SetOperand(2, self.instID, operand)
+
+    @property
+    def BB(self):
+        return self.store.blocks[self.instID]
+
+    @property
+    def active(self):
+        return bool(self.store.active[self.instID])
+
+    @active.setter
+    def active(self, status):
+        self.store.SetActive(self.instID, status)
+
+    @property
+    def firstVarPair(self):
+        return self.store.firstVarPairs[self.instID]
+
+    @property
+    def dependency(self):
+        return self.store.dependencies.get(self.instID, [])
 
     def setInstruction(self, instruction):
-        self.instruction = instruction
+        self.store.SetOpcode(self.instID, instruction)
+
+    @property
+    def users(self):
+        return self.store.GetUsers(self.instID)
 
     def setOperands(self, operand1: int = None, operand2: int = None):
         """
@@ -38,10 +329,10 @@ class InstructionNode:
             self.operand2 = operand2
 
     def setFirstVarPair(self, tup):
-        self.firstVarPair = tup
+        self.store.SetFirstVarPair(self.instID, tup)
 
     def addVarDependency(self, var):
-        self.dependency.append(var)
+        self.store.AddDependency(self.instID, var)
 
     def setActiveStatus(self, status):
         self.active = status
@@ -51,9 +342,119 @@ class InstructionNode:
 
 
 
+class ConstantPool:
+    """
+    Constants defined in block 0, deduplicated by value.
+    Entries stay in insertion order, which is the order they are printed in.
+    """
+
+    def __init__(self):
+        self.instIDs = {}  # value -> instID
+        self.uses = {}  # instID -> number of times the constant was requested
+        self.undo = None  # see InstructionStore.undo
+
+    def Lookup(self, value):
+        # instID of the constant, -1 if it has not been defined
+        return self.instIDs.get(value, -1)
+
+    def Add(self, value, instID):
+        self.instIDs[value] = instID
+        self.uses[instID] = 0
+        if self.undo is not None:
+            self.undo.Add(self.Remove, value)
+
+    def RecordUse(self, instID):
+        if self.undo is not None:
+            self.undo.Add(self.uses.__setitem__, instID, self.uses[instID])
+        self.uses[instID] += 1
+
+    def Remove(self, value):
+        # the constant's instruction was deleted, so later lookups define a new one
+        instID = self.instIDs.pop(value, None)
+        if instID is not None:
+            del self.uses[instID]
+
+    def GetStats(self):
+        """
+        Usage per constant, for deciding which constants are worth keeping in a register
+        and which are cheaper to rematerialize at each use
+        :return: list of (value, instID, uses) in insertion order
+        """
+        return [(value, instID, self.uses[instID]) for value, instID in self.instIDs.items()]
+
+    def __len__(self):
+        return len(self.instIDs)
+
+    def __iter__(self):
+        # (value, instID) in insertion order
+        return iter(self.instIDs.items())
+
+
+class HistoryLog:
+    """
+    Append-only log of the instruction histories kept in value tables, see SSA.AssignVariable.
+    An entry is (instID, operands1, operands2) for each instruction of the assigned expression, or the
+    (1, (version, varToken)) operands of a copied variable. Entries are stored column-wise like
+    InstructionStore, and a history is one contiguous run of them, referred to by a single int that
+    packs its offset and length, so a value table entry does not hold a list of its own.
+    """
+
+    EMPTY = 0  # reference to the empty history
+    SHIFT = 32
+    MASK = (1 << SHIFT) - 1
+
+    def __init__(self):
+        self.instIDs = array('q')
+        self.operands1 = []
+        self.operands2 = []  # None for copied variables
+
+    def Add(self, history):
+        """
+        Appends a history to the log
+        :param history: list of history entries, in the order they were generated
+        :return: reference to the history
+        """
+        if not history:
+            return self.EMPTY
+        start = len(self.instIDs)
+        for entry in history:
+            self.instIDs.append(entry[0])
+            self.operands1.append(entry[1])
+            self.operands2.append(entry[2] if len(entry) == 3 else None)
+        return start << self.SHIFT | len(history)
+
+    def Get(self, ref):
+        # entries of a history, as a new list of tuples
+        start = ref >> self.SHIFT
+        end = start + (ref & self.MASK)
+        return [(instID, operands1) if operands2 is None else (instID, operands1, operands2)
+                for instID, operands1, operands2 in zip(self.instIDs[start:end], self.operands1[start:end],
+                                                        self.operands2[start:end])]
+
+    def Length(self, ref):
+        return ref & self.MASK
+
+    def Truncate(self, length):
+        # drops the entries from offset length on, references into them become invalid
+        del self.instIDs[length:]
+        del self.operands1[length:]
+        del self.operands2[length:]
+
+    def Clear(self):
+        # invalidates every reference handed out so far
+        self.instIDs = array('q')
+        self.operands1 = []
+        self.operands2 = []
+
+    def __len__(self):
+        return len(self.instIDs)
+
+
 class BasicBlock:
-    def __init__(self, bbID: int, valueTable: dict = None, parents: list = None,
-                 dominators: list = None, idominators: list = None, blockType="",
+    __slots__ = ('bbID', 'valueTable', 'opTables', 'valueNumbers', 'children', 'parents',
+                 'joinBlocks', 'blockType', 'joinType', 'instructions', 'undo')
+
+    def __init__(self, bbID: int, valueTable: dict = None, parents: list = None, blockType="",
                  joinType=0, joinBlocks=None):
 
         # tables needed for SSA tracking
@@ -65,53 +466,124 @@ class BasicBlock:
         # optable
         # entry format (instID, op1, op2)
         #     both op1 and op2 can be None
-        # entries are reverse chronologically ordered
-        self.opTables = {token: [] for token in IRTokens}
-        # self.opTables = {IRTokens.constToken: [],
-        #                  IRTokens.addToken: [], IRTokens.subToken: [], IRTokens.mulToken: [],
-        #                  IRTokens.divToken: [], IRTokens.cmpToken: [], IRTokens.phiToken: []}
-
-        # for control flow graph
-        self.children = set()
+        # entries are chronologically ordered (newest last), iterate in reverse to find the latest
+        # only ops that have entries get a list, see GetOpTable/AddOpEntry
+        self.opTables = {}
+
+        # value numbering table for CSE, (op, op1, op2) -> instIDs defined in this block, oldest first
+        # SSA.FindPreviousInst probes it once per dominator instead of scanning opTables
+        self.valueNumbers = {}
+
+        # for control flow graph, block IDs are kept in int arrays
+        self.children = array('i')  # sorted, no duplicates
         if parents is None:
-            self.parents = []
+            self.parents = array('i')
         else:
-            self.parents = parents
-
-        # by definition, a basic block dominates itself
-        self.dominators = [bbID]
-        if dominators is not None:
-            self.dominators += dominators
-        self.idominators = []
-        if idominators is not None:
-            self.idominators += idominators
+            self.parents = array('i', parents)
         self.joinBlocks = []
         if joinBlocks is not None:
             self.joinBlocks = joinBlocks
         self.bbID = bbID
 
-        self.loadStore = []
-
         # bookkeeping
         self.blockType = blockType
         self.joinType = joinType
         self.instructions = []
+        self.undo = None  # see InstructionStore.undo, SSA.PlaceInst records changes to instructions
 
     def AddChild(self, blockID):
-        self.children.add(blockID)
+        i = bisect_left(self.children, blockID)
+        if i == len(self.children) or self.children[i] != blockID:
+            self.children.insert(i, blockID)
+            if self.undo is not None:
+                self.undo.Add(self.children.pop, i)
 
     def AddParent(self, blockID):
         if blockID not in self.parents:
             self.parents.append(blockID)
+            if self.undo is not None:
+                self.undo.Add(self.parents.pop)
+
+    def AddVersion(self, varToken, entry):
+        # adds the newest value table entry of the variable, entries are kept oldest first
+        versions = self.valueTable.get(varToken)
+        if versions is None:
+            self.valueTable[varToken] = [entry]
+            if self.undo is not None:
+                self.undo.Add(self.valueTable.pop, varToken)
+        else:
+            versions.append(entry)
+            if self.undo is not None:
+                self.undo.Add(versions.pop)
+
+    def SetVersions(self, varToken, versions):
+        old = self.valueTable.get(varToken)
+        self.valueTable[varToken] = versions
+        if self.undo is not None:
+            if old is None:
+                self.undo.Add(self.valueTable.pop, varToken)
+            else:
+                self.undo.Add(self.valueTable.__setitem__, varToken, old)
 
-    def AddDominator(self, block):
-        self.dominators.append(block)
+    def SetVersion(self, varToken, idx, entry):
+        versions = self.valueTable[varToken]
+        if self.undo is not None:
+            self.undo.Add(versions.__setitem__, idx, versions[idx])
+        versions[idx] = entry
 
-    def AddIDominator(self, block):
-        self.idominators.append(block)
+    def GetOpTable(self, op):
+        # entries for op, oldest first
+        return self.opTables.get(op, ())
+
+    def AddOpEntry(self, op, entry):
+        # returns the index of the entry in the table, entries are never moved
+        table = self.opTables.get(op)
+        if table is None:
+            self.opTables[op] = [entry]
+            if self.undo is not None:
+                self.undo.Add(self.opTables.pop, op)
+            return 0
+        table.append(entry)
+        if self.undo is not None:
+            self.undo.Add(table.pop)
+        return len(table) - 1
+
+    def SetOpEntry(self, op, idx, entry):
+        table = self.opTables[op]
+        if self.undo is not None:
+            self.undo.Add(table.__setitem__, idx, table[idx])
+        table[idx] = entry
 
     def AddNewOp(self, op, operand1, operand2, instID):
-        self.opTables[op].insert(0, (instID, operand1, operand2))
+        self.AddValueNumber((op, operand1, operand2), instID)
+        return self.AddOpEntry(op, (instID, operand1, operand2))
+
+    def AddValueNumber(self, key, instID):
+        insts = self.valueNumbers.get(key)
+        if insts is None:
+            self.valueNumbers[key] = [instID]
+            if self.undo is not None:
+                self.undo.Add(self.valueNumbers.pop, key)
+        else:
+            # keep instruction order when an existing instruction is re-keyed
+            i = bisect_right(insts, instID)
+            insts.insert(i, instID)
+            if self.undo is not None:
+                self.undo.Add(insts.pop, i)
+
+    def RemoveValueNumber(self, key, instID):
+        insts = self.valueNumbers.get(key)
+        if insts is not None and instID in insts:
+            i = insts.index(instID)
+            del insts[i]
+            if self.undo is not None:
+                self.undo.Add(insts.insert, i, instID)
+            if not insts:
+                del self.valueNumbers[key]
+                if self.undo is not None:
+                    self.undo.Add(self.valueNumbers.__setitem__, key, insts)
 
     def AddJoinBlocks(self, joinBlocks):
+        if self.undo is not None:
+            self.undo.Add(setattr, self, 'joinBlocks', self.joinBlocks)
         self.joinBlocks = joinBlocks
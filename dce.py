@@ -0,0 +1,82 @@
+from tokens import IRTokens
+from cfg import USE_COLUMNS
+from tracing import TraceEvent
+
+# instructions that are live whether or not their value is used: input/output, memory and control flow
+ROOTS = bytearray(max(IRTokens) + 1)
+for token in (IRTokens.writeToken, IRTokens.writeNLToken, IRTokens.readToken, IRTokens.storeToken,
+              IRTokens.killToken, IRTokens.endToken, IRTokens.braToken, IRTokens.bneToken, IRTokens.beqToken,
+              IRTokens.bleToken, IRTokens.bltToken, IRTokens.bgeToken, IRTokens.bgtToken):
+    ROOTS[token] = 1
+
+
+class DeadCodeElimination:
+    """
+    Mark-and-sweep dead code elimination over a finished SSA.
+    Instructions reached from a root through their operands are live, whether or not they are active.
+    A div is a root too unless its divisor is a non-zero constant, a division by zero stops the program
+    with or without its result being used. Everything else in a block is deleted with SSA.RemoveInsts.
+    """
+
+    def __init__(self, ssa):
+        """
+        :param ssa: the SSA of a parsed program, see Parser.ssa
+        """
+        self.ssa = ssa
+        self.store = ssa.instructionList
+        self.live = bytearray(len(self.store))
+        self.removed = 0
+
+    def Run(self):
+        """
+        :return: number of instructions removed
+        """
+        self.Mark()
+        self.Sweep()
+        if self.ssa.trace.opt:
+            self.ssa.trace.Emit(TraceEvent.OPT, f'dce removed {self.removed} instructions')
+        return self.removed
+
+    def Mark(self):
+        store = self.store
+        live = self.live
+        work = []
+        for block in self.ssa.BBList:
+            for instID in block.instructions:
+                operation = store.opcodes[instID]
+                if ROOTS[operation] or operation == IRTokens.divToken and not self.NonZero(store.operand2[instID]):
+                    live[instID] = 1
+                    work.append(instID)
+        while work:
+            instID = work.pop()
+            uses = USE_COLUMNS[store.opcodes[instID]]
+            for column, values in ((1, store.operand1), (2, store.operand2)):
+                if uses & column:
+                    value = values[instID]
+                    if 0 <= value < len(live) and not live[value]:
+                        live[value] = 1
+                        work.append(value)
+
+    def NonZero(self, operand):
+        store = self.store
+        if not 0 <= operand < len(store) or store.opcodes[operand] != IRTokens.constToken:
+            return False
+        value = store.GetOperand(1, operand)
+        return type(value) is int and value != 0
+
+    def Sweep(self):
+        live = self.live
+        dead = [instID for block in self.ssa.BBList for instID in block.instructions if not live[instID]]
+        if self.ssa.trace.opt:
+            for instID in dead:
+                self.ssa.trace.Emit(TraceEvent.OPT, f'dce removes {instID}: '
+                                                    f'{self.ssa.opDct[self.store[instID].instruction]}')
+        self.removed += self.ssa.RemoveInsts(dead)
+
+
+def EliminateDeadCode(ssa):
+    """
+    Runs DeadCodeElimination on a parsed program
+    :return: number of instructions removed
+    """
+    return DeadCodeElimination(ssa).Run()
@@ -0,0 +1,173 @@
+from array import array
+
+
+class DominatorTree:
+    """
+    Dominators of a finished control flow graph, computed with the iterative algorithm of
+    Cooper, Harvey and Kennedy ("A Simple, Fast Dominance Algorithm").
+    idom[b] is the immediate dominator of block b (the entry is its own, -1 for unreachable blocks).
+    Blocks are numbered in a preorder/postorder walk of the tree, so Dominates is O(1), and
+    dominance frontiers are computed on first use.
+    """
+
+    def __init__(self, blocks, entry=0):
+        """
+        :param blocks: list of cfg.BasicBlock indexed by block ID, see SSA.BBList
+        :param entry: ID of the entry block
+        """
+        self.blocks = blocks
+        self.entry = entry
+        count = len(blocks)
+        self.idom = array('i', [-1] * count)
+        self.rpo = self.ReversePostOrder()
+        # position of each block in self.rpo, -1 if it is unreachable
+        self.rpoIndex = array('i', [-1] * count)
+        for i, bbID in enumerate(self.rpo):
+            self.rpoIndex[bbID] = i
+        self.ComputeIdoms()
+
+        # children in the dominator tree, in block ID order
+        self.children = [[] for _ in range(count)]
+        for bbID in range(count):
+            if bbID != entry and self.idom[bbID] != -1:
+                self.children[self.idom[bbID]].append(bbID)
+        self.pre = array('i', [-1] * count)
+        self.post = array('i', [-1] * count)
+        self.NumberTree()
+        self.frontiers = None
+
+    def ReversePostOrder(self):
+        # iterative depth first search along the child edges
+        visited = bytearray(len(self.blocks))
+        visited[self.entry] = 1
+        order = []
+        stack = [(self.entry, iter(self.blocks[self.entry].children))]
+        while stack:
+            bbID, children = stack[-1]
+            for child in children:
+                if not visited[child]:
+                    visited[child] = 1
+                    stack.append((child, iter(self.blocks[child].children)))
+                    break
+            else:
+                stack.pop()
+                order.append(bbID)
+        order.reverse()
+        return order
+
+    def ComputeIdoms(self):
+        idom = self.idom
+        rpoIndex = self.rpoIndex
+        idom[self.entry] = self.entry
+        changed = True
+        while changed:
+            changed = False
+            for bbID in self.rpo[1:]:
+                newIdom = -1
+                for parent in self.blocks[bbID].parents:
+                    if idom[parent] == -1:
+                        continue
+                    if newIdom == -1:
+                        newIdom = parent
+                        continue
+                    # walk both fingers up the tree until they meet
+                    finger1, finger2 = parent, newIdom
+                    while finger1 != finger2:
+                        while rpoIndex[finger1] > rpoIndex[finger2]:
+                            finger1 = idom[finger1]
+                        while rpoIndex[finger2] > rpoIndex[finger1]:
+                            finger2 = idom[finger2]
+                    newIdom = finger1
+                if idom[bbID] != newIdom:
+                    idom[bbID] = newIdom
+                    changed = True
+
+    def NumberTree(self):
+        counter = 0
+        pre, post = self.pre, self.post
+        pre[self.entry] = counter
+        stack = [(self.entry, iter(self.children[self.entry]))]
+        while stack:
+            bbID, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                post[bbID] = counter
+            else:
+                counter += 1
+                pre[child] = counter
+                stack.append((child, iter(self.children[child])))
+
+    def Dominates(self, a, b):
+        """
+        :return: whether block a dominates block b (every block dominates itself)
+        """
+        if self.pre[a] == -1 or self.pre[b] == -1:
+            return False
+        return self.pre[a] <= self.pre[b] and self.post[b] <= self.post[a]
+
+    def StrictlyDominates(self, a, b):
+        return a != b and self.Dominates(a, b)
+
+    def Dominators(self, bbID):
+        """
+        :return: the dominators of bbID, closest first, ending with the entry block
+        """
+        idom = self.idom
+        if idom[bbID] == -1:
+            return
+        while True:
+            yield bbID
+            if bbID == self.entry:
+                return
+            bbID = idom[bbID]
+
+    def Frontier(self, bbID):
+        """
+        :return: set of blocks in the dominance frontier of bbID
+        """
+        if self.frontiers is None:
+            self.ComputeFrontiers()
+        return self.frontiers[bbID]
+
+    def ComputeFrontiers(self):
+        idom = self.idom
+        self.frontiers = [set() for _ in range(len(self.blocks))]
+        for bbID in self.rpo:
+            parents = self.blocks[bbID].parents
+            if len(parents) < 2:
+                continue
+            for parent in parents:
+                runner = parent
+                while idom[runner] != -1 and runner != idom[bbID]:
+                    self.frontiers[runner].add(bbID)
+                    runner = idom[runner]
+
+    def NaturalLoops(self):
+        """
+        Loops of the back edges, edges to a block that dominates their source
+        :return: list of (header, body) pairs, body being the set of blocks in the loop, innermost first
+        """
+        blocks = self.blocks
+        loops = {}
+        for bbID in self.rpo:
+            for child in blocks[bbID].children:
+                if self.Dominates(child, bbID):
+                    # the header and everything reaching bbID without going through it
+                    body = loops.setdefault(child, {child})
+                    work = [bbID]
+                    while work:
+                        block = work.pop()
+                        if block not in body:
+                            body.add(block)
+                            work.extend(blocks[block].parents)
+        return sorted(loops.items(), key=lambda loop: len(loop[1]))
+
+    def Preheader(self, header, body):
+        """
+        :return: the only block entering the loop when the header is its only child, -1 if there is none
+        """
+        outside = [parent for parent in self.blocks[header].parents if parent not in body]
+        if len(outside) != 1 or list(self.blocks[outside[0]].children) != [header]:
+            return -1
+        return outside[0]
@@ -0,0 +1,213 @@
+from tokens import IRTokens
+from dominance import DominatorTree
+from tracing import TraceEvent
+from sccp import Wrap
+import dce
+
+
+class StrengthReduction:
+    """
+    Induction variable detection and strength reduction over a finished SSA.
+    A basic induction variable is a phi of a loop header that adds the same loop-invariant step to
+    itself on every iteration, as in "let i <- i + 1". Instructions computing scale * i + offset from it,
+    with scale a constant and offset loop-invariant, are linear in i. This covers the address arithmetic
+    of Parser.arrayAddrInstCalculation: the mul by each dimension offset, the adds and the mul by the
+    word size. Each mul that is linear in i gets a new header phi instead, starting at
+    scale * (start of i) + offset and incremented by scale * step next to i, and the mul becomes dead.
+    The adda of an access keeps adding the array base to the incremented offset.
+    """
+
+    def __init__(self, ssa):
+        """
+        :param ssa: the SSA of a parsed program, see Parser.ssa
+        """
+        self.ssa = ssa
+        self.store = ssa.instructionList
+        self.tree = DominatorTree(ssa.BBList)
+        self.stats = {'loops': 0, 'basic': 0, 'reduced': 0, 'removed': 0}
+
+    def Run(self, removeDead=True):
+        """
+        :param removeDead: run DeadCodeElimination on the replaced multiplies afterwards
+        :return: stats, number of loops with a preheader, basic induction variables found, multiplies
+                 of the program replaced by incremented phis and instructions removed. Multiplies that
+                 Materialize emitted for an inner loop are reduced in the outer one but not counted
+        """
+        # instructions from here on are emitted by the pass
+        self.size = len(self.store)
+        for header, body in self.tree.NaturalLoops():
+            preheader = self.tree.Preheader(header, body)
+            if preheader == -1 or len(self.ssa.BBList[header].parents) != 2:
+                continue
+            self.stats['loops'] += 1
+            self.ReduceLoop(header, body, preheader)
+        if removeDead:
+            self.stats['removed'] += dce.EliminateDeadCode(self.ssa)
+        if self.ssa.trace.opt:
+            self.ssa.trace.Emit(TraceEvent.OPT, f'strength reduction {self.stats}')
+        return self.stats
+
+    def InductionVariables(self, header, body, preheader):
+        """
+        :return: (basics, linear), basics maps each basic induction variable to (start, next, step)
+                 and linear maps the instructions linear in one of them to (phi, scale, offset).
+                 Offsets and steps are (constant, terms), terms being (instID, factor) pairs of
+                 instructions from outside the loop
+        """
+        store = self.store
+        block = self.ssa.BBList[header]
+        # operand1 comes from the first parent and operand2 from the second
+        entry = list(block.parents).index(preheader) + 1
+        phis = {}
+        for instID in block.instructions:
+            if store.opcodes[instID] == IRTokens.phiToken and store.active[instID]:
+                start, nextID = store.GetOperand(entry, instID), store.GetOperand(3 - entry, instID)
+                if type(start) is int and type(nextID) is int and start >= 0 and nextID >= 0:
+                    phis[instID] = (start, nextID)
+
+        # every phi is a candidate until its value on the back edge is known
+        linear = self.Linear(body, phis)
+        basics = {}
+        for phiID, (start, nextID) in phis.items():
+            form = linear.get(nextID)
+            if form is not None and form[0] == phiID and form[1] == 1 and form[2] != (0, ()):
+                basics[phiID] = (start, nextID, form[2])
+        if len(basics) != len(phis):
+            linear = self.Linear(body, basics)
+        return basics, linear
+
+    def Linear(self, body, phis):
+        # linear forms of the add, sub and mul instructions of the loop in the given phis
+        store = self.store
+        opcodes = store.opcodes
+        linear = {phiID: (phiID, 1, (0, ())) for phiID in phis}
+        for bbID in self.tree.rpo:
+            if bbID not in body:
+                continue
+            for instID in self.ssa.BBList[bbID].instructions:
+                operation = opcodes[instID]
+                if not IRTokens.addToken <= operation <= IRTokens.mulToken or not store.active[instID]:
+                    continue
+                a = self.Form(store.GetOperand(1, instID), linear, body)
+                b = self.Form(store.GetOperand(2, instID), linear, body)
+                if a is None or b is None or (a[0] is None and b[0] is None):
+                    continue
+                if operation == IRTokens.mulToken:
+                    # one side has to be a constant
+                    if a[0] is None:
+                        a, b = b, a
+                    if b[0] is not None or b[2][1]:
+                        continue
+                    form = (a[0], Wrap(a[1] * b[2][0]), Scale(a[2], b[2][0]))
+                else:
+                    if a[0] is not None and b[0] is not None and a[0] != b[0]:
+                        continue
+                    sign = 1 if operation == IRTokens.addToken else -1
+                    form = (a[0] if a[0] is not None else b[0], Wrap(a[1] + sign * b[1]),
+                            AddOffsets(a[2], Scale(b[2], sign)))
+                if form[1] != 0:
+                    linear[instID] = form
+        return linear
+
+    def Form(self, operand, linear, body):
+        # linear form of an operand, (None, 0, offset) if it is defined outside of the loop
+        store = self.store
+        if operand in linear:
+            return linear[operand]
+        if type(operand) is not int or not 0 <= operand < len(store):
+            return None
+        bbID = store.placement[operand]
+        if bbID == -1 or bbID in body:
+            return None
+        if store.opcodes[operand] == IRTokens.constToken:
+            value = store.GetOperand(1, operand)
+            return (None, 0, (value, ())) if type(value) is int else None
+        return None, 0, (0, ((operand, 1),))
+
+    def ReduceLoop(self, header, body, preheader):
+        ssa = self.ssa
+        store = self.store
+        basics, linear = self.InductionVariables(header, body, preheader)
+        self.stats['basic'] += len(basics)
+        entry = list(ssa.BBList[header].parents).index(preheader) + 1
+        multiplies = {instID for instID in linear if store.opcodes[instID] == IRTokens.mulToken}
+        for instID in sorted(multiplies, key=store.order.__getitem__):
+            # a mul only used by other multiplies goes away with them
+            if all(user in multiplies for user in store.GetUsers(instID)):
+                continue
+            phiID, scale, offset = linear[instID]
+            start, nextID, step = basics[phiID]
+            initial = self.Materialize(preheader, start, scale, offset)
+            increment = self.Materialize(preheader, None, 0, Scale(step, scale))
+
+            newPhi, _ = ssa.DefineIR(IRTokens.phiToken, header)
+            bbID = store.placement[nextID]
+            position = ssa.GetInstPosInBB(nextID, bbID) + 1
+            newNext, _ = ssa.DefineIR(IRTokens.addToken, bbID, newPhi, increment, inst_position=position)
+            if entry == 1:
+                ssa.SetPhiOperands(newPhi, initial, newNext)
+            else:
+                ssa.SetPhiOperands(newPhi, newNext, initial)
+            ssa.ReplaceAllUses(instID, newPhi)
+            if instID < self.size:
+                self.stats['reduced'] += 1
+            if ssa.trace.opt:
+                ssa.trace.Emit(TraceEvent.OPT, f'strength reduction replaces {instID} by phi {newPhi} '
+                                               f'incremented by {newNext}')
+
+    def Materialize(self, bbID, value, scale, offset):
+        """
+        Emits scale * value + offset at the end of a block, before its branch
+        :param value: instruction ID, None for just the offset
+        :return: instruction ID of the result
+        """
+        constant, terms = offset
+        result = None
+        if value is not None and self.store.opcodes[value] == IRTokens.constToken:
+            start = self.store.GetOperand(1, value)
+            if type(start) is int:
+                constant, value = Wrap(constant + scale * start), None
+        if value is not None:
+            result = value if scale == 1 else self.Emit(IRTokens.mulToken, bbID, value, self.Constant(scale))
+        for term, factor in terms:
+            if factor != 1:
+                term = self.Emit(IRTokens.mulToken, bbID, term, self.Constant(factor))
+            result = term if result is None else self.Emit(IRTokens.addToken, bbID, result, term)
+        if constant != 0 or result is None:
+            constID = self.Constant(constant)
+            result = constID if result is None else self.Emit(IRTokens.addToken, bbID, result, constID)
+        return result
+
+    def Emit(self, operation, bbID, operand1, operand2):
+        opcodes = self.store.opcodes
+        insts = self.ssa.BBList[bbID].instructions
+        position = -1
+        if insts and IRTokens.braToken <= opcodes[insts[-1]] <= IRTokens.bgtToken:
+            position = len(insts) - 1
+        instID, _ = self.ssa.DefineIR(operation, bbID, operand1, operand2, inst_position=position)
+        return instID
+
+    def Constant(self, value):
+        instID, _ = self.ssa.DefineIR(IRTokens.constToken, 0, value)
+        return instID
+
+
+def Scale(offset, factor):
+    # offset * factor, for the (constant, terms) offsets of StrengthReduction
+    constant, terms = offset
+    return Wrap(constant * factor), tuple((term, Wrap(f * factor)) for term, f in terms if Wrap(f * factor))
+
+
+def AddOffsets(a, b):
+    factors = dict(a[1])
+    for term, factor in b[1]:
+        factors[term] = Wrap(factors.get(term, 0) + factor)
+    return Wrap(a[0] + b[0]), tuple(sorted((term, factor) for term, factor in factors.items() if factor))
+
+
+def ReduceStrength(ssa, removeDead=True):
+    """
+    Runs StrengthReduction on a parsed program
+    :return: stats of the pass, see StrengthReduction.Run
+    """
+    return StrengthReduction(ssa).Run(removeDead)
@@ -0,0 +1,142 @@
+from tokens import IRTokens
+from cfg import USE_COLUMNS
+from dominance import DominatorTree
+from tracing import TraceEvent
+
+# instructions without side effects that can be computed once before the loop
+HOISTABLE = bytearray(max(IRTokens) + 1)
+for token in (IRTokens.addToken, IRTokens.subToken, IRTokens.mulToken, IRTokens.divToken, IRTokens.cmpToken,
+              IRTokens.loadToken):
+    HOISTABLE[token] = 1
+
+
+class LoopInvariantCodeMotion:
+    """
+    Loop-invariant code motion over a finished SSA.
+    Loops are the natural loops of DominatorTree, innermost first. Instructions of the loop whose
+    operands are all defined outside of it are moved to the preheader, the block entering the loop
+    header, which for a while loop is the block the while statement started in.
+    They are re-defined there with SSA.DefineIR, so a hoisted instruction can also be merged with an
+    equal one that dominates the loop.
+    Only the header is sure to run once the preheader has, so from the rest of the body
+        div is only moved for a constant non-zero divisor,
+        load is only moved when nothing in the loop stores to or kills its array.
+    """
+
+    def __init__(self, ssa):
+        """
+        :param ssa: the SSA of a parsed program, see Parser.ssa
+        """
+        self.ssa = ssa
+        self.store = ssa.instructionList
+        self.tree = DominatorTree(ssa.BBList)
+        self.stats = {'loops': 0, 'hoisted': 0, 'loads': 0, 'merged': 0}
+
+    def Run(self):
+        """
+        :return: stats, number of loops with a preheader, instructions hoisted (loads included), loads
+                 hoisted and hoisted instructions merged with one before the loop
+        """
+        for header, body in self.tree.NaturalLoops():
+            preheader = self.tree.Preheader(header, body)
+            if preheader == -1:
+                continue
+            self.stats['loops'] += 1
+            self.HoistLoop(header, body, preheader)
+        if self.ssa.trace.opt:
+            self.ssa.trace.Emit(TraceEvent.OPT, f'licm {self.stats}')
+        return self.stats
+
+    def HoistLoop(self, header, body, preheader):
+        ssa = self.ssa
+        store = self.store
+        opcodes = store.opcodes
+        killed = self.KilledArrays(body)
+        dead = []
+        for bbID in self.tree.rpo:
+            if bbID not in body:
+                continue
+            for instID in ssa.BBList[bbID].instructions:
+                operation = opcodes[instID]
+                if not HOISTABLE[operation] or not store.active[instID]:
+                    continue
+                if operation == IRTokens.loadToken:
+                    addaID = store.operand1[instID]
+                    if (not self.Invariant(addaID, body) or self.Array(store.operand1[addaID]) in killed
+                            or opcodes[addaID] != IRTokens.addaToken):
+                        continue
+                    op1, op2 = store.GetOperand(1, addaID), store.GetOperand(2, addaID)
+                    pair = store.firstVarPairs[addaID]
+                elif self.Invariant(instID, body):
+                    op1, op2 = store.GetOperand(1, instID), store.GetOperand(2, instID)
+                    if operation == IRTokens.divToken and bbID != header and not self.NonZero(op2):
+                        continue
+                    pair = store.firstVarPairs[instID]
+                else:
+                    continue
+
+                # in front of the branch that ends the preheader, if it has one
+                insts = ssa.BBList[preheader].instructions
+                position = -1
+                if insts and IRTokens.braToken <= opcodes[insts[-1]] <= IRTokens.bgtToken:
+                    position = len(insts) - 1
+                size = len(store)
+                var1, var2 = pair if pair is not None else (None, None)
+                newID, _ = ssa.DefineIR(operation, preheader, op1, op2, inst_position=position, var1=var1, var2=var2)
+                if newID < size:
+                    self.stats['merged'] += 1
+                ssa.ReplaceAllUses(instID, newID)
+                dead.append(instID)
+                if operation == IRTokens.loadToken:
+                    dead.append(addaID)
+                    self.stats['loads'] += 1
+                self.stats['hoisted'] += 1
+                if ssa.trace.opt:
+                    ssa.trace.Emit(TraceEvent.OPT, f'licm hoists {instID} from BB{bbID} to BB{preheader} as {newID}')
+        ssa.RemoveInsts(dead)
+
+    def Invariant(self, instID, body):
+        # whether every operand of instID is defined outside of the loop
+        store = self.store
+        uses = USE_COLUMNS[store.opcodes[instID]]
+        for column, values in ((1, store.operand1), (2, store.operand2)):
+            if uses & column:
+                value = values[instID]
+                if 0 <= value < len(store) and store.placement[value] in body:
+                    return False
+        return True
+
+    def NonZero(self, operand):
+        store = self.store
+        if type(operand) is not int or not 0 <= operand < len(store) or store.opcodes[operand] != IRTokens.constToken:
+            return False
+        value = store.GetOperand(1, operand)
+        return type(value) is int and value != 0
+
+    def Array(self, base):
+        # array of a base address, the base address is added to the data base in every block that needs it
+        store = self.store
+        if 0 <= base < len(store) and store.opcodes[base] == IRTokens.addToken:
+            return store.operand2[base]
+        return base
+
+    def KilledArrays(self, body):
+        # arrays stored to or killed anywhere in the loop
+        store = self.store
+        killed = set()
+        for bbID in body:
+            for instID in self.ssa.BBList[bbID].instructions:
+                operation = store.opcodes[instID]
+                if operation == IRTokens.killToken:
+                    killed.add(self.Array(store.operand1[instID]))
+                elif operation == IRTokens.storeToken:
+                    killed.add(self.Array(store.operand1[store.operand1[instID]]))
+        return killed
+
+
+def HoistLoopInvariants(ssa):
+    """
+    Runs LoopInvariantCodeMotion on a parsed program
+    :return: stats of the pass, see LoopInvariantCodeMotion.Run
+    """
+    return LoopInvariantCodeMotion(ssa).Run()
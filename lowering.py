@@ -0,0 +1,210 @@
+from tokens import *
+from syntaxtree import *
+import parser
+
+
+class Lowering(parser.Parser):
+    """
+    Generates SSA from a syntax tree built by syntaxtree.BuildTree.
+    Reuses the parser's semantic actions (emitBranch, emitBinaryOp, emitAssignment, ...), so the IR is
+    the same as parsing the source directly. The tree is not modified and can be lowered again.
+    The lower* methods are generator frames run by syntaxtree.RunFrames, so lowering does not recurse
+    on the Python stack.
+    """
+
+    def __init__(self, tree: Computation, debug=False, sealedSSA=False):
+        super().__init__(debug=debug, names=tree.names, sealedSSA=sealedSSA)
+        self.tree = tree
+
+    def lower(self):
+        dataBase = False
+        for decl in self.tree.decls:
+            if type(decl) == ArrayDecl:
+                if not dataBase:
+                    self.declareDataBase()
+                    dataBase = True
+                for ident in decl.idents:
+                    self.declareArray(ident, decl.dims)
+            else:
+                for ident in decl.idents:
+                    self.declareVar(ident)
+
+        RunFrames(self.lowerStatSequence(self.tree.body))
+        self.emitEnd()
+
+    def lowerStatSequence(self, statements):
+        for statement in statements:
+            if type(statement) == Assignment:
+                yield self.lowerAssignment(statement)
+            elif type(statement) == FuncCall:
+                yield self.lowerFuncCall(statement)
+            elif type(statement) == IfStatement:
+                yield self.lowerIfStatement(statement)
+            else:
+                yield self.lowerWhileStatement(statement)
+
+    def lowerAssignment(self, node):
+        ident = node.target.ident
+        currBB = self.ssa.GetCurrBasicBlock()
+        if self.symbols.IsArray(ident):
+            arrBaseInstID, offsetID, _ = yield self.lowerArrayAddress(node.target, currBB)
+            value = yield self.lowerExpression(node.value)
+            self.emitAssignment(ident, currBB, value, (arrBaseInstID, offsetID))
+        else:
+            self.emitAssignment(ident, currBB, (yield self.lowerExpression(node.value)))
+
+    def lowerFuncCall(self, node):
+        if node.func == Tokens.inputNumToken:
+            instID, _ = self.ssa.DefineIR(IRTokens.readToken, self.ssa.GetCurrBasicBlock())
+        elif node.func == Tokens.outputNewLineToken:
+            instID, _ = self.ssa.DefineIR(IRTokens.writeNLToken, self.ssa.GetCurrBasicBlock())
+        else:
+            opID, instList, operand = yield self.lowerExpression(node.args[0])
+            instID, _ = self.ssa.DefineIR(IRTokens.writeToken, self.ssa.GetCurrBasicBlock(), opID, var1=operand)
+        return instID, [], (2, instID)
+
+    def lowerIfStatement(self, node):
+        # mirrors Parser.ifStatement
+        currBB = self.ssa.GetCurrBasicBlock()
+
+        relOp, cmpInstID = yield self.lowerRelation(node.relation)
+        braInstID = self.emitBranch(relOp, currBB, cmpInstID)
+
+        thenID = self.ssa.CreateNewBasicBlock(currBB, [currBB], blockType="then\\n")
+        self.ssa.AddBlockChild(currBB, thenID)
+        joinID = self.ssa.CreateNewBasicBlock(currBB, [], blockType='join\\n')
+        self.ssa.OpenJoin(joinID)
+
+        self.ssa.SetCurrBasicBlock(thenID)
+        self.joinStack.append((0, joinID, currBB))
+        yield self.lowerStatSequence(node.thenSeq)
+        self.joinStack.pop()
+
+        latestThenID = self.ssa.GetCurrBasicBlock()
+        thenFirstInst = self.ssa.GetFirstInstInBlock(thenID)
+        self.ssa.AddBlockParent(joinID, latestThenID)
+        self.ssa.AddBlockChild(latestThenID, joinID)
+
+        joinParent = currBB
+        if node.elseSeq is not None:
+            jmpID, _ = self.ssa.DefineIR(IRTokens.braToken, latestThenID, 0)
+
+            elseID = self.ssa.CreateNewBasicBlock(currBB, [currBB], blockType="else\\n")
+            self.ssa.AddBlockChild(currBB, elseID)
+            self.joinStack.append((1, joinID, currBB))
+            yield self.lowerStatSequence(node.elseSeq)
+            self.joinStack.pop()
+
+            latestElseID = self.ssa.GetCurrBasicBlock()
+
+            elseFirstInst = self.ssa.GetFirstInstInBlock(elseID)
+            if elseFirstInst == -1:
+                elseFirstInst, _ = self.ssa.DefineIR(IRTokens.emptyToken, elseID)
+            self.ssa.ChangeOperands(braInstID, cmpInstID, elseFirstInst)
+
+            if self.ssa.GetFirstInstInBlock(latestElseID) == -1:
+                self.ssa.DefineIR(IRTokens.emptyToken, latestElseID)
+            joinParent = latestElseID
+        elif thenFirstInst == -1:
+            self.ssa.DefineIR(IRTokens.emptyToken, thenID)
+
+        self.ssa.AddBlockParent(joinID, joinParent)
+        self.ssa.AddBlockChild(joinParent, joinID)
+        self.ssa.SealBlock(joinID)
+
+        if node.elseSeq is not None:
+            self.ssa.AddBlockChild(joinParent, joinID)
+            self.branchInsts.append((0, jmpID, joinID))
+        else:
+            self.ssa.AddBlockChild(currBB, joinID)
+            self.branchInsts.append((1, braInstID, joinID))
+        self.ssa.SetCurrBasicBlock(joinID)
+
+    def lowerWhileStatement(self, node):
+        # mirrors Parser.whileStatement
+        entryBB = self.ssa.GetCurrBasicBlock()
+
+        if self.ssa.GetFirstInstInBlock(entryBB) == -1:
+            self.ssa.DefineIR(IRTokens.emptyToken, entryBB)
+
+        joinBB = self.ssa.CreateNewBasicBlock(entryBB, [entryBB], blockType="join\\n", joinType=1)
+        self.ssa.AddBlockChild(entryBB, joinBB)
+        self.ssa.OpenJoin(joinBB)
+
+        relOp, cmpInstID = yield self.lowerRelation(node.relation)
+        braInstID = self.emitBranch(relOp, joinBB, cmpInstID)
+
+        self.joinStack.append((2, joinBB, entryBB))
+        doBB = self.ssa.CreateNewBasicBlock(joinBB, [joinBB], blockType="do\\n", joinBlocks=self.joinStack)
+        self.ssa.AddBlockChild(joinBB, doBB)
+        yield self.lowerStatSequence(node.body)
+
+        latestDoBB = self.ssa.GetCurrBasicBlock()
+        self.ssa.AddBlockChild(latestDoBB, joinBB)
+        self.ssa.AddBlockParent(joinBB, latestDoBB)
+        self.ssa.SealBlock(joinBB)
+
+        joinFirstID = self.ssa.GetFirstInstInBlock(joinBB)
+        backInstID, _ = self.ssa.DefineIR(IRTokens.braToken, latestDoBB, joinFirstID)
+        if self.ssa.sealed:
+            self.branchInsts.append((0, backInstID, joinBB))
+
+        exitBB = self.ssa.CreateNewBasicBlock(joinBB, [joinBB], "exit\\n")
+        self.ssa.AddBlockChild(joinBB, exitBB)
+        if not self.ssa.sealed:
+            self.ssa.whilePhi(joinBB, latestDoBB, self.symbols)
+        self.joinStack.pop()
+        self.ssa.AddBlockJoinStack(exitBB, self.joinStack)
+        self.branchInsts.append((1, braInstID, exitBB))
+
+    def lowerRelation(self, node):
+        currBB = self.ssa.GetCurrBasicBlock()
+        ex1, _, var1 = yield self.lowerExpression(node.left)
+        ex2, _, var2 = yield self.lowerExpression(node.right)
+        cmpInstID, _ = self.ssa.DefineIR(IRTokens.cmpToken, currBB, ex1, ex2, var1=var1, var2=var2)
+        return node.op, cmpInstID
+
+    def lowerExpression(self, node):
+        # returns the same (instID, instList, operands) triple as Parser.expression/term/factor
+        currBB = self.ssa.GetCurrBasicBlock()
+        if type(node) == BinaryOp:
+            left = yield self.lowerExpression(node.left)
+            right = yield self.lowerExpression(node.right)
+            return self.emitBinaryOp(node.op, currBB, left, right)
+        elif type(node) == Number:
+            instID, _ = self.ssa.DefineIR(IRTokens.constToken, currBB, node.value)
+            return instID, [], (0, instID)
+        elif type(node) == Designator:
+            if self.symbols.IsScalar(node.ident):
+                return self.emitVarRead(node.ident, currBB)
+            arrBaseInstID, offSetID, instList = yield self.lowerArrayAddress(node, currBB)
+            instID, _ = self.ssa.DefineIR(IRTokens.loadToken, currBB, arrBaseInstID, offSetID)
+            return instID, instList, (3, (0, arrBaseInstID, offSetID))
+        elif type(node) == Group:
+            instID, instList, _ = yield self.lowerExpression(node.expr)
+            return instID, instList, (2, instID)
+        else:
+            instID, _, _ = yield self.lowerFuncCall(node)
+            return instID, [], (2, instID)
+
+    def lowerArrayAddress(self, designator, currBB):
+        # drives Parser.arrayAddressSteps, lowering each subscript as it is asked for
+        steps = self.arrayAddressSteps(designator.ident, currBB)
+        value = None
+        while True:
+            try:
+                i = steps.send(value)
+            except StopIteration as result:
+                return result.value
+            value = yield self.lowerExpression(designator.indices[i])
+
+
+def LowerTree(tree, debug=False, sealedSSA=False):
+    """
+    Generates SSA for a syntax tree
+    :param sealedSSA: use sealed-block SSA construction, see SSA.OpenJoin
+    :return: the Lowering, which exposes the same PrintSSA/GenerateDot as Parser
+    """
+    comp = Lowering(tree, debug, sealedSSA)
+    comp.lower()
+    return comp
@@ -2,22 +2,35 @@ import tokenizer
 import tokens
 from tokens import *
 import ssa
+import tracing
+from tracing import TraceEvent
+from symbols import SymbolTable, SymbolKind
+import bisect
 from operator import mul
 from functools import reduce
 
 
 class Parser:
-    def __init__(self, filepath: str, debug=False, tokenDebug=False):
-        self.t = tokenizer.Tokenizer(filepath, tokenDebug)
+    def __init__(self, filepath: str = None, debug=False, tokenDebug=False, bulkLex=False, source=None,
+                 identPool=None, names=None, sealedSSA=False):
+        # source: in-memory program (str, bytes or file object such as sys.stdin), used instead of filepath
+        # identPool: tokenizer.IdentPool shared between compilations
+        # names: an existing tokenizer to use instead of opening one (e.g. when lowering a syntax tree)
+        # sealedSSA: build SSA with sealed blocks and incomplete phis instead of the whilePhi passes
+        if names is not None:
+            self.t = names
+        elif bulkLex:
+            # lexes the whole file up front, next() then reads the token stream by index
+            self.t = tokenizer.BulkTokenizer(filepath, tokenDebug, source=source, pool=identPool)
+        else:
+            self.t = tokenizer.Tokenizer(filepath, tokenDebug, source=source, pool=identPool)
         self.sym = None
         self.debug = debug
+        self.trace = tracing.GetTracer()
 
         self.endVarDecl = True
         self.collectArr = False
-        self.identTable = []
-        self.arrayDict = {}
-        self.arrayOffset = {}
-        self.arrayAddress = {}
+        self.symbols = SymbolTable()
         self.level = 0
         self.spacing = 2
         self.dataBaseAddr = -1
@@ -26,7 +39,7 @@ class Parser:
                       Tokens.geqToken, Tokens.leqToken,
                       Tokens.gtrToken, Tokens.lssToken]
 
-        self.ssa = ssa.SSA(self.t)
+        self.ssa = ssa.SSA(self.t, sealed=sealedSSA)
         # (opType, joinID, entryID)
         #  opType: 0, join if-then block, (ssa, entry/else)
         #          1, join else block, right-hand side (entry/if, ssa)
@@ -36,6 +49,9 @@ class Parser:
         # stores the branch instruction ID and basic block it branches to
         self.branchInsts = []  # (opPos, instID, branchBB)
 
+        # called with the parser before each top-level statement (used by IncrementalParser)
+        self.onStatement = None
+
     def next(self):
         self.sym = self.t.GetNext()
 
@@ -46,7 +62,13 @@ class Parser:
         if self.sym == token:
             self.next()
         else:
-            raise SyntaxError(f'Expected {self.t.GetTokenStr(token)}, got {self.t.GetTokenStr(self.sym)}')
+            raise SyntaxError(f'Expected {self.t.GetTokenStr(token)}, got {self.t.GetTokenStr(self.sym)} '
+                              f'at {self.ErrorLocation()}')
+
+    def ErrorLocation(self):
+        # line/column of the current token, only looked up when reporting an error
+        line, column = self.t.GetPosition()
+        return f'line {line}, column {column}'
 
     def PrintSSA(self):
         self.ssa.PrintInstructions()
@@ -67,6 +89,8 @@ class Parser:
 
     def computation(self):
         # computation = "main" { varDecl } { funcDecl } "{"" statSequence "}" ".".
+        if self.trace.parse:
+            self.trace.Emit(TraceEvent.PARSE, 'computation')
         self.next()
         self.CheckFor(Tokens.mainToken)
         if self.debug:
@@ -85,7 +109,7 @@ class Parser:
                 self.endVarDecl = False
             elif self.sym == Tokens.arrToken:
                 if not dataBase:
-                    self.dataBaseAddr, _ = self.ssa.DefineIR(IRTokens.constToken, 0, "Base")
+                    self.declareDataBase()
                     dataBase = True
                 self.collectArr = True
                 self.endVarDecl = False
@@ -97,17 +121,14 @@ class Parser:
             if not self.endVarDecl:
                 if self.sym > 255:
                     if self.collectArr:
-                        self.arrayDict[self.sym] = tuple(arrSize)
-                        self.arrayOffset[self.sym] = tuple(self.defineOffsets(arrSize))
-                        self.arrayAddress[self.sym], _ = self.ssa.DefineIR(IRTokens.constToken, 0,
-                                                                           f'{self.t.GetTokenStr(self.sym)}BaseAddr')
+                        self.declareArray(self.sym, arrSize)
                         #self.arrayTable.append((self.sym, tuple(arrSize)))
                     else:
-                        self.identTable.append(self.sym)
+                        self.declareVar(self.sym)
                     self.next()
                 else:
                     self.t.close()
-                    raise SyntaxError("Keyword cannot be used as variable name")
+                    raise SyntaxError(f"Keyword cannot be used as variable name at {self.ErrorLocation()}")
 
             if self.sym == Tokens.semiToken:
                 self.next()
@@ -117,16 +138,26 @@ class Parser:
                 self.next()
             else:
                 self.t.close()
-                raise SyntaxError(f"Expected \',\' or \';\', got {self.sym}")
+                raise SyntaxError(f"Expected \',\' or \';\', got {self.sym} at {self.ErrorLocation()}")
         # Function instantiation
         if self.sym == Tokens.funcToken:
             pass
         # move to statSequence
         self.CheckFor(Tokens.beginToken)
         self.statSequence()
+        self.finishComputation()
+
+    def finishComputation(self):
+        # closes the main body once its statSequence has been parsed
         self.CheckFor(Tokens.endToken)
 
         self.CheckFor(Tokens.periodToken)
+        self.emitEnd()
+
+        if self.debug:
+            print(f'{" " * self.level * self.spacing}Exit C{self.level}')
+
+    def emitEnd(self):
         self.ssa.DefineIR(IRTokens.endToken, self.ssa.GetCurrBasicBlock())
 
         # change branch instructions
@@ -137,8 +168,16 @@ class Parser:
             else:
                 self.ssa.ChangeOperands(braInsts[1], op2=brOp1)
 
-        if self.debug:
-            print(f'{" " * self.level * self.spacing}Exit C{self.level}')
+    def declareDataBase(self):
+        self.dataBaseAddr, _ = self.ssa.DefineIR(IRTokens.constToken, 0, "Base")
+
+    def declareVar(self, ident):
+        self.symbols.Declare(ident, SymbolKind.scalar)
+
+    def declareArray(self, ident, arrSize):
+        offsets = tuple(self.defineOffsets(arrSize))
+        baseAddr, _ = self.ssa.DefineIR(IRTokens.constToken, 0, f'{self.t.GetTokenStr(ident)}BaseAddr')
+        self.symbols.Declare(ident, SymbolKind.array, tuple(arrSize), offsets, baseAddr)
 
     def parseArraySize(self):
         self.CheckFor(Tokens.openbracketToken)
@@ -167,8 +206,12 @@ class Parser:
         self.level += 1
         if self.debug:
             print(f'{" " * self.level * self.spacing}In statSequence{self.level}')
+        if self.trace.parse:
+            self.trace.Emit(TraceEvent.PARSE, f'statSequence {self.level} at token {self.sym}')
         # Do stuff here
         while True:
+            if self.level == 1 and self.onStatement is not None:
+                self.onStatement(self)
             # statement = assignment | funcCall | ifStatement | whileStatement | returnStatement
             if self.sym == Tokens.letToken:
                 self.next()
@@ -200,31 +243,46 @@ class Parser:
         self.level += 1
         if self.debug:
             print(f'{" " * self.level * self.spacing}In assignment{self.level}')
+        if self.trace.parse:
+            self.trace.Emit(TraceEvent.PARSE, f'assignment {self.level} at token {self.sym}')
 
         # Do stuff here
-        # first check if designator has been declared
-        if self.sym in self.identTable:
-            pass
         ident = self.sym
         self.next()
         LHSArray = False
         currBB = self.ssa.GetCurrBasicBlock()
-        if ident in self.identTable:
+        if self.symbols.IsScalar(ident):
             self.CheckFor(Tokens.becomesToken)
-        elif ident in self.arrayDict:
+        elif self.symbols.IsArray(ident):
             LHSArray = True
             arrBaseInstID, offsetID, instList = self.arrayAddrInstCalculation(ident, currBB)
             self.CheckFor(Tokens.becomesToken)
 
-        instNode, instList, operands = self.expression()
+        value = self.expression()
+        if LHSArray:
+            self.emitAssignment(ident, currBB, value, (arrBaseInstID, offsetID))
+        else:
+            self.emitAssignment(ident, currBB, value)
+        if self.debug:
+            print(f'{" " * self.level * self.spacing}Exit assignment{self.level}')
+        self.level -= 1
+        return
+
+    def emitAssignment(self, ident, currBB, value, arrayAddr=None):
+        # value is the (instID, instList, operands) triple of the right-hand side
+        # arrayAddr is (arrBaseInstID, offsetID) when storing into an array element
+        instNode, instList, operands = value
         varAssign = False
         # used in copy propagation. we want to save a copy of this version
         if len(instList) == 0 and operands[0] == 1:
             varAssign = True
             instList = [operands]
-        if LHSArray:
+        if arrayAddr is not None:
+            arrBaseInstID, offsetID = arrayAddr
             instID, _ = self.ssa.DefineIR(IRTokens.storeToken, currBB, arrBaseInstID, offsetID, storeData=instNode)
             self.ssa.AddKillInst(ident, self.joinStack, currBB, arrBaseInstID)
+        elif self.ssa.sealed:
+            (version, inst, op) = self.ssa.WriteVariable(ident, instNode, currBB, instList)
         else:
             (version, inst, op) = self.ssa.AssignVariable(ident, instNode, currBB, instList, varAssign=varAssign)
             self.ssa.AddPhiNode(ident, inst, self.joinStack, currBB, varAssign=varAssign, operands=operands)
@@ -232,13 +290,9 @@ class Parser:
         if self.debug:
             print(f'Assigning {self.t.GetTokenStr(ident)} to {instNode}, {operands}')
             print(f'Dependency of {self.t.GetTokenStr(ident)} {instList}')
-        if not LHSArray and not varAssign:
+        if arrayAddr is None and not varAssign:
             for n in instList:
                 self.ssa.AddInstDependency(n[0], (version, ident))
-        if self.debug:
-            print(f'{" " * self.level * self.spacing}Exit assignment{self.level}')
-        self.level -= 1
-        return
 
     def funcCall(self):
         # funcCall = “call” ident [2 “(“ [expression { “,” expression } ] “)” ].
@@ -275,10 +329,11 @@ class Parser:
         self.level += 1
         if self.debug:
             print(f'{" " * self.level * self.spacing}In ifStatement{self.level}')
+        if self.trace.parse:
+            self.trace.Emit(TraceEvent.PARSE, f'ifStatement {self.level} at token {self.sym}')
 
         # Get current basic block
         currBB = self.ssa.GetCurrBasicBlock()
-        currBBDom = self.ssa.GetDomList(currBB)
 
         # call relation
         relOp, cmpInstID = self.relation()
@@ -286,26 +341,14 @@ class Parser:
         self.CheckFor(Tokens.thenToken)
 
         # add branch and save its id
-        if relOp == Tokens.eqlToken:    # ==
-            braInstID = self.ssa.DefineIR(IRTokens.bneToken, currBB, cmpInstID, 0)
-        elif relOp == Tokens.neqToken:  # !=
-            braInstID = self.ssa.DefineIR(IRTokens.beqToken, currBB, cmpInstID, 0)
-        elif relOp == Tokens.lssToken:  # <
-            braInstID = self.ssa.DefineIR(IRTokens.bgeToken, currBB, cmpInstID, 0)
-        elif relOp == Tokens.leqToken:  # <=
-            braInstID = self.ssa.DefineIR(IRTokens.bgtToken, currBB, cmpInstID, 0)
-        elif relOp == Tokens.gtrToken:  # >
-            braInstID = self.ssa.DefineIR(IRTokens.bleToken, currBB, cmpInstID, 0)
-        else:  # elif relOp == Tokens.geqToken:  # >=
-            braInstID = self.ssa.DefineIR(IRTokens.bltToken, currBB, cmpInstID, 0)
-
-        braInstID = braInstID[0]
+        braInstID = self.emitBranch(relOp, currBB, cmpInstID)
         # create new block and go to statSequence
-        thenID = self.ssa.CreateNewBasicBlock(currBBDom, [currBB], [currBB], blockType="then\\n")
+        thenID = self.ssa.CreateNewBasicBlock(currBB, [currBB], blockType="then\\n")
        # print(self.ssa.GetCurrBasicBlock(), self.ssa.GetDomList(thenID))
         self.ssa.AddBlockChild(currBB, thenID)
 
-        joinID = self.ssa.CreateNewBasicBlock(currBBDom, [], [currBB], blockType='join\\n')
+        joinID = self.ssa.CreateNewBasicBlock(currBB, [], blockType='join\\n')
+        self.ssa.OpenJoin(joinID)
 
         self.ssa.SetCurrBasicBlock(thenID)
         self.joinStack.append((0, joinID, currBB))
@@ -333,7 +376,7 @@ class Parser:
             # this branches straight to join block
             jmpID, _ = self.ssa.DefineIR(IRTokens.braToken, latestThenID, 0)
 
-            elseID = self.ssa.CreateNewBasicBlock(currBBDom, [currBB], [currBB], blockType="else\\n")
+            elseID = self.ssa.CreateNewBasicBlock(currBB, [currBB], blockType="else\\n")
             self.ssa.AddBlockChild(currBB, elseID)
             self.joinStack.append((1, joinID, currBB))
             self.statSequence()
@@ -368,6 +411,7 @@ class Parser:
         #joinID = self.ssa.CreateNewBasicBlock(currBBDom, joinParent)
         self.ssa.AddBlockParent(joinID, joinParent)
         self.ssa.AddBlockChild(joinParent, joinID)
+        self.ssa.SealBlock(joinID)
 
         #self.ssa.ifElsePhi(latestThenID, joinID, currBB, self.identTable, latestElseID)
 
@@ -399,41 +443,29 @@ class Parser:
         self.level += 1
         if self.debug:
             print(f'{" " * self.level * self.spacing}In whileStatement{self.level}')
+        if self.trace.parse:
+            self.trace.Emit(TraceEvent.PARSE, f'whileStatement {self.level} at token {self.sym}')
 
         # Get current basic block
         entryBB = self.ssa.GetCurrBasicBlock()
-        entryBBDom = self.ssa.GetDomList(entryBB)
 
         if self.ssa.GetFirstInstInBlock(entryBB) == -1:
             entryFirstInst, _ = self.ssa.DefineIR(IRTokens.emptyToken, entryBB)
 
         # create join block
-        joinBB = self.ssa.CreateNewBasicBlock(entryBBDom, [entryBB], [entryBB], blockType="join\\n", joinType=1)
-        joinBBDom = self.ssa.GetDomList(joinBB)
+        joinBB = self.ssa.CreateNewBasicBlock(entryBB, [entryBB], blockType="join\\n", joinType=1)
         self.ssa.AddBlockChild(entryBB, joinBB)
+        self.ssa.OpenJoin(joinBB)
 
         # call relation
         relOp, cmpInstID = self.relation()
 
         # add branch and save its id
-        if relOp == Tokens.eqlToken:    # ==
-            braInstID = self.ssa.DefineIR(IRTokens.bneToken, joinBB, cmpInstID, 0)
-        elif relOp == Tokens.neqToken:  # !=
-            braInstID = self.ssa.DefineIR(IRTokens.beqToken, joinBB, cmpInstID, 0)
-        elif relOp == Tokens.lssToken:  # <
-            braInstID = self.ssa.DefineIR(IRTokens.bgeToken, joinBB, cmpInstID, 0)
-        elif relOp == Tokens.leqToken:  # <=
-            braInstID = self.ssa.DefineIR(IRTokens.bgtToken, joinBB, cmpInstID, 0)
-        elif relOp == Tokens.gtrToken:  # >
-            braInstID = self.ssa.DefineIR(IRTokens.bleToken, joinBB, cmpInstID, 0)
-        else:  # elif relOp == Tokens.geqToken:  # >=
-            braInstID = self.ssa.DefineIR(IRTokens.bltToken, joinBB, cmpInstID, 0)
-
-        braInstID = braInstID[0]
+        braInstID = self.emitBranch(relOp, joinBB, cmpInstID)
         self.CheckFor(Tokens.doToken)
         self.joinStack.append((2, joinBB, entryBB))
         # doBlock
-        doBB = self.ssa.CreateNewBasicBlock(joinBBDom, [joinBB], [joinBB], blockType="do\\n", joinBlocks=self.joinStack)
+        doBB = self.ssa.CreateNewBasicBlock(joinBB, [joinBB], blockType="do\\n", joinBlocks=self.joinStack)
 
         # connect join block with do block for loop body
         #self.ssa.AddBlockParent(joinBB, doBB)
@@ -447,22 +479,43 @@ class Parser:
         self.CheckFor(Tokens.odToken)
         self.ssa.AddBlockChild(latestDoBB, joinBB)
         self.ssa.AddBlockParent(joinBB, latestDoBB)
+        self.ssa.SealBlock(joinBB)
 
         # reconcile phi function
         joinFirstID = self.ssa.GetFirstInstInBlock(joinBB)
-        self.ssa.DefineIR(IRTokens.braToken, latestDoBB, joinFirstID)
+        backInstID, _ = self.ssa.DefineIR(IRTokens.braToken, latestDoBB, joinFirstID)
+        if self.ssa.sealed:
+            # header phis can still be removed when an enclosing loop is sealed
+            self.branchInsts.append((0, backInstID, joinBB))
 
-        exitBB = self.ssa.CreateNewBasicBlock(joinBBDom, [joinBB], [joinBB], "exit\\n")
+        exitBB = self.ssa.CreateNewBasicBlock(joinBB, [joinBB], "exit\\n")
 
         self.ssa.AddBlockChild(joinBB, exitBB)
         #self.PrintSSA()
-        self.ssa.whilePhi(joinBB, latestDoBB, self.identTable)
+        if not self.ssa.sealed:
+            self.ssa.whilePhi(joinBB, latestDoBB, self.symbols)
         self.joinStack.pop()
         self.ssa.AddBlockJoinStack(exitBB, self.joinStack)
         # exitInstID = self.ssa.instructionCount
         # self.ssa.ChangeOperands(braInstID, cmpInstID, exitInstID)
         self.branchInsts.append((1, braInstID, exitBB))
 
+    def emitBranch(self, relOp, bbID, cmpInstID):
+        # branches away from the fall-through block when the relation does not hold
+        if relOp == Tokens.eqlToken:    # ==
+            braInstID = self.ssa.DefineIR(IRTokens.bneToken, bbID, cmpInstID, 0)
+        elif relOp == Tokens.neqToken:  # !=
+            braInstID = self.ssa.DefineIR(IRTokens.beqToken, bbID, cmpInstID, 0)
+        elif relOp == Tokens.lssToken:  # <
+            braInstID = self.ssa.DefineIR(IRTokens.bgeToken, bbID, cmpInstID, 0)
+        elif relOp == Tokens.leqToken:  # <=
+            braInstID = self.ssa.DefineIR(IRTokens.bgtToken, bbID, cmpInstID, 0)
+        elif relOp == Tokens.gtrToken:  # >
+            braInstID = self.ssa.DefineIR(IRTokens.bleToken, bbID, cmpInstID, 0)
+        else:  # elif relOp == Tokens.geqToken:  # >=
+            braInstID = self.ssa.DefineIR(IRTokens.bltToken, bbID, cmpInstID, 0)
+        return braInstID[0]
+
     def returnStatement(self):
         pass
 
@@ -473,13 +526,15 @@ class Parser:
         self.level += 1
         if self.debug:
             print(f'{" " * self.level * self.spacing}In relation{self.level}')
+        if self.trace.parse:
+            self.trace.Emit(TraceEvent.PARSE, f'relation {self.level} at token {self.sym}')
 
         currBB = self.ssa.GetCurrBasicBlock()
         ex1, instList2, var1 = self.expression()
 
         if self.sym not in self.relOp:
             self.t.close()
-            raise SyntaxError(f'Expected relOp, got {self.t.GetTokenStr(self.sym)}')
+            raise SyntaxError(f'Expected relOp, got {self.t.GetTokenStr(self.sym)} at {self.ErrorLocation()}')
 
         relOp = self.sym
         self.next()
@@ -499,32 +554,19 @@ class Parser:
         self.level += 1
         if self.debug:
             print(f'{" " * self.level * self.spacing}In E{self.level}')
+        if self.trace.parse:
+            self.trace.Emit(TraceEvent.PARSE, f'expression {self.level} at token {self.sym}')
         instID, instList, var = self.term()
         currBB = self.ssa.GetCurrBasicBlock()
         if self.debug:
             print(f'{" " * self.level * self.spacing}E{self.level}: Term 1: {instID}')
         while self.sym == Tokens.plusToken or self.sym == Tokens.minusToken:
             op1 = instID
-
-            if self.sym == Tokens.plusToken:
-                self.next()
-                op2, instList2, var2 = self.term()
-                instID, flip = self.ssa.DefineIR(IRTokens.addToken, currBB, op1, op2, var1=var, var2=var2)
-                instList += instList2
-                if flip:
-                    instList.append((instID, var2, var))
-                else:
-                    instList.append((instID, var, var2))
-            elif self.sym == Tokens.minusToken:
-                self.next()
-                op2, instList2, var2 = self.term()
-                instID, flip = self.ssa.DefineIR(IRTokens.subToken, currBB, op1, op2, var1=var, var2=var2)
-                instList += instList2
-                if flip:
-                    instList.append((instID, var2, var))
-                else:
-                    instList.append((instID, var, var2))
-            var = (2, instID)
+            operation = IRTokens.addToken if self.sym == Tokens.plusToken else IRTokens.subToken
+            self.next()
+            right = self.term()
+            op2 = right[0]
+            instID, instList, var = self.emitBinaryOp(operation, currBB, (instID, instList, var), right)
             if self.debug:
                 opvar = instList
                 print(f'{" " * self.level * self.spacing}E{self.level}: Current expression: {instID} {op1} {op2}, {opvar}')
@@ -539,6 +581,8 @@ class Parser:
         self.level += 1
         if self.debug:
             print(f'{" " * self.level * self.spacing}In T{self.level}')
+        if self.trace.parse:
+            self.trace.Emit(TraceEvent.PARSE, f'term {self.level} at token {self.sym}')
 
         instID, instList, var = self.factor()
         currBB = self.ssa.GetCurrBasicBlock()
@@ -547,25 +591,11 @@ class Parser:
 
         while self.sym == Tokens.timesToken or self.sym == Tokens.divToken:
             op1 = instID
-            if self.sym == Tokens.timesToken:
-                self.next()
-                op2, instList2, var2 = self.factor()
-                instID, flip = self.ssa.DefineIR(IRTokens.mulToken, currBB, instID, op2, var1=var, var2=var2)
-                instList += instList2
-                if flip:
-                    instList.append((instID, var2, var))
-                else:
-                    instList.append((instID, var, var2))
-            elif self.sym == Tokens.divToken:
-                self.next()
-                op2, instList2, var2 = self.factor()
-                instID, flip = self.ssa.DefineIR(IRTokens.divToken, currBB, instID, op2, var1=var, var2=var2)
-                instList += instList2
-                if flip:
-                    instList.append((instID, var2, var))
-                else:
-                    instList.append((instID, var, var2))
-            var = (2, instID)
+            operation = IRTokens.mulToken if self.sym == Tokens.timesToken else IRTokens.divToken
+            self.next()
+            right = self.factor()
+            op2 = right[0]
+            instID, instList, var = self.emitBinaryOp(operation, currBB, (instID, instList, var), right)
             if self.debug:
                 opvar = instList
                 print(f'{" " * self.level * self.spacing}T{self.level}: Current term: {instID} {op1} {op2}, {opvar}')
@@ -574,6 +604,18 @@ class Parser:
         self.level -= 1
         return instID, instList, var
 
+    def emitBinaryOp(self, operation, currBB, left, right):
+        # left and right are the (instID, instList, operands) triples returned by expression/term/factor
+        op1, instList, var = left
+        op2, instList2, var2 = right
+        instID, flip = self.ssa.DefineIR(operation, currBB, op1, op2, var1=var, var2=var2)
+        instList += instList2
+        if flip:
+            instList.append((instID, var2, var))
+        else:
+            instList.append((instID, var, var2))
+        return instID, instList, (2, instID)
+
     def factor(self):
         # factor = designator | number | “(“ expression “)” | funcCall
 
@@ -581,6 +623,8 @@ class Parser:
         operands = None
         if self.debug:
             print(f'{" " * self.level * self.spacing}In F{self.level}')
+        if self.trace.parse:
+            self.trace.Emit(TraceEvent.PARSE, f'factor {self.level} at token {self.sym}')
         currBB = self.ssa.GetCurrBasicBlock()
         instList = []
         # number
@@ -591,17 +635,13 @@ class Parser:
             self.next()
         # designator = ident{ "[" expression "]" }
         elif self.sym > 255:
-            # result = self.identTable[self.sym]
             if self.endVarDecl:
-                if self.sym not in self.identTable and self.sym not in self.arrayDict.keys():
-                    raise SyntaxError(f"Undeclared variable {self.t.GetTokenStr(self.sym)}.")
-            if self.sym in self.identTable:
-                instID = self.ssa.GetVarInstNode(self.sym, currBB)
-                varVersion = self.ssa.GetVarVersion(self.sym, currBB)
-                operands = (1, (varVersion[0], self.sym))
+                if self.sym not in self.symbols:
+                    raise SyntaxError(f"Undeclared variable {self.t.GetTokenStr(self.sym)} at {self.ErrorLocation()}.")
+            if self.symbols.IsScalar(self.sym):
+                instID, instList, operands = self.emitVarRead(self.sym, currBB)
                 self.next()
-            elif self.sym in self.arrayDict:
-                print("Loading array")
+            elif self.symbols.IsArray(self.sym):
                 ident = self.sym
                 self.next()
                 arrBaseInstID, offSetID, instList = self.arrayAddrInstCalculation(ident, currBB)
@@ -626,27 +666,56 @@ class Parser:
         self.level -= 1
         return instID, instList, operands
 
+    def emitVarRead(self, ident, currBB):
+        if self.ssa.sealed:
+            version, instID, _ = self.ssa.ReadVariable(ident, currBB)
+            return instID, [], (1, (version, ident))
+        instID = self.ssa.GetVarInstNode(ident, currBB)
+        varVersion = self.ssa.GetVarVersion(ident, currBB)
+        return instID, [], (1, (varVersion[0], ident))
+
     def arrayAddrInstCalculation(self, ident, currBB):
-        print("in load array")
-        print(self.ssa.instructionList)
-        arrSize = self.arrayDict[ident]
-        offSets = self.arrayOffset[ident]
+        if self.trace.parse:
+            self.trace.Emit(TraceEvent.PARSE, f'array address {self.t.GetTokenStr(ident)} in BB{currBB}')
+        return self.emitArrayAddress(ident, currBB, self.arrayIndex)
+
+    def arrayIndex(self, i):
+        # “[“ expression “]”
+        self.CheckFor(Tokens.openbracketToken)
+        value = self.expression()
+        self.CheckFor(Tokens.closebracketToken)
+        return value
+
+    def emitArrayAddress(self, ident, currBB, index):
+        # index(i) evaluates the i-th subscript and returns its (instID, instList, operands)
+        steps = self.arrayAddressSteps(ident, currBB)
+        value = None
+        while True:
+            try:
+                i = steps.send(value)
+            except StopIteration as result:
+                return result.value
+            value = index(i)
+
+    def arrayAddressSteps(self, ident, currBB):
+        # generator form of emitArrayAddress: yields each subscript number and is sent back its value
+        symbol = self.symbols.Lookup(ident)
+        arrSize = symbol.dims
+        offSets = symbol.offsets
         sumOffsetID = -1
         prevInstID = -1
-        arrBaseInstID, flip = self.ssa.DefineIR(IRTokens.addToken, currBB, self.dataBaseAddr, self.arrayAddress[ident],
-                                                var1=(0, self.dataBaseAddr), var2=(0,self.arrayAddress[ident]))
+        arrBaseInstID, flip = self.ssa.DefineIR(IRTokens.addToken, currBB, self.dataBaseAddr, symbol.baseAddr,
+                                                var1=(0, self.dataBaseAddr), var2=(0, symbol.baseAddr))
         loadInstList = []
         # address offset calculations
         # whatever expression is calculated above needs to be multiplied with the precomputed offset
         # A[M][N][O]
         # ex A[i][j][k] loads the address: (base + a_base) + 4*((N*O * i) + (O * j) + k)
-        # the offset is precomputed in self.arrayOffset, so for example, A's offset would have [N*O, O, 1]
+        # the offset is precomputed in the array's Symbol.offsets, so for example, A's offset would have [N*O, O, 1]
 
         for i in range(len(arrSize)):
-            self.CheckFor(Tokens.openbracketToken)
-            instID, instList, operands = self.expression()
+            instID, instList, operands = yield i
             loadInstList += instList
-            self.CheckFor(Tokens.closebracketToken)
             # the last offset is always 1, so no need to multiply it
             if offSets[i][1] != -1:
                 instID, flip = self.ssa.DefineIR(IRTokens.mulToken, currBB,
@@ -683,6 +752,88 @@ class Parser:
         return arrBaseInstID, offSetID, loadInstList
 
 
+def ParseString(source, debug=False, bulkLex=False, identPool=None, sealedSSA=False):
+    """
+    Compiles an in-memory SMPL program without touching the filesystem
+    :param source: program text, bytes, or a file object such as sys.stdin
+    :param identPool: optional tokenizer.IdentPool shared across many compilations
+    :param sealedSSA: use sealed-block SSA construction, see SSA.OpenJoin
+    :return: the Parser after computation() has run
+    """
+    comp = Parser(debug=debug, bulkLex=bulkLex, source=source, identPool=identPool, sealedSSA=sealedSSA)
+    comp.computation()
+    return comp
+
+
+class IncrementalParser:
+    """
+    Recompiles an edited program without starting over.
+    The token stream is kept between edits and only the damaged region is re-lexed. A checkpoint of the
+    SSA is taken before every top-level statement of the main body, see SSA.Checkpoint, so an edit rolls
+    the parser back to the top-level statement enclosing it and parses on from there. Edits in the header
+    or declarations are re-parsed in full. Both the default and the sealed SSA construction are supported.
+    The Parser returned by Edit is rolled back by the next edit, so it must not be changed in between
+    (e.g. by the optimization passes).
+    """
+
+    def __init__(self, source, debug=False, identPool=None, sealedSSA=False):
+        """
+        :param sealedSSA: use sealed-block SSA construction, see SSA.OpenJoin
+        """
+        self.debug = debug
+        self.sealedSSA = sealedSSA
+        self.parser = Parser(debug=debug, bulkLex=True, source=source, identPool=identPool, sealedSSA=sealedSSA)
+        self.t = self.parser.t
+        # (token index of the statement, number of branch instructions, SSA checkpoint) in source order
+        self.checkpoints = []
+        self.Run(self.parser, full=True)
+
+    def RecordStatement(self, parser):
+        self.checkpoints.append((self.t.pos - 1, len(parser.branchInsts), parser.ssa.Checkpoint()))
+
+    def Run(self, parser, full):
+        parser.onStatement = self.RecordStatement
+        try:
+            if full:
+                parser.ssa.RecordUndo()
+                parser.computation()
+            else:
+                parser.statSequence()
+                parser.finishComputation()
+        finally:
+            parser.onStatement = None
+        self.parser = parser
+
+    def Edit(self, start, end, text):
+        """
+        Replaces source[start:end] with text and recompiles
+        :return: the Parser holding the updated SSA
+        """
+        first = self.t.Relex(start, end, text)
+
+        # checkpoints taken at or before the first changed token only depend on unchanged tokens
+        keep = bisect.bisect_right([index for index, _, _ in self.checkpoints], first)
+        if keep == 0:
+            self.checkpoints = []
+            self.t.Seek(0)
+            self.Run(Parser(debug=self.debug, names=self.t, sealedSSA=self.sealedSSA), full=True)
+        else:
+            index, branches, checkpoint = self.checkpoints[keep - 1]
+            del self.checkpoints[keep - 1:]
+            parser = self.parser
+            parser.ssa.Rollback(checkpoint)
+            # the branches patched by emitEnd are reverted by the UndoLog, the list itself only grows
+            del parser.branchInsts[branches:]
+            # empty at a top-level statement, unless the last edit failed to parse. Blocks share the list
+            parser.joinStack.clear()
+            # re-read the statement's first token and re-enter the top-level statSequence
+            self.t.Seek(index)
+            parser.next()
+            parser.level = 0
+            self.Run(parser, full=False)
+        return self.parser
+
+
 if __name__ == '__main__':
     filePath = './tests/whileTests/whileCSERelations'
     #comp = Parser(filePath + ".txt", True)
@@ -0,0 +1,379 @@
+from tokens import IRTokens
+from dominance import DominatorTree
+from tracing import TraceEvent
+
+# expressions whose value only depends on their operands. div is left where it is, moving it could
+# move a division by zero in front of output
+CANDIDATES = bytearray(max(IRTokens) + 1)
+for token in (IRTokens.addToken, IRTokens.subToken, IRTokens.mulToken, IRTokens.cmpToken):
+    CANDIDATES[token] = 1
+
+# an expression that uses the result of another one being moved waits for the next round
+MAX_ROUNDS = 10
+
+
+class PartialRedundancyElimination:
+    """
+    Lazy code motion (Knoop, Ruething and Steffen, in the formulation of Drechsler and Stadel) over a
+    finished SSA. An expression is an operation on two SSA values, so only the blocks defining one of
+    its operands kill it. FindPreviousInst only reuses instructions of dominating blocks, so an
+    expression computed in both arms of an if, or in one arm and after the join, is computed again
+    after the join. Here the computations that are redundant on some paths are deleted, the
+    expression is inserted on the paths where it was missing, as late as possible, and phis merge
+    the values where the paths join. Critical edges that need an insertion are split by a new block.
+    """
+
+    def __init__(self, ssa):
+        """
+        :param ssa: the SSA of a parsed program, see Parser.ssa
+        """
+        self.ssa = ssa
+        self.store = ssa.instructionList
+        self.stats = {'rounds': 0, 'expressions': 0, 'eliminated': 0, 'inserted': 0, 'phis': 0, 'split': 0}
+
+    def Run(self):
+        """
+        :return: stats, number of rounds, expressions moved, computations eliminated, computations
+                 inserted, phis added and critical edges split
+        """
+        for _ in range(MAX_ROUNDS):
+            self.stats['rounds'] += 1
+            if not self.Round():
+                break
+        if self.ssa.trace.opt:
+            self.ssa.trace.Emit(TraceEvent.OPT, f'pre {self.stats}')
+        return self.stats
+
+    def Round(self):
+        """
+        :return: whether anything was changed
+        """
+        self.tree = DominatorTree(self.ssa.BBList)
+        self.dead = []
+        self.Collect()
+        if not self.expressions:
+            self.ssa.RemoveInsts(self.dead)
+            return bool(self.dead)
+        self.Solve()
+
+        # expressions using the result of one that is moved are left for the next round
+        moved = 0
+        for bbID in self.tree.rpo:
+            moved |= self.delete[bbID]
+        for instID, index in self.expressionOf.items():
+            if moved >> index & 1:
+                for operand in self.operandsOf[instID]:
+                    if operand in self.expressionOf and moved >> self.expressionOf[operand] & 1:
+                        moved &= ~(1 << index)
+                        break
+
+        inserts = {}
+        for child in self.tree.rpo:
+            for parent in self.ssa.BBList[child].parents:
+                if self.tree.rpoIndex[parent] != -1 and self.Insert((parent, child)) & moved:
+                    inserts[(parent, child)] = self.Insert((parent, child))
+        self.splits = {}  # (parent, child) -> block put on the edge
+        for index in range(len(self.expressions)):
+            if moved >> index & 1:
+                self.Transform(index, [edge for edge, mask in inserts.items() if mask >> index & 1])
+        self.ssa.RemoveInsts(self.dead)
+        return bool(moved) or bool(self.dead)
+
+    def Collect(self):
+        # expressions, their instances and the local properties of each block
+        store = self.store
+        blocks = self.ssa.BBList
+        self.expressions = []  # index -> (operation, operand1, operand2) of the first instance found
+        indexes = {}
+        self.instances = {}  # (bbID, index) -> instID
+        self.expressionOf = {}  # instance -> index
+        self.operandsOf = {}  # instance -> its operands
+        usedBy = {}  # instID -> expressions using it as an operand
+        for bbID in self.tree.rpo:
+            for instID in blocks[bbID].instructions:
+                operation = store.opcodes[instID]
+                if not CANDIDATES[operation] or not store.active[instID]:
+                    continue
+                op1, op2 = store.GetOperand(1, instID), store.GetOperand(2, instID)
+                key = (operation, op1, op2)
+                if operation in self.ssa.operandAgnostic and type(op1) is int and type(op2) is int and op2 < op1:
+                    key = (operation, op2, op1)
+                index = indexes.get(key)
+                if index is None:
+                    index = indexes[key] = len(self.expressions)
+                    self.expressions.append((operation, op1, op2))
+                    for operand in (op1, op2):
+                        usedBy[operand] = usedBy.get(operand, 0) | 1 << index
+                first = self.instances.setdefault((bbID, index), instID)
+                if first != instID:
+                    # computed twice in the same block
+                    self.ssa.ReplaceAllUses(instID, first)
+                    self.dead.append(instID)
+                    self.stats['eliminated'] += 1
+                    continue
+                self.expressionOf[instID] = index
+                self.operandsOf[instID] = (op1, op2)
+
+        count = len(blocks)
+        self.all = (1 << len(self.expressions)) - 1
+        self.comp = [0] * count
+        self.antloc = [0] * count
+        self.transp = [self.all] * count
+        for bbID in self.tree.rpo:
+            for instID in blocks[bbID].instructions:
+                self.transp[bbID] &= ~usedBy.get(instID, 0)
+        for (bbID, index), instID in self.instances.items():
+            self.comp[bbID] |= 1 << index
+            op1, op2 = self.operandsOf[instID]
+            # an instance after the definition of one of its operands is not computed on entry
+            if not any(type(operand) is int and 0 <= operand < len(store) and store.placement[operand] == bbID
+                       for operand in (op1, op2)):
+                self.antloc[bbID] |= 1 << index
+
+    def Solve(self):
+        # global properties, one bit per expression
+        blocks = self.ssa.BBList
+        rpo = self.tree.rpo
+        entry = self.tree.entry
+        count = len(blocks)
+        everything = self.all
+        comp, antloc, transp = self.comp, self.antloc, self.transp
+
+        # available: computed on every path from the entry
+        self.avout = avout = [everything] * count
+        avout[entry] = comp[entry]
+        changed = True
+        while changed:
+            changed = False
+            for bbID in rpo:
+                if bbID == entry:
+                    continue
+                avin = everything
+                for parent in blocks[bbID].parents:
+                    avin &= avout[parent]
+                value = comp[bbID] | (avin & transp[bbID])
+                if value != avout[bbID]:
+                    avout[bbID] = value
+                    changed = True
+
+        # anticipated: computed on every path to the exit before an operand is defined
+        self.antin = antin = [everything] * count
+        self.antout = antout = [0] * count
+        changed = True
+        while changed:
+            changed = False
+            for bbID in reversed(rpo):
+                out = everything if len(blocks[bbID].children) else 0
+                for child in blocks[bbID].children:
+                    out &= antin[child]
+                antout[bbID] = out
+                value = antloc[bbID] | (out & transp[bbID])
+                if value != antin[bbID]:
+                    antin[bbID] = value
+                    changed = True
+
+        # later: the insertion can still be moved down to the entry of the block
+        self.laterin = laterin = [everything] * count
+        laterin[entry] = 0
+        changed = True
+        while changed:
+            changed = False
+            for bbID in rpo:
+                if bbID == entry:
+                    continue
+                value = everything
+                for parent in blocks[bbID].parents:
+                    value &= self.Later((parent, bbID))
+                if value != laterin[bbID]:
+                    laterin[bbID] = value
+                    changed = True
+        self.delete = [antloc[bbID] & ~laterin[bbID] if bbID != entry else 0 for bbID in range(count)]
+
+    def Earliest(self, edge):
+        parent, child = edge
+        return self.antin[child] & ~self.avout[parent] & (~self.transp[parent] | ~self.antout[parent])
+
+    def Later(self, edge):
+        parent = edge[0]
+        return self.Earliest(edge) | (self.laterin[parent] & ~self.antloc[parent])
+
+    def Insert(self, edge):
+        return self.Later(edge) & ~self.laterin[edge[1]]
+
+    def Transform(self, index, inserts):
+        """
+        Inserts the expression on the given edges, then replaces the deleted instances by the value
+        reaching their block, with phis where paths with different values join
+        """
+        ssa = self.ssa
+        store = self.store
+        blocks = ssa.BBList
+        operation, operand1, operand2 = self.expressions[index]
+        bit = 1 << index
+
+        # value of the expression at the entry and at the exit of blocks
+        entries = {}
+        exits = {}
+        deleted = []
+        for (bbID, expression), instID in self.instances.items():
+            if expression != index:
+                continue
+            if self.delete[bbID] & bit:
+                deleted.append(instID)
+            else:
+                exits[bbID] = instID
+
+        for parent, child in inserts:
+            size = len(store)
+            if (parent, child) in self.splits:
+                bbID = self.splits[(parent, child)]
+                instID = exits[bbID] = self.Emit(operation, bbID, operand1, operand2, self.EndPosition(bbID))
+            elif len(blocks[parent].children) == 1:
+                instID = exits[parent] = self.Emit(operation, parent, operand1, operand2, self.EndPosition(parent))
+            elif len(blocks[child].parents) == 1:
+                instID = entries[child] = self.Emit(operation, child, operand1, operand2, self.StartPosition(child))
+            else:
+                bbID, instID = self.SplitEdge(parent, child, operation, operand1, operand2)
+                self.splits[(parent, child)] = bbID
+                exits[bbID] = instID
+            # CSE in DefineIR hands back an equal instruction that already dominates the edge
+            if instID >= size:
+                self.stats['inserted'] += 1
+
+        phis = []
+        values = {instID: self.EntryValue(store.placement[instID], entries, exits, phis) for instID in deleted}
+        for instID, value in values.items():
+            # CSE in DefineIR can hand back an instance that is deleted here
+            while value in values:
+                value = values[value]
+            ssa.ReplaceAllUses(instID, value)
+            self.dead.append(instID)
+        self.stats['eliminated'] += len(deleted)
+        self.stats['expressions'] += 1
+        self.stats['phis'] += len(phis) - self.RemoveTrivialPhis(phis)
+        if ssa.trace.opt:
+            ssa.trace.Emit(TraceEvent.OPT, f'pre {ssa.opDct[operation]} {operand1} {operand2}: deleted {deleted}, '
+                                           f'{len(inserts)} inserted')
+
+    def EntryValue(self, bbID, entries, exits, phis):
+        """
+        :return: the value of the expression on entry to bbID, it is available on every path into the block
+        """
+        blocks = self.ssa.BBList
+        work = [bbID]
+        pending = []
+        while work:
+            block = work[-1]
+            if block in entries:
+                work.pop()
+                continue
+            parents = blocks[block].parents
+            if len(parents) == 1:
+                parent = parents[0]
+                if parent in exits:
+                    entries[block] = exits[parent]
+                elif parent in entries:
+                    entries[block] = entries[parent]
+                else:
+                    work.append(parent)
+                    continue
+                work.pop()
+            elif len(parents) > 1:
+                # placeholder first, so paths coming back around a loop find it
+                entries[block], _ = self.ssa.DefineIR(IRTokens.phiToken, block)
+                phis.append(entries[block])
+                pending.append(block)
+                work.pop()
+                work.extend(parent for parent in parents if parent not in exits and parent not in entries)
+            else:
+                raise RuntimeError(f'PRE: no value for BB{bbID}, it does not reach the entry')
+        for block in pending:
+            operands = [exits[parent] if parent in exits else entries[parent] for parent in blocks[block].parents]
+            self.ssa.SetPhiOperands(entries[block], operands[0], operands[1])
+        return entries[bbID]
+
+    def RemoveTrivialPhis(self, phis):
+        """
+        Replaces the new phis that only merge one value (besides themselves) by that value
+        :return: number of phis removed
+        """
+        ssa = self.ssa
+        store = self.store
+        created = set(phis)
+        removed = set()
+        work = list(phis)
+        while work:
+            phiID = work.pop()
+            if phiID in removed:
+                continue
+            operands = {store.operand1[phiID], store.operand2[phiID]} - {phiID}
+            if len(operands) != 1:
+                continue
+            same = operands.pop()
+            removed.add(phiID)
+            users = ssa.ReplaceAllUses(phiID, same)
+            work.extend(user for user in users if user in created)
+        self.dead.extend(removed)
+        return len(removed)
+
+    def SplitEdge(self, parent, child, operation, operand1, operand2):
+        """
+        Puts a new block computing operation on the edge parent -> child
+        :return: (block ID, instruction ID of the computation)
+        """
+        ssa = self.ssa
+        store = self.store
+        current = ssa.GetCurrBasicBlock()
+        bbID = ssa.CreateNewBasicBlock(parent, [parent])
+        ssa.SetCurrBasicBlock(current)
+        block = ssa.BBList[bbID]
+        block.AddChild(child)
+        parents = ssa.BBList[child].parents
+        parents[list(parents).index(parent)] = bbID
+        children = ssa.BBList[parent].children
+        children.remove(child)
+        ssa.BBList[parent].AddChild(bbID)
+
+        instID = self.Emit(operation, bbID, operand1, operand2, -1)
+        target = ssa.GetFirstInstInBlock(child)
+        if target == -1:
+            target, _ = ssa.DefineIR(IRTokens.emptyToken, child)
+        ssa.DefineIR(IRTokens.braToken, bbID, target)
+        # a branch to child now goes through the new block
+        insts = ssa.BBList[parent].instructions
+        if insts and IRTokens.braToken <= store.opcodes[insts[-1]] <= IRTokens.bgtToken:
+            column = 1 if store.opcodes[insts[-1]] == IRTokens.braToken else 2
+            branchTarget = store.GetOperand(column, insts[-1])
+            if type(branchTarget) is int and 0 <= branchTarget < len(store) and store.placement[branchTarget] == child:
+                store.SetOperand(column, insts[-1], ssa.GetFirstInstInBlock(bbID))
+        self.stats['split'] += 1
+        return bbID, instID
+
+    def Emit(self, operation, bbID, operand1, operand2, position):
+        instID, _ = self.ssa.DefineIR(operation, bbID, operand1, operand2, inst_position=position)
+        return instID
+
+    def EndPosition(self, bbID):
+        # in front of the branch that ends the block, if it has one
+        opcodes = self.store.opcodes
+        insts = self.ssa.BBList[bbID].instructions
+        if insts and IRTokens.braToken <= opcodes[insts[-1]] <= IRTokens.bgtToken:
+            return len(insts) - 1
+        return -1
+
+    def StartPosition(self, bbID):
+        # after the phis at the top of the block
+        opcodes = self.store.opcodes
+        insts = self.ssa.BBList[bbID].instructions
+        for i, instID in enumerate(insts):
+            if opcodes[instID] != IRTokens.phiToken:
+                return i
+        return -1
+
+
+def EliminatePartialRedundancies(ssa):
+    """
+    Runs PartialRedundancyElimination on a parsed program
+    :return: stats of the pass, see PartialRedundancyElimination.Run
+    """
+    return PartialRedundancyElimination(ssa).Run()
@@ -0,0 +1,303 @@
+from tokens import IRTokens
+from dominance import DominatorTree
+from tracing import TraceEvent
+import dce
+
+# lattice of instruction values: no entry in ConstantPropagation.values means not known yet (top),
+# an int is a constant, VARIES means the value is not constant (bottom)
+VARIES = None
+
+# conditional branches: whether the branch is taken for the value of its cmp
+BRANCH_TAKEN = {
+    IRTokens.bneToken: lambda c: c != 0,
+    IRTokens.beqToken: lambda c: c == 0,
+    IRTokens.bltToken: lambda c: c < 0,
+    IRTokens.bleToken: lambda c: c <= 0,
+    IRTokens.bgtToken: lambda c: c > 0,
+    IRTokens.bgeToken: lambda c: c >= 0,
+}
+
+
+def Wrap(value):
+    # arithmetic is done on 32 bit two's complement registers
+    return (value + (1 << 31)) % (1 << 32) - (1 << 31)
+
+
+def Fold(operation, a, b):
+    """
+    :return: the value of operation on constants a and b, VARIES if it cannot be computed at compile time
+    """
+    if operation == IRTokens.addToken:
+        return Wrap(a + b)
+    if operation == IRTokens.subToken:
+        return Wrap(a - b)
+    if operation == IRTokens.mulToken:
+        return Wrap(a * b)
+    if operation == IRTokens.divToken:
+        if b == 0:
+            return VARIES
+        # division truncates towards zero
+        quotient = abs(a) // abs(b)
+        return Wrap(quotient if (a >= 0) == (b >= 0) else -quotient)
+    if operation == IRTokens.cmpToken:
+        return (a > b) - (a < b)
+    return VARIES
+
+
+class ConstantPropagation:
+    """
+    Sparse conditional constant propagation (Wegman and Zadeck) over a finished SSA.
+    Values are only propagated along control flow edges found executable, so a branch on a constant
+    comparison leaves the blocks behind its other edge unreachable. Then
+        arithmetic, cmp and phis with a constant value are replaced by a const from block 0,
+        branches on constant comparisons become a bra or fall through,
+        unreachable blocks are emptied and taken out of the control flow graph (their idom becomes -1),
+        phis lose the operands of removed edges, and phis whose inputs agree are replaced by that input.
+    Instructions left without uses are removed by DeadCodeElimination afterwards.
+    """
+
+    def __init__(self, ssa):
+        """
+        :param ssa: the SSA of a parsed program, see Parser.ssa
+        """
+        self.ssa = ssa
+        self.store = ssa.instructionList
+        self.values = {}  # instID -> int or VARIES
+        self.reachable = bytearray(len(ssa.BBList))
+        self.edges = set()  # executable (parent, child) edges
+        self.stats = {'folded': 0, 'branches': 0, 'phis': 0, 'unreachable': 0, 'removed': 0}
+
+    def Run(self, removeDead=True):
+        """
+        :param removeDead: run DeadCodeElimination once the program has been rewritten
+        :return: stats, number of instructions folded to constants, branches resolved, phis replaced,
+                 blocks found unreachable and instructions removed
+        """
+        self.Solve()
+        self.Rewrite()
+        if removeDead:
+            self.stats['removed'] += dce.EliminateDeadCode(self.ssa)
+        if self.ssa.trace.opt:
+            self.ssa.trace.Emit(TraceEvent.OPT, f'sccp {self.stats}')
+        return self.stats
+
+    def Solve(self):
+        store = self.store
+        blocks = self.ssa.BBList
+        self.edgeWork = [(-1, 0)]
+        self.instWork = []
+        while self.edgeWork or self.instWork:
+            while self.edgeWork:
+                parent, bbID = self.edgeWork.pop()
+                if (parent, bbID) in self.edges:
+                    continue
+                self.edges.add((parent, bbID))
+                if self.reachable[bbID]:
+                    # a new way into a visited block only changes its phis
+                    for instID in blocks[bbID].instructions:
+                        if store.opcodes[instID] == IRTokens.phiToken:
+                            self.Visit(instID)
+                    continue
+                self.reachable[bbID] = 1
+                for instID in blocks[bbID].instructions:
+                    self.Visit(instID)
+                self.VisitSuccessors(bbID)
+            while self.instWork:
+                instID = self.instWork.pop()
+                for user in store.GetUsers(instID):
+                    bbID = store.placement[user]
+                    if bbID != -1 and self.reachable[bbID]:
+                        self.Visit(user)
+
+    def Visit(self, instID):
+        store = self.store
+        operation = store.opcodes[instID]
+        if IRTokens.bneToken <= operation <= IRTokens.bgtToken:
+            self.VisitSuccessors(store.placement[instID])
+            return
+        if operation == IRTokens.phiToken:
+            value = self.EvaluatePhi(instID)
+        elif operation == IRTokens.constToken:
+            value = store.GetOperand(1, instID)
+            if type(value) is not int:
+                value = VARIES
+        elif IRTokens.addToken <= operation <= IRTokens.cmpToken:
+            a, b = self.Value(store.GetOperand(1, instID)), self.Value(store.GetOperand(2, instID))
+            if a is VARIES or b is VARIES:
+                value = VARIES
+            elif a is Ellipsis or b is Ellipsis:
+                return
+            else:
+                value = Fold(operation, a, b)
+        else:
+            value = VARIES
+        if value is Ellipsis:
+            return
+        if instID not in self.values or (self.values[instID] is not VARIES and self.values[instID] != value):
+            # values only move down the lattice, a second constant means the value varies
+            self.values[instID] = value if instID not in self.values else VARIES
+            self.instWork.append(instID)
+
+    def Value(self, operand):
+        # lattice value of an operand, Ellipsis while it is not known yet
+        store = self.store
+        if type(operand) is not int or not 0 <= operand < len(store) or store.placement[operand] == -1:
+            return VARIES
+        return self.values.get(operand, Ellipsis)
+
+    def EvaluatePhi(self, phiID):
+        store = self.store
+        bbID = store.placement[phiID]
+        parents = self.ssa.BBList[bbID].parents
+        value = Ellipsis
+        for column in (1, 2):
+            if column > len(parents) or (parents[column - 1], bbID) not in self.edges:
+                continue
+            operand = self.Value(store.GetOperand(column, phiID))
+            if operand is Ellipsis:
+                continue
+            if operand is VARIES or (value is not Ellipsis and value != operand):
+                return VARIES
+            value = operand
+        return value
+
+    def VisitSuccessors(self, bbID):
+        for child in self.Successors(bbID):
+            self.edgeWork.append((bbID, child))
+
+    def Successors(self, bbID):
+        # children reached from bbID given what is known about its branch condition
+        store = self.store
+        block = self.ssa.BBList[bbID]
+        instID = self.Terminator(bbID)
+        if instID == -1:
+            return list(block.children)
+        operation = store.opcodes[instID]
+        if operation == IRTokens.braToken:
+            target = self.TargetBlock(instID, 1)
+            return list(block.children) if target == -1 else [target]
+        condition = self.Value(store.GetOperand(1, instID))
+        target = self.TargetBlock(instID, 2)
+        if condition is Ellipsis:
+            return []
+        if condition is VARIES or target == -1:
+            return list(block.children)
+        if BRANCH_TAKEN[operation](condition):
+            return [target]
+        return [child for child in block.children if child != target][:1]
+
+    def Terminator(self, bbID):
+        # the branch ending bbID, -1 if it falls through
+        opcodes = self.store.opcodes
+        for instID in reversed(self.ssa.BBList[bbID].instructions):
+            if IRTokens.braToken <= opcodes[instID] <= IRTokens.bgtToken:
+                return instID
+        return -1
+
+    def TargetBlock(self, instID, column):
+        store = self.store
+        target = store.GetOperand(column, instID)
+        if type(target) is not int or not 0 <= target < len(store):
+            return -1
+        return store.placement[target]
+
+    def Rewrite(self):
+        ssa = self.ssa
+        store = self.store
+        blocks = ssa.BBList
+        dead = set()
+
+        # branches on constant comparisons
+        for bbID in range(len(blocks)):
+            instID = self.Terminator(bbID) if self.reachable[bbID] else -1
+            operation = store.opcodes[instID] if instID != -1 else None
+            if operation not in BRANCH_TAKEN:
+                continue
+            condition = self.Value(store.GetOperand(1, instID))
+            target = self.TargetBlock(instID, 2)
+            if condition is VARIES or condition is Ellipsis or target == -1:
+                continue
+            dead.add(instID)
+            if BRANCH_TAKEN[operation](condition):
+                ssa.DefineIR(IRTokens.braToken, bbID, store.GetOperand(2, instID))
+            self.stats['branches'] += 1
+            if ssa.trace.opt:
+                ssa.trace.Emit(TraceEvent.OPT, f'sccp resolves branch {instID} in BB{bbID}')
+
+        # edges that are never taken, and everything in unreachable blocks
+        for bbID, block in enumerate(blocks):
+            for child in list(block.children):
+                if (bbID, child) not in self.edges:
+                    dead.update(self.RemoveEdge(bbID, child))
+        for bbID, block in enumerate(blocks):
+            if not self.reachable[bbID]:
+                self.stats['unreachable'] += 1
+                dead.update(block.instructions)
+        ssa.RemoveInsts(dead)
+
+        # constants
+        for bbID, block in enumerate(blocks):
+            if not self.reachable[bbID]:
+                continue
+            for instID in list(block.instructions):
+                operation = store.opcodes[instID]
+                if operation != IRTokens.phiToken and not IRTokens.addToken <= operation <= IRTokens.cmpToken:
+                    continue
+                value = self.values.get(instID, VARIES)
+                if value is VARIES:
+                    continue
+                constID, _ = ssa.DefineIR(IRTokens.constToken, 0, value)
+                ssa.ReplaceAllUses(instID, constID)
+                self.stats['folded'] += 1
+                if ssa.trace.opt:
+                    ssa.trace.Emit(TraceEvent.OPT, f'sccp folds {instID} to {value}')
+
+        # phis whose two inputs are the same instruction
+        for block in blocks:
+            for instID in block.instructions:
+                if store.opcodes[instID] == IRTokens.phiToken and store.GetUsers(instID):
+                    op1, op2 = store.operand1[instID], store.operand2[instID]
+                    if op1 == op2 and op1 >= 0:
+                        ssa.ReplaceAllUses(instID, op1)
+                        self.stats['phis'] += 1
+
+        # removing edges can move immediate dominators down, unreachable blocks get -1
+        tree = DominatorTree(blocks)
+        ssa.idom = tree.idom
+        ssa.idom[0] = -1
+        ssa.varMemo = {}
+
+    def RemoveEdge(self, parent, child):
+        """
+        Takes parent -> child out of the control flow graph. The phis of child are replaced by their
+        operand for the other parent
+        :return: the phis that were replaced
+        """
+        ssa = self.ssa
+        store = self.store
+        block = ssa.BBList[child]
+        replaced = []
+        if parent in block.parents:
+            index = list(block.parents).index(parent)
+            for instID in block.instructions:
+                # phis of unreachable blocks are deleted with the block
+                if store.opcodes[instID] != IRTokens.phiToken or not self.reachable[child]:
+                    continue
+                # operand1 comes from the first parent and operand2 from the second
+                other = store.GetOperand(2 if index == 0 else 1, instID)
+                if other == instID:
+                    continue
+                ssa.ReplaceAllUses(instID, other)
+                replaced.append(instID)
+                self.stats['phis'] += 1
+            block.parents.remove(parent)
+        ssa.BBList[parent].children.remove(child)
+        return replaced
+
+
+def PropagateConstants(ssa, removeDead=True):
+    """
+    Runs ConstantPropagation on a parsed program
+    :return: stats of the pass, see ConstantPropagation.Run
+    """
+    return ConstantPropagation(ssa).Run(removeDead)
@@ -1,6 +1,19 @@
 from __future__ import annotations
 from cfg import *
 from tokens import *
+import tracing
+from tracing import TraceEvent
+from bisect import bisect_left
+from array import array
+from dominance import DominatorTree
+
+# spacing of the order labels given to appended instructions, see SSA.PlaceInst
+ORDER_GAP = 1 << 16
+
+# what counts as a value of a variable in a block's value table, see SSA.FindVarBlock
+VAR_ANY = 0  # any entry (ReadVariable)
+VAR_ACTIVE = 1  # an entry whose instruction is active (GetVarInstNode)
+VAR_VERSION = 2  # VAR_ACTIVE, or version 0 in a while join block (GetVarVersion)
 
 
 class SSA:
@@ -8,7 +21,7 @@ class SSA:
     Maintains control flow graphs, basic blocks, value tables
     """
 
-    def __init__(self, tokenizer, debug=False):
+    def __init__(self, tokenizer, debug=False, sealed=False):
         self.opDct = {
             IRTokens.constToken: "const",
             IRTokens.addToken: 'add',
@@ -66,7 +79,9 @@ class SSA:
         ]
 
         self.instructionCount = 0  # always incrementing
-        self.instructionList = []
+        self.instructionList = InstructionStore()  # indexed by instID, see cfg.InstructionStore
+        # value table entries are (version, instID, history), history is a reference into this log
+        self.histories = HistoryLog()
 
         # I guess we don't need this if we're just appending to BBList
         # and never deleting
@@ -77,13 +92,70 @@ class SSA:
         block1 = BasicBlock(self.GetNextBBID())
         self.BBList[0].AddChild(block1.bbID)
         block1.AddParent(0)
-        block1.AddDominator(0)
-        block1.AddIDominator(0)
         self.BBList.append(block1)
+        # immediate dominator of each block, -1 for block 0. The parser creates blocks in structured
+        # order, so a block's immediate dominator is known when it is created, see Dominators
+        self.idom = array('i', (-1, 0))
         self.CurrentBasicBlock = 1
         self.t = tokenizer
 
         self.phiNodes = []
+        self.trace = tracing.GetTracer()
+
+        # constants live in block 0, see DefineIR
+        self.constants = ConstantPool()
+
+        # sealed-block construction (sealed=True), see OpenJoin/SealBlock
+        # variables are looked up on demand and loop headers get their phis while the body is parsed,
+        # instead of the AddPhiNode/whilePhi passes patching the loop body afterwards
+        self.sealed = sealed
+        self.unsealedBlocks = set()
+        self.incompletePhis = {}  # bbID -> {varToken: phiID}, operands filled in by SealBlock
+        self.assignedVars = []  # (joinID, variables assigned since OpenJoin), innermost last
+        self.phiDefs = {}  # phiID -> [(bbID, varToken)] value table entries holding it
+        self.varVersions = {}  # varToken -> last version handed out
+
+        # variable lookups, see FindVarBlock
+        # varToken -> one {bbID: closest dominator holding a value} dict per VAR_* lookup kind,
+        # dropped whenever a value table entry of the variable changes (InvalidateVar)
+        self.varMemo = {}
+
+        # UndoLog shared by the instruction store, constants and blocks, see RecordUndo
+        self.undo = None
+
+    def RecordUndo(self):
+        """
+        Starts recording the changes made from now on, so Rollback can return to a Checkpoint.
+        Covers what parsing changes in both the default and the sealed construction.
+        """
+        self.undo = UndoLog()
+        self.instructionList.undo = self.undo
+        self.constants.undo = self.undo
+        for block in self.BBList:
+            block.undo = self.undo
+
+    def Checkpoint(self):
+        """
+        :return: the current state, for Rollback. Only needs the lengths of the tables that are
+                 appended to and a mark in the UndoLog
+        """
+        return self.undo.Mark(), len(self.instructionList), len(self.histories), len(self.BBList), \
+            self.CurrentBasicBlock
+
+    def Rollback(self, checkpoint):
+        """
+        Returns to a Checkpoint taken since RecordUndo, in time proportional to the changes made after it
+        """
+        mark, instructions, histories, blocks, current = checkpoint
+        self.undo.Rollback(mark)
+        self.instructionList.Truncate(instructions)
+        self.histories.Truncate(histories)
+        del self.BBList[blocks:]
+        del self.idom[blocks:]
+        self.instructionCount = instructions
+        self.basicBlockCount = blocks
+        self.CurrentBasicBlock = current
+        self.varMemo = {}
 
     def GetNextBBID(self):
         # Gets the next BBID and increments BBID count
@@ -97,11 +169,46 @@ class SSA:
         return ID
 
     def GetInstPosInBB(self, instID, bb_id):
+        # index of the instruction in the block's instruction list, -1 if it is not in that block
+        store = self.instructionList
+        if type(instID) is not int or not 0 <= instID < len(store) or store.placement[instID] != bb_id:
+            return -1
+        # the list is sorted by order label, so the index can be found by bisection
+        return bisect_left(self.BBList[bb_id].instructions, store.order[instID], key=store.order.__getitem__)
+
+    def PlaceInst(self, bb_id, instID, position=-1):
+        """
+        Adds an instruction to a block's instruction list and keeps the instruction -> block and
+        order label indexes up to date
+        :param position: index to insert at with list.insert semantics, -1 appends
+        """
+        store = self.instructionList
+        order = store.order
         insts = self.BBList[bb_id].instructions
-        for i in range(len(insts)):
-            if insts[i] == instID:
-                return i
-        return -1
+        # the placement and order label of instID are rolled back with its row, see InstructionStore.Truncate
+        store.placement[instID] = bb_id
+        if position == -1 or position >= len(insts):
+            order[instID] = order[insts[-1]] + ORDER_GAP if insts else 0
+            insts.append(instID)
+            if self.undo is not None:
+                self.undo.Add(insts.pop)
+            return
+        if position < 0:
+            position = max(position + len(insts), 0)
+        insts.insert(position, instID)
+        if self.undo is not None:
+            self.undo.Add(insts.pop, position)
+        nextLabel = order[insts[position + 1]]
+        if position == 0:
+            order[instID] = nextLabel - ORDER_GAP
+        elif nextLabel - order[insts[position - 1]] >= 2:
+            order[instID] = (order[insts[position - 1]] + nextLabel) // 2
+        else:
+            # no room between the neighbours, respace the whole block
+            for i, inst in enumerate(insts):
+                if self.undo is not None:
+                    self.undo.Add(order.__setitem__, inst, order[inst])
+                order[inst] = i * ORDER_GAP
 
     def DefineIR(self, operation, bb_id, operand1=None, operand2=None, inst_position=-1, var1=None, var2=None, storeData=None):
         """
@@ -113,73 +220,76 @@ class SSA:
         :return: instruction node ID (either one seen previously or a newly generated one)
         """
 
-        instID = self.FindPreviousInst(operation, operand1, operand2, bb_id, inst_position=inst_position)
+        # phi nodes are always created, so skip the lookup for them
+        instID = -1
+        if operation != IRTokens.phiToken:
+            instID = self.FindPreviousInst(operation, operand1, operand2, bb_id, inst_position=inst_position)
         # if no instructions are found, create a new instruction
-        if instID == -1 or operation == IRTokens.phiToken:
+        if instID == -1:
             if operation in self.operandAgnostic:
                 instID = self.FindPreviousInst(operation, operand2, operand1, bb_id)
                 if instID != -1:
+                    if self.trace.cse:
+                        self.trace.Emit(TraceEvent.CSE, f'{self.opDct[operation]} {operand2} {operand1} in BB{bb_id} '
+                                                        f'reuses {instID}')
                     return instID, True
             instID = self.GetNextInstID()
+            if self.trace.ir:
+                self.trace.Emit(TraceEvent.IR, f'({instID}, {bb_id}): {self.opDct[operation]} {operand1} {operand2}')
             if operation == IRTokens.constToken:
-                instruction = InstructionNode(operation, operand1, operand2, instID, 0, firstVarPair=(var1, var2))
-                #print(f'Instruction made: ({instID}, {0}): {self.opDct[operation]} {operand1} {operand2}')
-                self.instructionList.append(instruction)
-                self.BBList[0].instructions.append(instID)
-                self.BBList[0].opTables[operation].insert(0, (instID, operand1))
+                self.instructionList.Append(operation, operand1, operand2, 0, (var1, var2))
+                self.PlaceInst(0, instID)
+                self.constants.Add(operand1, instID)
             elif operation in [IRTokens.loadToken, IRTokens.storeToken, IRTokens.killToken]:
                 # in adda, op1 is always BASE and op2 is offset
                 # kill takes 1 op, which will be some BASE.
                 if operation != IRTokens.killToken:
                     # construct the adda command
-                    addaInst = InstructionNode(IRTokens.addaToken, operand1, operand2, instID, bb_id, firstVarPair=(var1, var2))
-                    self.instructionList.append(addaInst)
+                    self.instructionList.Append(IRTokens.addaToken, operand1, operand2, bb_id, (var1, var2))
 
                     # then we construct the load/store command
                     memInstID = self.GetNextInstID()
-                    memInst = InstructionNode(operation, instID, storeData, memInstID, bb_id, firstVarPair=(var1, var2))
-                    self.instructionList.append(memInst)
+                    self.instructionList.Append(operation, instID, storeData, bb_id, (var1, var2))
                     if inst_position == -1:
-                        self.BBList[bb_id].instructions.append(instID)
-                        self.BBList[bb_id].instructions.append(memInstID)
+                        self.PlaceInst(bb_id, instID)
+                        self.PlaceInst(bb_id, memInstID)
                     else:
-                        self.BBList[bb_id].instructions.insert(inst_position, memInstID)
-                        self.BBList[bb_id].instructions.insert(inst_position, instID)
+                        self.PlaceInst(bb_id, memInstID, inst_position)
+                        self.PlaceInst(bb_id, instID, inst_position)
 
                     # lastly, add this entry into the table
-                    self.BBList[bb_id].opTables[IRTokens.killToken].insert(0, (operation, instID, operand1, operand2, storeData))
+                    self.instructionList.opSlots[instID] = self.BBList[bb_id].AddOpEntry(
+                        IRTokens.killToken, (operation, instID, operand1, operand2, storeData))
                     instID = memInstID
                 else:
-                    instruction = InstructionNode(operation, operand1, operand2, instID, 0, firstVarPair=(var1, var2))
-                    self.instructionList.append(instruction)
+                    self.instructionList.Append(operation, operand1, operand2, 0, (var1, var2))
                     if inst_position != -1:
-                        self.BBList[bb_id].instructions.insert(0, instID)
+                        self.PlaceInst(bb_id, instID, 0)
                     else:
-                        self.BBList[bb_id].instructions.append(instID)
-                    self.BBList[bb_id].opTables[IRTokens.killToken].insert(0, (instID, operand1))
+                        self.PlaceInst(bb_id, instID)
+                    self.BBList[bb_id].AddOpEntry(IRTokens.killToken, (instID, operand1))
             else:
-                instruction = InstructionNode(operation, operand1, operand2, instID, bb_id, firstVarPair=(var1, var2))
-                #print(f'Instruction made: ({instID}, {self.CurrentBasicBlock}): '
-                      #f'{self.opDct[operation]} {operand1} {operand2}')
-                self.instructionList.append(instruction)
+                self.instructionList.Append(operation, operand1, operand2, bb_id, (var1, var2))
                 if inst_position != -1:
-                    self.BBList[bb_id].instructions.insert(inst_position, instID)
+                    self.PlaceInst(bb_id, instID, inst_position)
                 else:
                     # insert phi instructions at the beginning, but in order of insertion
                     if operation == IRTokens.phiToken:
-                        if len(self.BBList[bb_id].instructions) == 0:
-                            self.BBList[bb_id].instructions.append(instID)
+                        opcodes = self.instructionList.opcodes
+                        insts = self.BBList[bb_id].instructions
+                        for i in range(len(insts)):
+                            if opcodes[insts[i]] != IRTokens.phiToken:
+                                self.PlaceInst(bb_id, instID, i)
+                                break
                         else:
-                            for i in range(len(self.BBList[bb_id].instructions)):
-                                inst = self.instructionList[self.BBList[bb_id].instructions[i]]
-                                if inst.instruction != IRTokens.phiToken:
-                                    self.BBList[bb_id].instructions.insert(i, instID)
-                                    break
-                            else:
-                                self.BBList[bb_id].instructions.append(instID)
+                            self.PlaceInst(bb_id, instID)
                     else:
-                        self.BBList[bb_id].instructions.append(instID)
-                self.BBList[bb_id].opTables[operation].insert(0, (instID, operand1, operand2))
+                        self.PlaceInst(bb_id, instID)
+                self.instructionList.opSlots[instID] = self.BBList[bb_id].AddNewOp(operation, operand1, operand2, instID)
+        elif self.trace.cse:
+            self.trace.Emit(TraceEvent.CSE, f'{self.opDct[operation]} {operand1} {operand2} in BB{bb_id} reuses {instID}')
+        if operation == IRTokens.constToken:
+            self.constants.RecordUse(instID)
         return instID, False
 
     def GetInstNode(self, instID):
@@ -218,16 +328,18 @@ class SSA:
             compareInstPos = self.GetInstPosInBB(instID, bb_id)
 
         if operation == IRTokens.constToken:
-            for const in self.BBList[0].opTables[IRTokens.constToken]:
-                if const[1] == operand1:
-                    return const[0]
+            return self.constants.Lookup(operand1)
         else:
-            dom_list = self.BBList[bb_id].dominators
-            for dom_block in dom_list:
+            idom = self.idom
+            dom_block = bb_id
+            while dom_block != -1:
                 if operation == IRTokens.loadToken:
-                    op_list = self.BBList[dom_block].opTables[IRTokens.killToken]
-                    for inst in op_list:
+                    op_list = self.BBList[dom_block].GetOpTable(IRTokens.killToken)
+                    for inst in reversed(op_list):
                         # entries are (operation, instID, operand1, operand2, storeData)
+                        # the (instID, operand1) entry of a kill instruction is covered by its (kill, -1, ...) entry
+                        if len(inst) != 5:
+                            continue
                         if dom_block == bb_id:
                             if compareInstPos != -1:
                                 currInstPos = self.GetInstPosInBB(inst[1], bb_id)
@@ -261,13 +373,17 @@ class SSA:
                                 return inst[1] + 1
                             elif inst[0] == IRTokens.storeToken and inst[2] == operand1 and inst[3] == operand2:
                                 return inst[4]
+                    # a loop header without its back edge yet may still be killed by the loop body
+                    if dom_block in self.unsealedBlocks:
+                        return -1
                 else:
-                    op_list = self.BBList[dom_block].opTables[operation]
-                    for inst in op_list:
-                        # entries are (instID, op1, op2)
-                        instNode = self.GetInstNode(inst[0])
-                        if inst[1] == operand1 and inst[2] == operand2 and instNode.active:
-                            return inst[0]
+                    # newest active instruction with the same (op, op1, op2) in the closest dominator
+                    insts = self.BBList[dom_block].valueNumbers.get((operation, operand1, operand2))
+                    if insts is not None:
+                        for prevInstID in reversed(insts):
+                            if self.instructionList.active[prevInstID]:
+                                return prevInstID
+                dom_block = idom[dom_block]
         return -1
 
     def AssignVariable(self, varToken, instID, bb_id, instList=None, varAssign=False):
@@ -277,35 +393,42 @@ class SSA:
         :param varToken: the variable token to be updated
         :param instID: the instruction assigned to the variable
         :param bb_id: the basic block ID
+        :param instList: instructions of the assigned expression, stored in self.histories
         :return: void
         """
-        if instList is None:
-            instList = []
         (n, inst, op) = self.GetVarVersion(varToken, bb_id)
         varSSAVal = (n, inst, op)
         if bb_id != 0:
+            instList = self.histories.Add(instList)
             if n != -1 and inst != instID or varAssign:
-                if varToken in self.BBList[bb_id].valueTable:
-                    varSSAVal = (n + 1, instID, instList)
-                    self.BBList[bb_id].valueTable[varToken].insert(0, (n + 1, instID, instList))
-                else:
-                    varSSAVal = (n + 1, instID, instList)
-                    self.BBList[bb_id].valueTable[varToken] = [(n + 1, instID, instList)]
+                varSSAVal = (n + 1, instID, instList)
+                self.BBList[bb_id].AddVersion(varToken, varSSAVal)
             elif inst == instID:
-                if varToken in self.BBList[bb_id].valueTable:
-                    varSSAVal = (n + 1, instID, instList)
-                    self.BBList[bb_id].valueTable[varToken].insert(0, (n + 1, instID, instList))
-                else:
-                    varSSAVal = (n + 1, instID, instList)
-                    self.BBList[bb_id].valueTable[varToken] = [(n + 1, instID, instList)]
+                varSSAVal = (n + 1, instID, instList)
+                self.BBList[bb_id].AddVersion(varToken, varSSAVal)
             elif n == -1:
                 varSSAVal = (0, instID, instList)
-                self.BBList[bb_id].valueTable[varToken] = [(0, instID, instList)]
+                self.BBList[bb_id].SetVersions(varToken, [varSSAVal])
+            self.InvalidateVar(varToken)
 
             return varSSAVal
         else:
             raise Exception("Basic block 0 has no variables")
 
+    def DropHistories(self):
+        """
+        Frees the instruction histories of the value tables. They are only needed by the whilePhi passes
+        and the debug output of GenerateDot, so call this once the program has been parsed.
+        Entries keep their version and instruction, with an empty history.
+        """
+        empty = HistoryLog.EMPTY
+        for block in self.BBList:
+            for entries in block.valueTable.values():
+                for idx, entry in enumerate(entries):
+                    if entry[2] != empty:
+                        entries[idx] = (entry[0], entry[1], empty)
+        self.histories.Clear()
+
     def GetVarInstNode(self, varToken, bb_id: int = -1):
         """
         Finds the latest SSA value of the program variable in a basic block.
@@ -320,13 +443,9 @@ class SSA:
         blockID = self.CurrentBasicBlock
         if bb_id != -1:
             blockID = bb_id
-        dom_list = self.BBList[blockID].dominators
-        for dom_block in dom_list:
-            if varToken in self.BBList[dom_block].valueTable:
-                # return first entry that is active
-                for version in self.BBList[dom_block].valueTable[varToken]:
-                    if self.instructionList[version[1]].active:
-                        return self.BBList[dom_block].valueTable[varToken][0][1]
+        dom_block = self.FindVarBlock(varToken, blockID, VAR_ACTIVE)
+        if dom_block != -1:
+            return self.BBList[dom_block].valueTable[varToken][-1][1]
         # if we reached here, that means this variable does not have a value
         print("WARNING: variable not instantiated. Assigning variable with value 0.")
         instID, _ = self.DefineIR(IRTokens.constToken, self.CurrentBasicBlock, 0)
@@ -347,17 +466,27 @@ class SSA:
         blockID = self.CurrentBasicBlock
         if bb_id != -1:
             blockID = bb_id
-        dom_list = self.BBList[blockID].dominators
-        for dom_block in dom_list:
+        if varVersion == -1 and not prevBB and not phi:
+            # the common case, the first value found up the dominators
+            dom_block = self.FindVarBlock(varToken, blockID, VAR_VERSION)
+            if dom_block != -1:
+                isWhileJoin = self.BBList[dom_block].joinType == 1
+                for version in reversed(self.BBList[dom_block].valueTable[varToken]):
+                    if self.instructionList.active[version[1]] or isWhileJoin and version[0] == 0:
+                        return version
+            return -1, -1, -1
+        idom = self.idom
+        dom_block = blockID
+        while dom_block != -1:
             if phi and dom_block != bb_id:
                 break
             if not prevBB or dom_block != bb_id:
                 if varToken in self.BBList[dom_block].valueTable:
                     # if we're not looking for a particular version
                     # return first entry that contains active instruction
-                    for version in self.BBList[dom_block].valueTable[varToken]:
+                    for version in reversed(self.BBList[dom_block].valueTable[varToken]):
                         if varVersion == -1:
-                            if self.instructionList[version[1]].active or phi:
+                            if self.instructionList.active[version[1]] or phi:
                                 return version
                         # in while join blocks, the phi node will be the same version as the first version of the
                         # the body node
@@ -366,19 +495,359 @@ class SSA:
                                 return version
                         elif version[0] == varVersion:
                             return version
+            dom_block = idom[dom_block]
         return -1, -1, -1
 
-    def CreateNewBasicBlock(self, dom_list, parent_list, idom_list, blockType="", joinType=0, joinBlocks=None):
+    def FindVarBlock(self, varToken, bb_id, kind=VAR_ACTIVE):
+        """
+        Finds the closest dominator of bb_id (bb_id included) holding a value of the variable.
+        The answer is remembered for every block walked through, so later lookups from those blocks
+        or their descendants stop after one step, until the variable's value table entries change.
+        :param kind: VAR_ANY, VAR_ACTIVE or VAR_VERSION, what counts as a value
+        :return: the block ID, an unsealed join block without a value (sealed mode), or -1
+        """
+        active = self.instructionList.active
+        # the newest entry in bb_id itself is the usual answer
+        entries = self.BBList[bb_id].valueTable.get(varToken)
+        if entries and (kind == VAR_ANY or active[entries[-1][1]]):
+            return bb_id
+        memo = None
+        if self.varMemo is not None:
+            memos = self.varMemo.get(varToken)
+            if memos is not None:
+                memo = memos[kind]
+        idom = self.idom
+        walked = []
+        found = -1
+        dom_block = bb_id
+        while dom_block != -1:
+            if memo is not None:
+                cached = memo.get(dom_block)
+                if cached is not None:
+                    found = cached
+                    break
+            block = self.BBList[dom_block]
+            entries = block.valueTable.get(varToken)
+            if entries:
+                if kind == VAR_ANY:
+                    found = dom_block
+                    break
+                isWhileJoin = kind == VAR_VERSION and block.joinType == 1
+                for version in reversed(entries):
+                    if active[version[1]] or isWhileJoin and version[0] == 0:
+                        found = dom_block
+                        break
+                if found != -1:
+                    break
+            if dom_block in self.unsealedBlocks:
+                found = dom_block
+                break
+            walked.append(dom_block)
+            dom_block = idom[dom_block]
+        if walked and self.varMemo is not None:
+            if memo is None:
+                memo = self.varMemo.setdefault(varToken, ({}, {}, {}))[kind]
+            for dom_block in walked:
+                memo[dom_block] = found
+        return found
+
+    def InvalidateVar(self, varToken):
+        # called whenever a value table entry of varToken is added, replaced or (de)activated
+        if self.varMemo is not None:
+            self.varMemo.pop(varToken, None)
+
+    def OpenJoin(self, joinID):
+        """
+        Sealed mode: marks a join block whose parents are not all known yet. Reads that reach it
+        before SealBlock get an incomplete phi, assignments are collected for the phis of SealBlock.
+        """
+        if not self.sealed:
+            return
+        self.unsealedBlocks.add(joinID)
+        self.assignedVars.append((joinID, set()))
+        if self.undo is not None:
+            self.undo.Add(self.unsealedBlocks.discard, joinID)
+            self.undo.Add(self.assignedVars.pop)
+
+    def SealBlock(self, joinID):
+        """
+        Sealed mode: called once all parents of the join block opened by OpenJoin are known.
+        Completes its incomplete phis, adds phis for the other variables assigned since OpenJoin and
+        removes the phis that turn out trivial.
+        """
+        if not self.sealed:
+            return
+        _, assigned = self.assignedVars.pop()
+        self.unsealedBlocks.discard(joinID)
+        phis = self.incompletePhis.pop(joinID, {})
+        if self.undo is not None:
+            self.undo.Add(self.assignedVars.append, (joinID, assigned))
+            self.undo.Add(self.unsealedBlocks.add, joinID)
+            if phis:
+                self.undo.Add(self.incompletePhis.__setitem__, joinID, phis.copy())
+        for varToken in assigned:
+            if varToken not in phis:
+                phis[varToken] = self.NewPhi(varToken, joinID)
+        parents = self.BBList[joinID].parents
+        for varToken, phiID in phis.items():
+            op1 = self.ReadVariable(varToken, parents[0], warn=False)[1]
+            op2 = self.ReadVariable(varToken, parents[1], warn=False)[1]
+            self.SetPhiOperands(phiID, op1, op2)
+        for phiID in phis.values():
+            self.RemoveTrivialPhi(phiID)
+        if self.assignedVars:
+            outer = self.assignedVars[-1][1]
+            if self.undo is not None:
+                self.undo.Add(outer.difference_update, assigned - outer)
+            outer.update(assigned)
+
+    def WriteVariable(self, varToken, instID, bb_id, instList=None):
+        """
+        Sealed mode counterpart of AssignVariable
+        :return: the new value table entry (version, instID, instList)
+        """
+        if self.assignedVars:
+            assigned = self.assignedVars[-1][1]
+            if self.undo is not None and varToken not in assigned:
+                self.undo.Add(assigned.discard, varToken)
+            assigned.add(varToken)
+        return self.SetVarEntry(varToken, instID, bb_id, instList)
+
+    def SetVarEntry(self, varToken, instID, bb_id, instList=None):
+        version = self.varVersions.get(varToken, -1) + 1
+        self.varVersions[varToken] = version
+        entry = (version, instID, self.histories.Add(instList))
+        self.BBList[bb_id].AddVersion(varToken, entry)
+        if self.undo is not None:
+            if version == 0:
+                self.undo.Add(self.varVersions.pop, varToken)
+            else:
+                self.undo.Add(self.varVersions.__setitem__, varToken, version - 1)
+        if instID in self.phiDefs:
+            self.AddPhiDef(instID, bb_id, varToken)
+        self.InvalidateVar(varToken)
+        return entry
+
+    def ReadVariable(self, varToken, bb_id, warn=True):
+        """
+        Sealed mode counterpart of GetVarInstNode/GetVarVersion. Walks up the dominators to the
+        closest value, stopping at an unsealed loop header, where an incomplete phi is placed.
+        If the variable has no value, it is read as 0.
+        :return: value table entry (version, instID, instList)
+        """
+        dom_block = self.FindVarBlock(varToken, bb_id, VAR_ANY)
+        if dom_block != -1:
+            entries = self.BBList[dom_block].valueTable.get(varToken)
+            if entries:
+                return entries[-1]
+            # unsealed loop header
+            phiID = self.NewPhi(varToken, dom_block)
+            phis = self.incompletePhis.get(dom_block)
+            if phis is None:
+                phis = self.incompletePhis[dom_block] = {}
+                if self.undo is not None:
+                    self.undo.Add(self.incompletePhis.pop, dom_block)
+            elif self.undo is not None:
+                self.undo.Add(phis.pop, varToken)
+            phis[varToken] = phiID
+            return self.BBList[dom_block].valueTable[varToken][-1]
+        instID, _ = self.DefineIR(IRTokens.constToken, bb_id, 0)
+        if not warn:
+            return -1, instID, []
+        print("WARNING: variable not instantiated. Assigning variable with value 0.")
+        return self.SetVarEntry(varToken, instID, bb_id)
+
+    def NewPhi(self, varToken, bb_id):
+        # operands are set by SetPhiOperands once the block is sealed
+        phiID, _ = self.DefineIR(IRTokens.phiToken, bb_id, var1=(1, (0, varToken)), var2=(1, (0, varToken)))
+        self.phiDefs[phiID] = []
+        if self.undo is not None:
+            self.undo.Add(self.phiDefs.pop, phiID)
+        self.SetVarEntry(varToken, phiID, bb_id)
+        return phiID
+
+    def AddPhiDef(self, phiID, bb_id, varToken):
+        # records a value table entry holding the phi
+        defs = self.phiDefs[phiID]
+        defs.append((bb_id, varToken))
+        if self.undo is not None:
+            self.undo.Add(defs.pop)
+
+    def SetPhiOperands(self, phiID, op1, op2):
+        self.ReplaceOperands(phiID, op1, op2)
+
+    def ReplaceAllUses(self, old, new):
+        """
+        Makes every instruction that uses old as an operand use new instead.
+        Runs in time proportional to the number of uses, see InstructionStore.GetUsers
+        :return: the instructions that were changed
+        """
+        store = self.instructionList
+        users = store.GetUsers(old)
+        for user in users:
+            op1, op2 = store.GetOperand(1, user), store.GetOperand(2, user)
+            if op1 == old and store.IsUse(user, 1):
+                op1 = new
+            if op2 == old and store.IsUse(user, 2):
+                op2 = new
+            self.ReplaceOperands(user, op1, op2)
+        if self.trace.ir and users:
+            self.trace.Emit(TraceEvent.IR, f'uses of {old} replaced by {new}: {users}')
+        return users
+
+    def RemoveInsts(self, instIDs):
+        """
+        Deletes instructions from their blocks' instruction lists, op tables and value numbers, for the
+        passes run after parsing. They stay in the instruction store as inactive nops that are not placed
+        in any block. Branches whose target was deleted are pointed at the first remaining instruction of
+        the target block, an empty instruction is added if there is none.
+        :param instIDs: placed instructions, nothing may use them any more except other deleted ones
+        :return: number of instructions deleted
+        """
+        store = self.instructionList
+        dead = set(instIDs)
+        if not dead:
+            return 0
+        # block each branch jumps to, taken before its target can be deleted
+        targets = []
+        for block in self.BBList:
+            for instID in block.instructions:
+                opcode = store.opcodes[instID]
+                if IRTokens.braToken <= opcode <= IRTokens.bgtToken and instID not in dead:
+                    column = 1 if opcode == IRTokens.braToken else 2
+                    target = store.GetOperand(column, instID)
+                    if target in dead and store.placement[target] != -1:
+                        targets.append((instID, column, store.placement[target]))
+
+        blocks = {store.placement[instID] for instID in dead}
+        for instID in dead:
+            if store.opcodes[instID] == IRTokens.constToken:
+                self.constants.Remove(store.GetOperand(1, instID))
+            # a nop has no operand uses, so the def-use chains of the operands drop it
+            store.SetOpcode(instID, IRTokens.nopToken)
+            store.active[instID] = 0
+            store.placement[instID] = -1
+            store.opSlots[instID] = -1
+            store.dependencies.pop(instID, None)
+        for bb_id in blocks:
+            block = self.BBList[bb_id]
+            # order labels are left as they are, they still increase along the list
+            block.instructions = [instID for instID in block.instructions if instID not in dead]
+            self.RemoveTableEntries(block, dead)
+
+        for instID, column, bb_id in targets:
+            first = self.GetFirstInstInBlock(bb_id)
+            if first == -1:
+                first, _ = self.DefineIR(IRTokens.emptyToken, bb_id)
+            store.SetOperand(column, instID, first)
+        return len(dead)
+
+    def RemoveTableEntries(self, block, dead):
+        # drops the op table entries and value numbers of deleted instructions and renumbers the op table
+        # slots of the entries that are left
+        store = self.instructionList
+        for op, table in block.opTables.items():
+            kept = []
+            for entry in table:
+                if op == IRTokens.killToken:
+                    # (operation, addaID, ...) for loads and stores, (operation, -1, ...) for kills of a
+                    # join block, (instID, operand1) for kill instructions
+                    instID = entry[1] if len(entry) == 5 else entry[0]
+                else:
+                    instID = entry[0]
+                if instID in dead:
+                    continue
+                if op != IRTokens.killToken or (len(entry) == 5 and entry[0] != IRTokens.killToken):
+                    store.opSlots[instID] = len(kept)
+                kept.append(entry)
+            table[:] = kept
+        for key in list(block.valueNumbers):
+            insts = [instID for instID in block.valueNumbers[key] if instID not in dead]
+            if insts:
+                block.valueNumbers[key] = insts
+            else:
+                del block.valueNumbers[key]
+
+    def ReplaceOperands(self, instID, op1, op2):
+        """
+        Changes both operands of an instruction and re-keys it in its block's tables
+        """
+        store = self.instructionList
+        operation = store.opcodes[instID]
+        oldOp1, oldOp2 = store.GetOperand(1, instID), store.GetOperand(2, instID)
+        store.SetOperand(1, instID, op1)
+        store.SetOperand(2, instID, op2)
+        block = self.BBList[store.placement[instID]]
+        if operation == IRTokens.addaToken or operation == IRTokens.storeToken:
+            # memory instructions are entered in the kill table under their adda
+            addaID = instID if operation == IRTokens.addaToken else instID - 1
+            idx = store.opSlots[addaID]
+            if idx != -1:
+                table = block.GetOpTable(IRTokens.killToken)
+                entry = table[idx]
+                if operation == IRTokens.addaToken:
+                    block.SetOpEntry(IRTokens.killToken, idx, (entry[0], addaID, op1, op2, entry[4]))
+                else:
+                    block.SetOpEntry(IRTokens.killToken, idx, (entry[0], addaID, entry[2], entry[3], op2))
+        elif operation != IRTokens.loadToken:
+            idx = store.opSlots[instID]
+            table = block.GetOpTable(operation)
+            # instructions whose opcode was changed are not in this table
+            if 0 <= idx < len(table) and table[idx][0] == instID:
+                block.SetOpEntry(operation, idx, (instID, op1, op2))
+            block.RemoveValueNumber((operation, oldOp1, oldOp2), instID)
+            block.AddValueNumber((operation, op1, op2), instID)
+
+    def RemoveTrivialPhi(self, phiID):
+        """
+        Replaces phis that only merge one value (besides themselves) by that value, then rechecks the
+        phis that used them
+        """
+        store = self.instructionList
+        work = [phiID]
+        while work:
+            phiID = work.pop()
+            if not store.active[phiID] or phiID not in self.phiDefs or store.operand1[phiID] == store.NONE:
+                continue
+            same = None
+            for operand in (store.operand1[phiID], store.operand2[phiID]):
+                if operand == phiID or operand == same:
+                    continue
+                if same is not None:
+                    break
+                same = operand
+            else:
+                if same is None:
+                    continue
+                store.SetActive(phiID, False)
+                users = self.ReplaceAllUses(phiID, same)
+                defs = self.phiDefs.pop(phiID)
+                if self.undo is not None:
+                    self.undo.Add(self.phiDefs.__setitem__, phiID, defs)
+                for bb_id, varToken in defs:
+                    block = self.BBList[bb_id]
+                    for idx, entry in enumerate(block.valueTable[varToken]):
+                        if entry[1] == phiID:
+                            block.SetVersion(varToken, idx, (entry[0], same, entry[2]))
+                    self.InvalidateVar(varToken)
+                    if same in self.phiDefs:
+                        self.AddPhiDef(same, bb_id, varToken)
+                if self.trace.ir:
+                    self.trace.Emit(TraceEvent.IR, f'trivial phi {phiID} replaced by {same}')
+                work.extend(user for user in users if user in self.phiDefs)
+
+    def CreateNewBasicBlock(self, idom, parent_list, blockType="", joinType=0, joinBlocks=None):
         """
         Creates a new block and sets current basic block to new block
-        :param dom_list: list of blocks that dominate this block
+        :param idom: the immediate dominator of this block
         :param parent_list: list of parents for this block
         :return: ID of this block
         """
         BBID = self.GetNextBBID()
-        block = BasicBlock(BBID, None, parent_list, dom_list, idom_list, blockType=blockType,
-                           joinType=joinType, joinBlocks=joinBlocks)
+        block = BasicBlock(BBID, None, parent_list, blockType=blockType, joinType=joinType, joinBlocks=joinBlocks)
+        block.undo = self.undo
         self.BBList.append(block)
+        self.idom.append(idom)
         self.CurrentBasicBlock = BBID
         return BBID
 
@@ -386,7 +855,7 @@ class SSA:
         # entries are (operation, instID, operand1, operand2, storeData)
         for opType, joinID, entryID in reversed(joinBlocks):
             self.DefineIR(IRTokens.killToken, joinID, arrBaseInstID, inst_position=0)
-            self.BBList[joinID].opTables[IRTokens.killToken].insert(0, (IRTokens.killToken, -1, arrBaseInstID, -1, -1))
+            self.BBList[joinID].AddOpEntry(IRTokens.killToken, (IRTokens.killToken, -1, arrBaseInstID, -1, -1))
 
     def AddPhiNode(self, identToken, firstSSA, joinBlocks, currBB, varAssign=False, operands=None):
         # Adds a phi node to the iterated dominance frontier, aka the joinBlocks
@@ -402,6 +871,8 @@ class SSA:
         ssaBB = currBB
         whilePhi = []
         for opType, joinID, entryID in reversed(joinBlocks):
+            # phis of the previous join block may have been (de)activated
+            self.InvalidateVar(identToken)
             varExists = self.GetVarVersion(identToken, joinID)
             phiInstVar = self.GetVarVersion(identToken, joinID, phi=True)
             entryInstVar = self.GetVarVersion(identToken, entryID)
@@ -484,6 +955,7 @@ class SSA:
                 if opType == 2:
                     whilePhi.append((joinID, ssaVal))
                 self.AssignVariable(identToken, ssaVal, joinID)
+        self.InvalidateVar(identToken)
 
         # iterate through join stack in reverse
         # update the entry ssa
@@ -497,6 +969,9 @@ class SSA:
     def whilePhi(self, joinID, latestDoID, varEntries):
         #print(f"IN WHILE PHI! Parameters: {joinID} {latestDoID}")
         #print(varEntries)
+        # the passes rewrite value tables and phi activity as they go, so they look variables up
+        # without the memo
+        self.varMemo = None
         # need to update CMP and other operands in the doblock
         # main items:
         #     if a later variable needs the unmodified instruction,
@@ -525,6 +1000,7 @@ class SSA:
                 self.whilePhiBBHelper2(currID, joinID)
 
         self.phiCleanUp(joinID)
+        self.varMemo = {}
         #print('EXITING PHI')
 
     def phiCleanUp(self, joinID):
@@ -547,8 +1023,8 @@ class SSA:
         if bbID != joinID:
             for k, v in self.BBList[bbID].valueTable.items():
                 newSSA = []
-                finalSSAVersionInBlock = v[0][1]
-                for i, ssaVersion in reversed(list(enumerate(v))):
+                finalSSAVersionInBlock = v[-1][1]
+                for i, ssaVersion in enumerate(v.copy()):
                     phiInstID = self.GetVarInstNode(k, joinID)
                     ver = ssaVersion[0]
                     ssaInstID = ssaVersion[1]  # self.instructionList[phiInstID].operand1
@@ -556,10 +1032,11 @@ class SSA:
                     newHist = []
                     # print(self.t.GetTokenStr(k), v)
                     oldHistID = []
-                    if len(ssaVersion[2]) == 1 and len(ssaVersion[2][0]) == 2:
-                        varVersion = self.GetVarVersion(ssaVersion[2][0][1][1], varVersion=ssaVersion[2][0][1][0], bb_id=bbID)
+                    if self.histories.Length(ssaVersion[2]) == 1 and len(self.histories.Get(ssaVersion[2])[0]) == 2:
+                        copied = self.histories.Get(ssaVersion[2])[0]
+                        varVersion = self.GetVarVersion(copied[1][1], varVersion=copied[1][0], bb_id=bbID)
                         newSSAVersion = (ssaVersion[0], varVersion[1], ssaVersion[2])
-                        v[i] = newSSAVersion
+                        self.BBList[bbID].SetVersion(k, i, newSSAVersion)
                         #self.GetVarVersion()
 
     def whilePhiBBHelper1(self, bbID, joinID):
@@ -600,10 +1077,12 @@ class SSA:
                     else:
                         op2 = oldOp2
                 currNode.setOperands(op1, op2)
-                for opIdx in range(len(self.BBList[bbID].opTables[currNode.instruction])):
-                    if self.BBList[bbID].opTables[currNode.instruction][opIdx] == (currNode.instID, oldOp1, oldOp2):
-                        self.BBList[bbID].opTables[currNode.instruction][opIdx] = (currNode.instID, op1, op2)
-                        break
+                opTable = self.BBList[bbID].GetOpTable(currNode.instruction)
+                opIdx = self.instructionList.opSlots[currNode.instID]
+                if 0 <= opIdx < len(opTable) and opTable[opIdx] == (currNode.instID, oldOp1, oldOp2):
+                    self.BBList[bbID].SetOpEntry(currNode.instruction, opIdx, (currNode.instID, op1, op2))
+                    self.BBList[bbID].RemoveValueNumber((currNode.instruction, oldOp1, oldOp2), currNode.instID)
+                    self.BBList[bbID].AddValueNumber((currNode.instruction, op1, op2), currNode.instID)
             elif currNode.instruction == IRTokens.writeToken:
                 op1 = currNode.firstVarPair[0]
                 if op1 == 1:
@@ -648,8 +1127,8 @@ class SSA:
         if bbID != joinID:
             for k, v in self.BBList[bbID].valueTable.items():
                 newSSA = []
-                finalSSAVersionInBlock = v[0][1]
-                for i, ssaVersion in reversed(list(enumerate(v))):
+                finalSSAVersionInBlock = v[-1][1]
+                for i, ssaVersion in enumerate(v.copy()):
                     phiInstID = self.GetVarInstNode(k, joinID)
                     ver = ssaVersion[0]
                     ssaInstID = ssaVersion[1]  # self.instructionList[phiInstID].operand1
@@ -657,7 +1136,8 @@ class SSA:
                     newHist = []
                     # print(self.t.GetTokenStr(k), v)
                     oldHistID = []
-                    if len(ssaVersion[2]) == 1 and len(ssaVersion[2][0]) == 2:
+                    oldHist = self.histories.Get(ssaVersion[2])
+                    if len(oldHist) == 1 and len(oldHist[0]) == 2:
                         pass
                         #print(k, ssaVersion[2])
                     elif self.instructionList[ssaInstID].instruction == IRTokens.loadToken:
@@ -668,9 +1148,9 @@ class SSA:
                         # otherwise, we need to reload
                         addaInst = self.instructionList[ssaInstID - 1]
                         newLoad = self.FindPreviousInst(IRTokens.loadToken, addaInst.operand1, addaInst.operand2, bbID)
-                        self.BBList[bbID].valueTable[k][i] = (ver, newLoad, newHist)
+                        self.BBList[bbID].SetVersion(k, i, (ver, newLoad, HistoryLog.EMPTY))
                     else:
-                        for hist in ssaVersion[2]:
+                        for hist in oldHist:
                             # gather both current and previous instruction operand for comparison
                             instID = hist[0]
                             oldHistID.append(instID)
@@ -765,9 +1245,11 @@ class SSA:
                             ssaInstID = newHist[-1][0]
                         if newHistID != oldHistID and phiInstID == -1:
                             self.AddPhiNode(k, ssaInstID, self.BBList[bbID].joinBlocks, bbID)
-                        self.BBList[bbID].valueTable[k][i] = (ver, ssaInstID, newHist)
+                        # unchanged histories keep their place in the log
+                        histRef = ssaVersion[2] if newHist == oldHist else self.histories.Add(newHist)
+                        self.BBList[bbID].SetVersion(k, i, (ver, ssaInstID, histRef))
 
-                newFinalSSAVersionInBlock = self.BBList[bbID].valueTable[k][0][1]
+                newFinalSSAVersionInBlock = self.BBList[bbID].valueTable[k][-1][1]
                 if finalSSAVersionInBlock != newFinalSSAVersionInBlock:
                     self.AddPhiNode(k, newFinalSSAVersionInBlock, self.BBList[bbID].joinBlocks, bbID)
 
@@ -790,8 +1272,7 @@ class SSA:
                         versionHistory = []
                     pos = 0
                     prevPos = -2
-                    for i in range(len(versionHistory)):
-                        version = versionHistory[i]
+                    for version in reversed(versionHistory):
                         pos = self.GetInstPosInBB(version[1], bbID)
 
                         # passes whileCSERelations
@@ -800,22 +1281,22 @@ class SSA:
                             break
                         prevPos = pos
                     else:
-                        bbDom = self.BBList[bbID].dominators[1]
+                        bbDom = self.idom[bbID]
                         op = self.GetVarVersion(nodeVar[1][1], bbDom)[1]
                         # last resort, this variable was initialized inside this join block
                         if op == -1:
-                            op = self.BBList[joinID].valueTable[nodeVar[1][1]][0][1]
+                            op = self.BBList[joinID].valueTable[nodeVar[1][1]][-1][1]
                     #print(f'Node history is {op}')
                 else:
                     op = self.GetVarVersion(nodeVar[1][1], bbID)[1]
         return op
 
     def FindInstBlock(self, instID):
-        for block in self.BBList:
-            for inst in block.instructions:
-                if self.instructionList[inst].instID == instID:
-                    return block.bbID
-        return -1
+        # block whose instruction list holds instID, -1 if it is not in any block
+        store = self.instructionList
+        if type(instID) is not int or not 0 <= instID < len(store):
+            return -1
+        return store.placement[instID]
 
     def GetCurrBasicBlock(self):
         return self.CurrentBasicBlock
@@ -824,11 +1305,11 @@ class SSA:
         self.CurrentBasicBlock = bbID
 
     def GetFirstInstInBlock(self, bbID):
-        if len(self.BBList[bbID].instructions) > 0:
-            for inst in self.BBList[bbID].instructions:
-                instNode = self.GetInstNode(inst)
-                if instNode.active:
-                    return inst
+        # first active instruction, only inactive phis at the top of a join block are skipped over
+        active = self.instructionList.active
+        for inst in self.BBList[bbID].instructions:
+            if active[inst]:
+                return inst
         return -1
 
     def AddBlockChild(self, parentBBID, childBBID):
@@ -846,8 +1327,21 @@ class SSA:
     def AddBlockJoinStack(self, bbID, joinBlocks):
         self.BBList[bbID].AddJoinBlocks(joinBlocks)
 
+    def Dominators(self, BBID):
+        # BBID and the blocks dominating it, closest first, by following the immediate dominators
+        idom = self.idom
+        while BBID != -1:
+            yield BBID
+            BBID = idom[BBID]
+
     def GetDomList(self, BBID):
-        return self.BBList[BBID].dominators
+        return list(self.Dominators(BBID))
+
+    def GetDominatorTree(self):
+        """
+        Dominator analysis of the finished CFG, see dominance.DominatorTree
+        """
+        return DominatorTree(self.BBList)
 
     def GetBlockInsts(self, BBID):
         return self.BBList[BBID].instructions
@@ -873,31 +1367,41 @@ class SSA:
     def PrintBlocks(self):
         for block in self.BBList:
             print(block.bbID)
-            print(f'    Dominators: {block.dominators}')
-            print(f'    Parents: {block.parents}')
-            print(f'    Children: {block.children}')
+            print(f'    Dominators: {self.GetDomList(block.bbID)}')
+            print(f'    Parents: {list(block.parents)}')
+            print(f'    Children: {list(block.children)}')
             print(f'    Instructions: {block.instructions}')
 
             values = ''
             first = True
             for k, v in block.valueTable.items():
+                # newest entry first
                 if first:
-                    values += f'({self.t.GetTokenStr(k)}, {k}): {v}, \n'
+                    values += f'({self.t.GetTokenStr(k)}, {k}): {v[::-1]}, \n'
                 else:
-                    values += " " * 13 + f'({self.t.GetTokenStr(k)}, {k}): {v}, \n'
+                    values += " " * 13 + f'({self.t.GetTokenStr(k)}, {k}): {v[::-1]}, \n'
                 first = False
             values = '{' + values[:-2] + '}'
             print(f'    Values: {values}')
             optables = ''
             first = True
-            for k, v in block.opTables.items():
+            for k, v in sorted(block.opTables.items()):
+                # newest entry first
                 if len(v) > 0:
                     if first:
-                        optables += f'{self.opDct[k]}: {v}, \n'
+                        optables += f'{self.opDct[k]}: {v[::-1]}, \n'
                     else:
-                        optables += f'         {self.opDct[k]}: {v}, \n'
+                        optables += f'         {self.opDct[k]}: {v[::-1]}, \n'
                     first = False
             print(f'    Ops: {optables}')
+            if block.bbID == 0:
+                print(f'    Constants: {self.GetConstantStats()}')
+
+    def GetConstantStats(self):
+        """
+        :return: list of (value, instID, uses) for every constant, in the order they were defined
+        """
+        return self.constants.GetStats()
 
     def GenerateDot(self, tokenizer, varMode=False, debugMode=False):
         blockSect = []
@@ -909,6 +1413,9 @@ class SSA:
                  'gold', 'orange', 'limegreen']
 
         for block in self.BBList:
+            if block.bbID > 0 and self.idom[block.bbID] == -1:
+                # unreachable, see sccp.ConstantPropagation
+                continue
             blockInfo = f"\tbb{block.bbID}[shape=record, label=\"<b>{block.blockType}BB{block.bbID}|{{"
             lenInst = len(block.instructions)
             for i in range(lenInst):
@@ -960,11 +1467,11 @@ class SSA:
                 blockInfo += "}|{"
                 for k in block.valueTable:
                     valueInfo = ''
-                    for v in block.valueTable[k]:
+                    for v in reversed(block.valueTable[k]):
                         if debugMode:
                             versionString = f'({v[0]}, {v[1]}, ['
 
-                            for vrsn in v[2]:
+                            for vrsn in self.histories.Get(v[2]):
                                 if len(vrsn) == 2 and vrsn[0] == 1:
                                     versionString += f'({vrsn[0]}, ({vrsn[1][0]}, {tokenizer.GetTokenStr(vrsn[1][1])})'
                                 else:
@@ -977,7 +1484,7 @@ class SSA:
                                     versionString += f'({vrsn[0]}, {op1}, {op2})'
                             valueVerInfo = f'{tokenizer.GetTokenStr(k)}: {versionString}])|'
                         else:
-                            if self.instructionList[v[1]].active:
+                            if self.instructionList.active[v[1]]:
                                 valueVerInfo = f'{tokenizer.GetTokenStr(k)}: ({v[0]}, {v[1]})|'
                             else:
                                 valueVerInfo = ""
@@ -1015,11 +1522,11 @@ class SSA:
                             edgeInfo += "[label=\"fall-through\"]"
                 edgeInfo += ";"
                 dagSect.append(edgeInfo)
-            for domID in block.idominators:
-                if domID != block.bbID and domID > 0:
-                    domInfo = f"\tbb{domID}:b -> bb{block.bbID}:b [color=\"{color[domID % len(color)]}\", " \
-                              f"style=dashed, label=\"dom\"];"
-                    domSect.append(domInfo)
+            domID = self.idom[block.bbID]
+            if domID > 0:
+                domInfo = f"\tbb{domID}:b -> bb{block.bbID}:b [color=\"{color[domID % len(color)]}\", " \
+                          f"style=dashed, label=\"dom\"];"
+                domSect.append(domInfo)
 
         separator = "\n"
         dot = f'digraph G {{\n{separator.join(blockSect)}\n\n{separator.join(dagSect)}\n{separator.join(domSect)} \n}}'
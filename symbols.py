@@ -0,0 +1,101 @@
+from enum import IntEnum
+
+
+class SymbolKind(IntEnum):
+    scalar = 0
+    array = 1
+    function = 2
+    parameter = 3
+
+
+class Symbol:
+    __slots__ = ('ident', 'kind', 'dims', 'offsets', 'baseAddr', 'scope')
+
+    def __init__(self, ident, kind: SymbolKind, dims=(), offsets=(), baseAddr=-1, scope=0):
+        """
+        One declared name
+        :param ident: identifier token
+        :param kind: SymbolKind
+        :param dims: array dimensions, empty for scalars
+        :param offsets: precomputed (offset, constInstID) per dimension, see Parser.defineOffsets
+        :param baseAddr: instruction ID of the array's base address constant, -1 for scalars
+        :param scope: nesting depth of the declaring scope, 0 is global
+        """
+        self.ident = ident
+        self.kind = kind
+        self.dims = dims
+        self.offsets = offsets
+        self.baseAddr = baseAddr
+        self.scope = scope
+
+
+class SymbolTable:
+    """
+    Maps identifier tokens to their innermost visible Symbol.
+    Every identifier has one stack of declarations in a single dict, and each scope remembers which
+    identifiers it pushed, so lookups are O(1) no matter how deeply scopes are nested and leaving a
+    scope only touches the names it declared.
+    """
+
+    def __init__(self):
+        self.table = {}  # ident -> [Symbol], innermost last
+        self.scopes = [[]]  # idents declared per open scope, global scope first
+
+    def EnterScope(self):
+        self.scopes.append([])
+
+    def ExitScope(self):
+        if len(self.scopes) == 1:
+            raise ValueError('Cannot exit the global scope')
+        for ident in self.scopes.pop():
+            stack = self.table[ident]
+            stack.pop()
+            if not stack:
+                del self.table[ident]
+
+    def GetDepth(self):
+        return len(self.scopes) - 1
+
+    def Declare(self, ident, kind: SymbolKind, dims=(), offsets=(), baseAddr=-1) -> Symbol:
+        """
+        Adds a declaration to the current scope. Redeclaring a name in the same scope replaces it,
+        declaring it in an inner scope shadows the outer declaration until the scope is exited.
+        :return: the new Symbol
+        """
+        symbol = Symbol(ident, kind, dims, offsets, baseAddr, self.GetDepth())
+        stack = self.table.get(ident)
+        if stack is None:
+            self.table[ident] = [symbol]
+            self.scopes[-1].append(ident)
+        elif stack[-1].scope == symbol.scope:
+            stack[-1] = symbol
+        else:
+            stack.append(symbol)
+            self.scopes[-1].append(ident)
+        return symbol
+
+    def Lookup(self, ident):
+        """
+        :return: the innermost Symbol for ident, None if it is undeclared
+        """
+        stack = self.table.get(ident)
+        if stack is None:
+            return None
+        return stack[-1]
+
+    def IsScalar(self, ident):
+        stack = self.table.get(ident)
+        return stack is not None and stack[-1].kind in (SymbolKind.scalar, SymbolKind.parameter)
+
+    def IsArray(self, ident):
+        stack = self.table.get(ident)
+        return stack is not None and stack[-1].kind == SymbolKind.array
+
+    def __contains__(self, ident):
+        return ident in self.table
+
+    def GetSymbols(self, kind: SymbolKind = None):
+        """
+        :return: the visible Symbols, optionally only those of one kind, in declaration order
+        """
+        return [stack[-1] for stack in self.table.values() if kind is None or stack[-1].kind == kind]
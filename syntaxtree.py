@@ -0,0 +1,527 @@
+import tokenizer
+from tokens import *
+from symbols import SymbolTable, SymbolKind
+
+
+# Syntax tree nodes. Identifiers and operators are kept as their token codes, names are looked up
+# through Computation.names (the tokenizer the tree was built with).
+
+class Computation:
+    __slots__ = ('decls', 'body', 'names')
+
+    def __init__(self, decls, body, names):
+        self.decls = decls  # VarDecl/ArrayDecl in source order
+        self.body = body  # tuple of statements
+        self.names = names
+
+
+class VarDecl:
+    __slots__ = ('idents',)
+
+    def __init__(self, idents):
+        self.idents = idents
+
+
+class ArrayDecl:
+    __slots__ = ('dims', 'idents')
+
+    def __init__(self, dims, idents):
+        self.dims = dims
+        self.idents = idents
+
+
+class Assignment:
+    __slots__ = ('target', 'value')
+
+    def __init__(self, target, value):
+        self.target = target  # Designator
+        self.value = value
+
+
+class FuncCall:
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, args):
+        self.func = func  # Tokens.inputNumToken, outputNumToken or outputNewLineToken
+        self.args = args
+
+
+class IfStatement:
+    __slots__ = ('relation', 'thenSeq', 'elseSeq')
+
+    def __init__(self, relation, thenSeq, elseSeq):
+        self.relation = relation
+        self.thenSeq = thenSeq
+        self.elseSeq = elseSeq  # None when there is no else block
+
+
+class WhileStatement:
+    __slots__ = ('relation', 'body')
+
+    def __init__(self, relation, body):
+        self.relation = relation
+        self.body = body
+
+
+class Relation:
+    __slots__ = ('op', 'left', 'right')
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+
+class BinaryOp:
+    __slots__ = ('op', 'left', 'right')
+
+    def __init__(self, op, left, right):
+        self.op = op  # IRTokens add/sub/mul/div
+        self.left = left
+        self.right = right
+
+
+class Number:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Designator:
+    __slots__ = ('ident', 'indices')
+
+    def __init__(self, ident, indices=()):
+        self.ident = ident
+        self.indices = indices  # one expression per array dimension, empty for variables
+
+
+class Group:
+    # parenthesized expression, kept because it is lowered as a plain value rather than a variable
+    __slots__ = ('expr',)
+
+    def __init__(self, expr):
+        self.expr = expr
+
+
+class TreeBuilder:
+    """
+    Parses a program into a syntax tree without generating any IR.
+    Follows the same grammar and declaration checks as parser.Parser.
+    """
+
+    def __init__(self, filepath: str = None, bulkLex=False, source=None, identPool=None):
+        if bulkLex:
+            self.t = tokenizer.BulkTokenizer(filepath, source=source, pool=identPool)
+        else:
+            self.t = tokenizer.Tokenizer(filepath, source=source, pool=identPool)
+        self.sym = None
+        self.symbols = SymbolTable()
+
+        self.relOp = [Tokens.eqlToken, Tokens.neqToken,
+                      Tokens.geqToken, Tokens.leqToken,
+                      Tokens.gtrToken, Tokens.lssToken]
+        self.binaryOp = {
+            Tokens.plusToken: IRTokens.addToken,
+            Tokens.minusToken: IRTokens.subToken,
+            Tokens.timesToken: IRTokens.mulToken,
+            Tokens.divToken: IRTokens.divToken
+        }
+
+    def next(self):
+        self.sym = self.t.GetNext()
+
+    def close(self):
+        self.t.close()
+
+    def ErrorLocation(self):
+        line, column = self.t.GetPosition()
+        return f'line {line}, column {column}'
+
+    def CheckFor(self, token: Tokens) -> None:
+        if self.sym == token:
+            self.next()
+        else:
+            raise SyntaxError(f'Expected {self.t.GetTokenStr(token)}, got {self.t.GetTokenStr(self.sym)} '
+                              f'at {self.ErrorLocation()}')
+
+    def build(self):
+        return self.computation()
+
+    def computation(self):
+        # computation = "main" { varDecl } { funcDecl } "{"" statSequence "}" ".".
+        self.next()
+        self.CheckFor(Tokens.mainToken)
+        decls = self.declarations()
+        self.CheckFor(Tokens.beginToken)
+        body = self.statSequence()
+        self.CheckFor(Tokens.endToken)
+        self.CheckFor(Tokens.periodToken)
+        return Computation(decls, body, self.t)
+
+    def declarations(self):
+        # varDecl = typeDecl indent { “,” ident } “;”
+        decls = []
+        idents = None
+        while self.sym != Tokens.funcToken and self.sym != Tokens.beginToken:
+            # typeDecl = “var” | “array” “[“ number “]” { “[“ number “]”}
+            if self.sym == Tokens.varToken:
+                self.next()
+                idents = []
+                decls.append(VarDecl(idents))
+            elif self.sym == Tokens.arrToken:
+                self.next()
+                arrSize = [self.parseArraySize()]
+                while self.sym == Tokens.openbracketToken:
+                    arrSize.append(self.parseArraySize())
+                idents = []
+                decls.append(ArrayDecl(tuple(arrSize), idents))
+
+            if idents is not None:
+                if self.sym > 255:
+                    if type(decls[-1]) == ArrayDecl:
+                        self.symbols.Declare(self.sym, SymbolKind.array, decls[-1].dims)
+                    else:
+                        self.symbols.Declare(self.sym, SymbolKind.scalar)
+                    idents.append(self.sym)
+                    self.next()
+                else:
+                    raise SyntaxError(f"Keyword cannot be used as variable name at {self.ErrorLocation()}")
+
+            if self.sym == Tokens.semiToken:
+                self.next()
+                idents = None
+            elif self.sym == Tokens.commaToken:
+                self.next()
+            else:
+                raise SyntaxError(f"Expected \',\' or \';\', got {self.sym} at {self.ErrorLocation()}")
+        for decl in decls:
+            decl.idents = tuple(decl.idents)
+        return tuple(decls)
+
+    def parseArraySize(self):
+        self.CheckFor(Tokens.openbracketToken)
+        self.CheckFor(Tokens.number)
+        size = self.t.lastNum
+        self.CheckFor(Tokens.closebracketToken)
+        return size
+
+    def statSequence(self):
+        # statSequence = statement { “;” statement } [ “;” ]
+        statements = []
+        while True:
+            if self.sym == Tokens.letToken:
+                self.next()
+                statements.append(self.assignment())
+            elif self.sym == Tokens.callToken:
+                self.next()
+                statements.append(self.funcCall())
+            elif self.sym == Tokens.ifToken:
+                self.next()
+                statements.append(self.ifStatement())
+            elif self.sym == Tokens.whileToken:
+                self.next()
+                statements.append(self.whileStatement())
+
+            if self.sym in [Tokens.elseToken, Tokens.fiToken, Tokens.odToken, Tokens.endToken]:
+                break
+            else:
+                self.CheckFor(Tokens.semiToken)
+        return tuple(statements)
+
+    def assignment(self):
+        # assignment = “let” designator “<-” expression
+        ident = self.sym
+        if ident not in self.symbols:
+            raise SyntaxError(f"Undeclared variable {self.t.GetTokenStr(ident)} at {self.ErrorLocation()}.")
+        target = self.designator()
+        self.CheckFor(Tokens.becomesToken)
+        return Assignment(target, self.expression())
+
+    def designator(self):
+        # designator = ident{ "[" expression "]" }
+        ident = self.sym
+        self.next()
+        if self.symbols.IsScalar(ident):
+            return Designator(ident)
+        indices = []
+        for _ in self.symbols.Lookup(ident).dims:
+            self.CheckFor(Tokens.openbracketToken)
+            indices.append(self.expression())
+            self.CheckFor(Tokens.closebracketToken)
+        return Designator(ident, tuple(indices))
+
+    def funcCall(self):
+        # funcCall = “call” ident [2 “(“ [expression { “,” expression } ] “)” ].
+        func = self.sym
+        if func == Tokens.inputNumToken or func == Tokens.outputNewLineToken:
+            self.next()
+            if self.sym == Tokens.openparenToken:
+                self.next()
+                self.CheckFor(Tokens.closeparenToken)
+            return FuncCall(func, ())
+        elif func == Tokens.outputNumToken:
+            self.next()
+            self.CheckFor(Tokens.openparenToken)
+            arg = self.expression()
+            self.CheckFor(Tokens.closeparenToken)
+            return FuncCall(func, (arg,))
+        raise SyntaxError(f'Undefined function {self.t.GetTokenStr(func)} at {self.ErrorLocation()}')
+
+    def ifStatement(self):
+        # ifStatement = “if” relation “then” statSequence [ “else” statSequence ] “fi”.
+        relation = self.relation()
+        self.CheckFor(Tokens.thenToken)
+        thenSeq = self.statSequence()
+        elseSeq = None
+        if self.sym == Tokens.elseToken:
+            self.next()
+            elseSeq = self.statSequence()
+        self.CheckFor(Tokens.fiToken)
+        return IfStatement(relation, thenSeq, elseSeq)
+
+    def whileStatement(self):
+        # whileStatement = "while" relation "do" statSequence "od"
+        relation = self.relation()
+        self.CheckFor(Tokens.doToken)
+        body = self.statSequence()
+        self.CheckFor(Tokens.odToken)
+        return WhileStatement(relation, body)
+
+    def relation(self):
+        # relation = expression relOp expression
+        left = self.expression()
+        if self.sym not in self.relOp:
+            raise SyntaxError(f'Expected relOp, got {self.t.GetTokenStr(self.sym)} at {self.ErrorLocation()}')
+        relOp = self.sym
+        self.next()
+        return Relation(relOp, left, self.expression())
+
+    def expression(self):
+        # expression = term {(“+” | “-”) term}
+        node = self.term()
+        while self.sym == Tokens.plusToken or self.sym == Tokens.minusToken:
+            op = self.binaryOp[self.sym]
+            self.next()
+            node = BinaryOp(op, node, self.term())
+        return node
+
+    def term(self):
+        # term = factor { (“*” | “/”) factor}
+        node = self.factor()
+        while self.sym == Tokens.timesToken or self.sym == Tokens.divToken:
+            op = self.binaryOp[self.sym]
+            self.next()
+            node = BinaryOp(op, node, self.factor())
+        return node
+
+    def factor(self):
+        # factor = designator | number | “(“ expression “)” | funcCall
+        if self.sym == Tokens.number:
+            node = Number(self.t.lastNum)
+            self.next()
+        elif self.sym > 255:
+            if self.sym not in self.symbols:
+                raise SyntaxError(f"Undeclared variable {self.t.GetTokenStr(self.sym)} at {self.ErrorLocation()}.")
+            node = self.designator()
+        elif self.sym == Tokens.openparenToken:
+            self.next()
+            node = Group(self.expression())
+            self.CheckFor(Tokens.closeparenToken)
+        elif self.sym == Tokens.callToken:
+            self.next()
+            node = self.funcCall()
+        else:
+            raise SyntaxError(f'Expected expression, got {self.t.GetTokenStr(self.sym)} at {self.ErrorLocation()}')
+        return node
+
+
+def RunFrames(frame):
+    """
+    Runs generator frames on an explicit stack instead of the Python call stack.
+    A frame yields another frame to call it and is sent back that frame's return value,
+    so nesting depth is limited only by memory.
+    :param frame: the outermost generator
+    :return: its return value
+    """
+    stack = [frame]
+    value = None
+    while stack:
+        try:
+            callee = stack[-1].send(value)
+        except StopIteration as result:
+            stack.pop()
+            value = result.value
+        else:
+            stack.append(callee)
+            value = None
+    return value
+
+
+class StackTreeBuilder(TreeBuilder):
+    """
+    TreeBuilder whose grammar rules are generator frames run by RunFrames, so deeply nested
+    if/while statements and parenthesized expressions do not hit Python's recursion limit.
+    Builds the same tree as TreeBuilder.
+    """
+
+    def build(self):
+        return RunFrames(self.computation())
+
+    def computation(self):
+        # computation = "main" { varDecl } { funcDecl } "{"" statSequence "}" ".".
+        self.next()
+        self.CheckFor(Tokens.mainToken)
+        decls = self.declarations()
+        self.CheckFor(Tokens.beginToken)
+        body = yield self.statSequence()
+        self.CheckFor(Tokens.endToken)
+        self.CheckFor(Tokens.periodToken)
+        return Computation(decls, body, self.t)
+
+    def statSequence(self):
+        # statSequence = statement { “;” statement } [ “;” ]
+        statements = []
+        while True:
+            if self.sym == Tokens.letToken:
+                self.next()
+                statements.append((yield self.assignment()))
+            elif self.sym == Tokens.callToken:
+                self.next()
+                statements.append((yield self.funcCall()))
+            elif self.sym == Tokens.ifToken:
+                self.next()
+                statements.append((yield self.ifStatement()))
+            elif self.sym == Tokens.whileToken:
+                self.next()
+                statements.append((yield self.whileStatement()))
+
+            if self.sym in [Tokens.elseToken, Tokens.fiToken, Tokens.odToken, Tokens.endToken]:
+                break
+            else:
+                self.CheckFor(Tokens.semiToken)
+        return tuple(statements)
+
+    def assignment(self):
+        # assignment = “let” designator “<-” expression
+        ident = self.sym
+        if ident not in self.symbols:
+            raise SyntaxError(f"Undeclared variable {self.t.GetTokenStr(ident)} at {self.ErrorLocation()}.")
+        target = yield self.designator()
+        self.CheckFor(Tokens.becomesToken)
+        return Assignment(target, (yield self.expression()))
+
+    def designator(self):
+        # designator = ident{ "[" expression "]" }
+        ident = self.sym
+        self.next()
+        if self.symbols.IsScalar(ident):
+            return Designator(ident)
+        indices = []
+        for _ in self.symbols.Lookup(ident).dims:
+            self.CheckFor(Tokens.openbracketToken)
+            indices.append((yield self.expression()))
+            self.CheckFor(Tokens.closebracketToken)
+        return Designator(ident, tuple(indices))
+
+    def funcCall(self):
+        # funcCall = “call” ident [2 “(“ [expression { “,” expression } ] “)” ].
+        func = self.sym
+        if func == Tokens.inputNumToken or func == Tokens.outputNewLineToken:
+            self.next()
+            if self.sym == Tokens.openparenToken:
+                self.next()
+                self.CheckFor(Tokens.closeparenToken)
+            return FuncCall(func, ())
+        elif func == Tokens.outputNumToken:
+            self.next()
+            self.CheckFor(Tokens.openparenToken)
+            arg = yield self.expression()
+            self.CheckFor(Tokens.closeparenToken)
+            return FuncCall(func, (arg,))
+        raise SyntaxError(f'Undefined function {self.t.GetTokenStr(func)} at {self.ErrorLocation()}')
+
+    def ifStatement(self):
+        # ifStatement = “if” relation “then” statSequence [ “else” statSequence ] “fi”.
+        relation = yield self.relation()
+        self.CheckFor(Tokens.thenToken)
+        thenSeq = yield self.statSequence()
+        elseSeq = None
+        if self.sym == Tokens.elseToken:
+            self.next()
+            elseSeq = yield self.statSequence()
+        self.CheckFor(Tokens.fiToken)
+        return IfStatement(relation, thenSeq, elseSeq)
+
+    def whileStatement(self):
+        # whileStatement = "while" relation "do" statSequence "od"
+        relation = yield self.relation()
+        self.CheckFor(Tokens.doToken)
+        body = yield self.statSequence()
+        self.CheckFor(Tokens.odToken)
+        return WhileStatement(relation, body)
+
+    def relation(self):
+        # relation = expression relOp expression
+        left = yield self.expression()
+        if self.sym not in self.relOp:
+            raise SyntaxError(f'Expected relOp, got {self.t.GetTokenStr(self.sym)} at {self.ErrorLocation()}')
+        relOp = self.sym
+        self.next()
+        return Relation(relOp, left, (yield self.expression()))
+
+    def expression(self):
+        # expression = term {(“+” | “-”) term}
+        node = yield self.term()
+        while self.sym == Tokens.plusToken or self.sym == Tokens.minusToken:
+            op = self.binaryOp[self.sym]
+            self.next()
+            node = BinaryOp(op, node, (yield self.term()))
+        return node
+
+    def term(self):
+        # term = factor { (“*” | “/”) factor}
+        node = yield self.factor()
+        while self.sym == Tokens.timesToken or self.sym == Tokens.divToken:
+            op = self.binaryOp[self.sym]
+            self.next()
+            node = BinaryOp(op, node, (yield self.factor()))
+        return node
+
+    def factor(self):
+        # factor = designator | number | “(“ expression “)” | funcCall
+        if self.sym == Tokens.number:
+            node = Number(self.t.lastNum)
+            self.next()
+        elif self.sym > 255:
+            if self.sym not in self.symbols:
+                raise SyntaxError(f"Undeclared variable {self.t.GetTokenStr(self.sym)} at {self.ErrorLocation()}.")
+            node = yield self.designator()
+        elif self.sym == Tokens.openparenToken:
+            self.next()
+            node = Group((yield self.expression()))
+            self.CheckFor(Tokens.closeparenToken)
+        elif self.sym == Tokens.callToken:
+            self.next()
+            node = yield self.funcCall()
+        else:
+            raise SyntaxError(f'Expected expression, got {self.t.GetTokenStr(self.sym)} at {self.ErrorLocation()}')
+        return node
+
+
+def BuildTree(filepath: str = None, bulkLex=False, source=None, identPool=None, explicitStack=False):
+    """
+    Parses a program into a syntax tree, which can be lowered to SSA any number of times
+    :param filepath: path of the program, ignored when source is given
+    :param source: in-memory program (str, bytes or file object)
+    :param explicitStack: parse with StackTreeBuilder, for programs nested deeper than the recursion limit
+    :return: the Computation node
+    """
+    if explicitStack:
+        builder = StackTreeBuilder(filepath, bulkLex, source, identPool)
+    else:
+        builder = TreeBuilder(filepath, bulkLex, source, identPool)
+    try:
+        return builder.build()
+    finally:
+        builder.close()
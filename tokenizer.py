@@ -1,9 +1,140 @@
+import codecs
+import mmap
+import os
+import re
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from types import MappingProxyType
+
+import tracing
 from tokens import Tokens
+from tracing import TraceEvent
+
+# files at least this large are memory-mapped instead of read into a string
+MMAP_THRESHOLD = 1 << 20
+
+# static lexer tables, shared read-only by every Tokenizer
+TOKEN_TABLE = MappingProxyType({
+    'OutputNewLine': Tokens.outputNewLineToken,
+    'OutputNum': Tokens.outputNumToken,
+    'InputNum': Tokens.inputNumToken,
+
+    'main': Tokens.mainToken,
+    '{': Tokens.beginToken,
+
+    'procedure': Tokens.procToken,
+    'function': Tokens.funcToken,
+    'void': Tokens.voidToken,
+    'array': Tokens.arrToken,
+    'var': Tokens.varToken,
+
+    'return': Tokens.returnToken,
+    'while': Tokens.whileToken,
+    'if': Tokens.ifToken,
+    'call': Tokens.callToken,
+    'let': Tokens.letToken,
+
+    'else': Tokens.elseToken,
+
+    'fi': Tokens.fiToken,
+    'od': Tokens.odToken,
+    '}': Tokens.endToken,
+
+    ';': Tokens.semiToken,
+
+    'ident': Tokens.ident,
+    'number': Tokens.number,
+
+    '(': Tokens.openparenToken,
+
+    'do': Tokens.doToken,
+    'then': Tokens.thenToken,
+    '<-': Tokens.becomesToken,
+
+    ')': Tokens.closeparenToken,
+    ']': Tokens.closebracketToken,
+    '[': Tokens.openbracketToken,
+    ',': Tokens.commaToken,
+    '.': Tokens.periodToken,
+
+    '>': Tokens.gtrToken,
+    '<=': Tokens.leqToken,
+    '>=': Tokens.geqToken,
+    '<': Tokens.lssToken,
+    '!=': Tokens.neqToken,
+    '==': Tokens.eqlToken,
+
+    '-': Tokens.minusToken,
+    '+': Tokens.plusToken,
+
+    '/': Tokens.divToken,
+    '*': Tokens.timesToken
+})
+
+INV_TOKEN_TABLE = MappingProxyType({v: k for k, v in TOKEN_TABLE.items()})
+
+GLOBAL_KEYWORDS = frozenset(['main', 'procedure', 'function', 'void', 'array', 'var',
+                             'return', 'while', 'if', 'call', 'let', 'fi', 'od', 'do', 'then'])
+
+SINGLE_SYMBOLS = frozenset(['*', '/', '+', '-', '.', ',', '[', ']', '(', ')', ';', '{', '}'])
+
+FIRST_IDENT_ID = max([t.value for t in Tokens]) + 1  # for new identifiers
+
+
+class IdentPool:
+    """
+    Interns identifier names to token IDs.
+    A pool can be passed to many Tokenizers so repeated compilations reuse the same IDs and strings.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.names = {}
+        self.idCounter = FIRST_IDENT_ID
+
+    def Intern(self, name):
+        token = self.ids.get(name)
+        if token is None:
+            name = sys.intern(name)
+            token = self.idCounter
+            self.ids[name] = token
+            self.names[token] = name
+            self.idCounter += 1
+        return token
+
+    def GetName(self, token):
+        return self.names[token]
+
+
+class LineIndex:
+    """
+    Line-start offset table for a source buffer, built once.
+    Offsets are converted to (line, column) by bisection only when a diagnostic needs them.
+    """
+
+    def __init__(self, buffer):
+        newline = '\n' if isinstance(buffer, str) else b'\n'
+        self.lineStarts = array('i', [0])
+        i = buffer.find(newline)
+        while i != -1:
+            self.lineStarts.append(i + 1)
+            i = buffer.find(newline, i + 1)
+
+    def GetPosition(self, offset):
+        """
+        :param offset: offset into the source buffer
+        :return: (line, column), both starting at 1
+        """
+        line = bisect_right(self.lineStarts, offset) - 1
+        return line + 1, offset - self.lineStarts[line] + 1
 
 
 class FileReader:
     def __init__(self, filepath):
+        self.filepath = filepath
         self.f = open(filepath, 'r')
+        self.pos = 0
         self.__EOF = False
         self.__ERROR = False
 
@@ -17,8 +148,15 @@ class FileReader:
         sym = self.f.read(1)
         if sym == '':
             self.__EOF = True
+        else:
+            self.pos += 1
         return sym
 
+    def GetSourceBuffer(self):
+        # only needed for diagnostics, so re-read the file instead of keeping it around
+        with open(self.filepath, 'r') as f:
+            return f.read()
+
     def Error(self, errorMsg=""):
         self.__ERROR = True
         print(f'Error {errorMsg}')
@@ -28,82 +166,164 @@ class FileReader:
         self.f.close()
 
 
-class Tokenizer:
-    def __init__(self, filepath, debug=False):
-        self.f = FileReader(filepath)
-        self.sym = ""
-        self.__next()
-        self.tokenTable = {
-            'OutputNewLine': Tokens.outputNewLineToken,
-            'OutputNum': Tokens.outputNumToken,
-            'InputNum': Tokens.inputNumToken,
+class BufferedFileReader:
+    """
+    Loads the whole source once and walks an index over it instead of calling read(1) per character.
+    Large files are memory-mapped so they are never copied into a Python string.
+    GetNext/Error/close behave exactly like FileReader.
+    """
+
+    def __init__(self, filepath, useMmap=False):
+        self.f = open(filepath, 'rb')
+        self.mm = None
+        if useMmap:
+            try:
+                self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                self.mm = None
+        if self.mm is not None:
+            self.buffer = self.mm
+            # decodes like the str path does, the map itself only yields byte values
+            self.decoder = codecs.getincrementaldecoder('utf-8')()
+        else:
+            self.buffer = self.f.read().decode().replace('\r\n', '\n')
+        self.pos = 0
+        self.length = len(self.buffer)
+        self.__EOF = False
+        self.__ERROR = False
 
-            'main': Tokens.mainToken,
-            '{': Tokens.beginToken,
+    def GetNext(self):
+        if self.__ERROR:
+            return 0
 
-            'procedure': Tokens.procToken,
-            'function': Tokens.funcToken,
-            'void': Tokens.voidToken,
-            'array': Tokens.arrToken,
-            'var': Tokens.varToken,
+        if self.__EOF:
+            return ''
 
-            'return': Tokens.returnToken,
-            'while': Tokens.whileToken,
-            'if': Tokens.ifToken,
-            'call': Tokens.callToken,
-            'let': Tokens.letToken,
+        if self.pos >= self.length:
+            self.__EOF = True
+            return ''
+        sym = self.buffer[self.pos]
+        self.pos += 1
+        if self.mm is not None:
+            if sym >= 0x80:
+                # bytes of a multi-byte character are fed to the decoder until it completes one
+                sym = self.decoder.decode(self.buffer[self.pos - 1:self.pos])
+                while not sym:
+                    final = self.pos >= self.length
+                    sym = self.decoder.decode(self.buffer[self.pos:self.pos + 1], final)
+                    self.pos += 1
+                return sym
+            sym = chr(sym)
+            # match text mode newline translation
+            if sym == '\r' and self.pos < self.length and self.buffer[self.pos] == 10:
+                sym = '\n'
+                self.pos += 1
+        return sym
 
-            'else': Tokens.elseToken,
+    def Error(self, errorMsg=""):
+        self.__ERROR = True
+        print(f'Error {errorMsg}')
+        self.close()
 
-            'fi': Tokens.fiToken,
-            'od': Tokens.odToken,
-            '}': Tokens.endToken,
+    def close(self):
+        if self.mm is not None and not self.mm.closed:
+            self.mm.close()
+        self.f.close()
 
-            ';': Tokens.semiToken,
+    def GetSourceBuffer(self):
+        if self.mm is not None and self.mm.closed:
+            with open(self.f.name, 'rb') as f:
+                return f.read()
+        return self.buffer
 
-            'ident': Tokens.ident,
-            'number': Tokens.number,
 
-            '(': Tokens.openparenToken,
+class StringReader:
+    """
+    Walks an index over source text that is already in memory (a string, bytes or a read file object).
+    GetNext/Error/close behave exactly like FileReader.
+    """
 
-            'do': Tokens.doToken,
-            'then': Tokens.thenToken,
-            '<-': Tokens.becomesToken,
+    def __init__(self, source):
+        self.buffer = ReadSource(source)
+        self.pos = 0
+        self.length = len(self.buffer)
+        self.__EOF = False
+        self.__ERROR = False
 
-            ')': Tokens.closeparenToken,
-            ']': Tokens.closebracketToken,
-            '[': Tokens.openbracketToken,
-            ',': Tokens.commaToken,
-            '.': Tokens.periodToken,
+    def GetNext(self):
+        if self.__ERROR:
+            return 0
 
-            '>': Tokens.gtrToken,
-            '<=': Tokens.leqToken,
-            '>=': Tokens.geqToken,
-            '<': Tokens.lssToken,
-            '!=': Tokens.neqToken,
-            '==': Tokens.eqlToken,
+        if self.__EOF:
+            return ''
+
+        if self.pos >= self.length:
+            self.__EOF = True
+            return ''
+        sym = self.buffer[self.pos]
+        self.pos += 1
+        return sym
+
+    def Error(self, errorMsg=""):
+        self.__ERROR = True
+        print(f'Error {errorMsg}')
+        self.close()
+
+    def close(self):
+        pass
+
+    def GetSourceBuffer(self):
+        return self.buffer
 
-            '-': Tokens.minusToken,
-            '+': Tokens.plusToken,
 
-            '/': Tokens.divToken,
-            '*': Tokens.timesToken
-        }
+def ReadSource(source):
+    """
+    Normalizes in-memory source into text
+    :param source: str, bytes-like object, or file object (e.g. sys.stdin) opened in text or binary mode
+    :return: the source text with newlines translated like text-mode reads
+    """
+    if hasattr(source, 'read'):
+        source = source.read()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = bytes(source).decode()
+    return source.replace('\r\n', '\n')
 
-        self.invTokenTable = {v: k for k, v in self.tokenTable.items()}
 
-        self.globalKeyword = ['main', 'procedure', 'function', 'void', 'array', 'var',
-                              'return', 'while', 'if', 'call', 'let', 'fi', 'od', 'do', 'then']
+def OpenFileReader(filepath, buffered=True):
+    """
+    Picks a reader for the file: a memory map for large files, a single read otherwise
+    :param filepath: path of the source file
+    :param buffered: set false to fall back to the per-character FileReader
+    :return: a reader exposing GetNext/Error/close
+    """
+    if not buffered:
+        return FileReader(filepath)
+    return BufferedFileReader(filepath, useMmap=os.path.getsize(filepath) >= MMAP_THRESHOLD)
 
-        self.singleSymbol = ['*', '/', '+', '-', '.', ',', '[', ']', '(', ')', ';', '{', '}']
+
+class Tokenizer:
+    def __init__(self, filepath, debug=False, buffered=True, source=None, pool=None):
+        # pool: optional IdentPool shared across tokenizers
+        # source, if given, is in-memory text/bytes/file object and filepath is ignored
+        if source is not None:
+            self.f = StringReader(source)
+        else:
+            self.f = OpenFileReader(filepath, buffered)
+        self.sym = ""
+        self.__next()
+        self.pool = pool if pool is not None else IdentPool()
 
         self.lastNum = None
         self.lastId = None
+        # offset of the start of the last token returned, see GetPosition
+        self.tokenOffset = 0
+        self.lineIndex = None
 
-        self.idCounter = max([t.value for t in Tokens]) + 1  # for new identifiers
         self.EOF = False
         self.ERROR = False
         self.debug = debug
+        self.trace = tracing.GetTracer()
 
     def __next(self):
         self.sym = self.f.GetNext()
@@ -112,7 +332,28 @@ class Tokenizer:
         self.f.close()
 
     def GetTokenStr(self, token):
-        return self.invTokenTable[token]
+        if token >= FIRST_IDENT_ID:
+            return self.pool.GetName(token)
+        return INV_TOKEN_TABLE[token]
+
+    def GetPosition(self, offset=None):
+        """
+        Line and column of a source offset, the last token returned by default.
+        The line table is only built the first time this is called.
+        :return: (line, column), both starting at 1
+        """
+        if offset is None:
+            offset = self.tokenOffset
+        if self.lineIndex is None:
+            self.lineIndex = LineIndex(self.f.GetSourceBuffer())
+        return self.lineIndex.GetPosition(offset)
+
+    def LookupIdent(self, name):
+        # keywords map to their token, new identifiers get an ID from the pool
+        token = TOKEN_TABLE.get(name)
+        if token is None:
+            token = self.pool.Intern(name)
+        return token
 
     def GetNext(self):
         if self.EOF:
@@ -129,12 +370,13 @@ class Tokenizer:
             self.__next()
         if self.sym == "#":
             while self.sym != "\n":
-                print(self.sym)
                 self.__next()
             self.__next()
         while self.sym.isspace():  # self.sym in [" ","\n", "\t"]:
             self.__next()
 
+        # the current symbol has already been read, so the token starts one character back
+        self.tokenOffset = self.f.pos - 1 if self.sym else self.f.pos
         token = 0
         if self.sym == '':
             self.EOF = True
@@ -142,7 +384,7 @@ class Tokenizer:
 
         # starting symbol is number
         elif self.sym in "0123456789":
-            token = self.tokenTable['number']
+            token = Tokens.number
             result = int(self.sym)
             self.__next()
             # keep collecting until non-numeric char occurs
@@ -160,17 +402,7 @@ class Tokenizer:
                 result += self.sym
                 self.__next()
             # print(result)
-            if result in self.globalKeyword:
-                token = self.tokenTable[result]
-            else:
-                if result in self.tokenTable:
-                    token = self.tokenTable[result]
-                else:
-                    token = self.idCounter
-                    self.tokenTable[result] = self.idCounter
-                    self.invTokenTable[self.idCounter] = result
-                    self.idCounter += 1
-
+            token = self.LookupIdent(result)
             self.lastId = token
 
         else:  # otherwise it's a special symbol
@@ -178,9 +410,9 @@ class Tokenizer:
             if self.sym == "":
                 self.EOF = True
                 token = Tokens.eofToken
-            elif self.sym in self.singleSymbol:
+            elif self.sym in SINGLE_SYMBOLS:
                 result = self.sym
-                token = self.tokenTable[self.sym]
+                token = TOKEN_TABLE[self.sym]
                 self.__next()
             else:  # deals with token subsets of [20-25] and 40, relops and '<-'
                 firstChar = self.sym
@@ -188,16 +420,16 @@ class Tokenizer:
                 if firstChar in '=!<>':
                     self.__next()
                     if self.sym == '=':  # '==', '!=', '>=', '<='
-                        token = self.tokenTable[firstChar + self.sym]
+                        token = TOKEN_TABLE[firstChar + self.sym]
                         result += self.sym
                         self.__next()
                     elif self.sym == '-':  # '<-'
-                        token = self.tokenTable[firstChar + self.sym]
+                        token = TOKEN_TABLE[firstChar + self.sym]
                         result += self.sym
                         self.__next()
                     else:
                         if firstChar == '>' or firstChar == '<':  # '<', '>'
-                            token = self.tokenTable[firstChar]
+                            token = TOKEN_TABLE[firstChar]
                         else:
                             # otherwise we have '!' and '='
                             # 	which is not valid on its own
@@ -209,6 +441,226 @@ class Tokenizer:
 
         if self.debug:
             print(result, token)
+        if self.trace.tokens:
+            self.trace.Emit(TraceEvent.TOKENS, f'{result} {token} @{self.tokenOffset}')
+        return token
+
+
+# one alternative per token class, tried in order; 'error' catches any stray character
+# words are a letter then letters and digits, as Tokenizer checks them with isalpha and isalnum
+TOKEN_PATTERN = re.compile(r"""
+      (?P<skip>\s+|\#[^\n]*)
+    | (?P<number>[0-9]+)
+    | (?P<word>[^\W\d_][^\W_]*)
+    | (?P<relop><-|==|!=|<=|>=|<|>)
+    | (?P<symbol>[-*/+.,\[\]();{}])
+    | (?P<error>.)
+""", re.VERBOSE | re.DOTALL)
+
+# largest value a TokenStream keeps inline
+MAX_VALUE = (1 << 63) - 1
+
+
+class TokenStream:
+    """
+    Compact token stream produced in one pass over the source.
+    codes, values and offsets are parallel arrays indexed by token position:
+        codes:   the Tokens value (or identifier ID)
+        values:  number literal for numbers, token code for words, -1 for symbols
+        offsets: start offset of the token in the source
+    Number literals that do not fit into values are kept in literals, the value of their token
+    is then -2 - their index there.
+    """
+
+    def __init__(self):
+        self.codes = array('i')
+        self.values = array('q')
+        self.offsets = array('i')
+        self.literals = []
+
+    def Append(self, code, value, offset):
+        self.codes.append(code)
+        self.values.append(self.Encode(value))
+        self.offsets.append(offset)
+
+    def Encode(self, value):
+        # entry of values for a lexed value
+        if value > MAX_VALUE:
+            self.literals.append(value)
+            return -1 - len(self.literals)
+        return value
+
+    def Value(self, index):
+        # lexed value of the token at index
+        value = self.values[index]
+        return self.literals[-2 - value] if value < -1 else value
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class BulkTokenizer(Tokenizer):
+    """
+    Tokenizes the whole source with a compiled master regex up front.
+    GetNext then walks an index over the resulting TokenStream, so callers see the same
+    token codes and lastNum/lastId updates as with Tokenizer.
+    """
+
+    def __init__(self, filepath, debug=False, source=None, pool=None):
+        if source is not None:
+            source = ReadSource(source)
+        else:
+            with open(filepath, 'r') as f:
+                source = f.read()
+        self.pool = pool if pool is not None else IdentPool()
+
+        self.lastNum = None
+        self.lastId = None
+
+        self.EOF = False
+        self.ERROR = False
+        self.debug = debug
+        self.trace = tracing.GetTracer()
+
+        self.source = source
+        self.tokenOffset = 0
+        self.lineIndex = None
+
+        self.stream = self.Tokenize(source)
+        self.pos = 0
+
+    def Tokenize(self, source):
+        stream = TokenStream()
+        for token, value, offset in self.LexFrom(source, 0):
+            stream.Append(token, value, offset)
+        return stream
+
+    def LexFrom(self, source, pos):
+        """
+        Yields (token, value, offset) from pos to the end of source.
+        Stops after an error token, otherwise ends with the EOF token.
+        """
+        for m in TOKEN_PATTERN.finditer(source, pos):
+            kind = m.lastgroup
+            if kind == 'skip':
+                continue
+            if kind == 'number':
+                yield Tokens.number, int(m.group()), m.start()
+            elif kind == 'word':
+                name = m.group()
+                if not name[0].isalpha():
+                    # numeric characters other than decimal digits, e.g. '²', cannot start an identifier
+                    yield Tokens.errorToken, -1, m.start()
+                    return
+                token = self.LookupIdent(name)
+                yield token, token, m.start()
+            elif kind == 'error':
+                # '!' and '=' are not valid on their own, nor is anything else unmatched
+                yield Tokens.errorToken, -1, m.start()
+                return
+            else:
+                yield TOKEN_TABLE[m.group()], -1, m.start()
+        yield Tokens.eofToken, -1, len(source)
+
+    def Relex(self, start, end, text):
+        """
+        Replaces source[start:end] with text and re-lexes only the damaged region.
+        Lexing restarts at the beginning of the edited line (no token or comment spans a newline)
+        and stops as soon as a new token lines up with an old one past the edit, since the
+        regex lexer carries no state between tokens.
+        :return: index of the first token that may have changed
+        """
+        oldSource = self.source
+        source = oldSource[:start] + text + oldSource[end:]
+        delta = len(text) - (end - start)
+        editEnd = start + len(text)
+        codes = self.stream.codes
+        values = self.stream.values
+        offsets = self.stream.offsets
+
+        restart = oldSource.rfind('\n', 0, start) + 1
+        # the stream ends at an error token, so an edit past it still re-lexes from the error
+        first = min(bisect_left(offsets, restart), len(offsets) - 1)
+        restart = min(restart, offsets[first])
+        oldIdx = first
+        newCodes = array('i')
+        newValues = array('q')
+        newOffsets = array('i')
+        synced = False
+        for token, value, offset in self.LexFrom(source, restart):
+            if offset >= editEnd:
+                # skip old tokens that the edit swallowed
+                while oldIdx < len(offsets) and offsets[oldIdx] + delta < offset:
+                    oldIdx += 1
+                if oldIdx < len(offsets) and offsets[oldIdx] + delta == offset \
+                        and codes[oldIdx] == token and self.stream.Value(oldIdx) == value:
+                    synced = True
+                    break
+            newCodes.append(token)
+            newValues.append(self.stream.Encode(value))
+            newOffsets.append(offset)
+        if not synced:
+            oldIdx = len(codes)
+
+        codes[first:oldIdx] = newCodes
+        values[first:oldIdx] = newValues
+        offsets[first:oldIdx] = newOffsets
+        if delta:
+            for i in range(first + len(newOffsets), len(offsets)):
+                offsets[i] += delta
+
+        self.source = source
+        self.lineIndex = None
+        return first
+
+    def Seek(self, index):
+        # restarts reading at token index
+        self.pos = index
+        self.EOF = False
+        self.ERROR = False
+
+    def close(self):
+        pass
+
+    def GetPosition(self, offset=None):
+        if offset is None:
+            offset = self.tokenOffset
+        if self.lineIndex is None:
+            self.lineIndex = LineIndex(self.source)
+        return self.lineIndex.GetPosition(offset)
+
+    def GetNext(self):
+        if self.EOF:
+            if self.debug:
+                print("", Tokens.eofToken)
+            return Tokens.eofToken
+        elif self.ERROR:
+            return Tokens.errorToken
+
+        token = self.stream.codes[self.pos]
+        value = self.stream.Value(self.pos)
+        self.tokenOffset = self.stream.offsets[self.pos]
+        self.pos += 1
+        if token == Tokens.eofToken:
+            self.EOF = True
+        elif token == Tokens.errorToken:
+            self.ERROR = True
+        elif token == Tokens.number:
+            self.lastNum = value
+        elif value != -1:
+            self.lastId = token
+
+        if self.debug or self.trace.tokens:
+            if token == Tokens.number:
+                result = value
+            elif token >= FIRST_IDENT_ID:
+                result = self.pool.GetName(token)
+            else:
+                result = INV_TOKEN_TABLE.get(token, '')
+            if self.debug:
+                print(result, token)
+            if self.trace.tokens:
+                self.trace.Emit(TraceEvent.TOKENS, f'{result} {token} @{self.tokenOffset}')
         return token
 
 
@@ -0,0 +1,72 @@
+import sys
+from enum import IntFlag
+
+
+class TraceEvent(IntFlag):
+    NONE = 0
+    TOKENS = 1  # every token returned by the tokenizer
+    PARSE = 2  # grammar rules entered by the parser
+    IR = 4  # instructions created by SSA.DefineIR
+    CSE = 8  # instructions reused by SSA.DefineIR instead of created
+    OPT = 16  # instructions changed by the optimization passes run after parsing
+    ALL = 31
+
+
+class Tracer:
+    """
+    Structured trace output with one on/off flag per event category.
+    Callers check the flag before building a message, e.g.
+        if self.trace.ir:
+            self.trace.Emit(TraceEvent.IR, f'...')
+    so a disabled category costs a single attribute lookup.
+    """
+
+    def __init__(self, events=TraceEvent.NONE, out=None):
+        self.events = TraceEvent(events)
+        self.tokens = bool(self.events & TraceEvent.TOKENS)
+        self.parse = bool(self.events & TraceEvent.PARSE)
+        self.ir = bool(self.events & TraceEvent.IR)
+        self.cse = bool(self.events & TraceEvent.CSE)
+        self.opt = bool(self.events & TraceEvent.OPT)
+        self.ownsOut = False
+        if out is None:
+            out = sys.stdout
+        elif isinstance(out, str):
+            out = open(out, 'w')
+            self.ownsOut = True
+        self.out = out
+
+    def Emit(self, event, message):
+        self.out.write(f'{event.name.lower()}: {message}\n')
+
+    def close(self):
+        if self.ownsOut:
+            self.out.close()
+            self.ownsOut = False
+
+
+# disabled until EnableTracing is called
+tracer = Tracer()
+
+
+def GetTracer():
+    return tracer
+
+
+def EnableTracing(events=TraceEvent.ALL, out=None):
+    """
+    Turns on tracing for Tokenizers, Parsers and SSAs created afterwards
+    :param events: TraceEvent flags to record
+    :param out: file path or file object to stream to, stdout by default
+    :return: the new tracer
+    """
+    global tracer
+    tracer.close()
+    tracer = Tracer(events, out)
+    return tracer
+
+
+def DisableTracing():
+    global tracer
+    tracer.close()
+    tracer = Tracer()